@@ -36,6 +36,7 @@ export function AdvancedSearch({ onResultSelect }: AdvancedSearchProps) {
     queryFn: async () => {
       const params = {
         q: searchQuery,
+        include_count: 'true',
         ...filters,
       };
       const response = await searchAPI.searchTransactions(params);
@@ -196,6 +196,8 @@ export const auditLogAPI = {
 export const searchAPI = {
   searchTransactions: (params: any) => api.get('/fund-flows/search/transactions/', { params }),
   searchProjects: (params: any) => api.get('/fund-flows/search/projects/', { params }),
+  searchAll: (params: any) => api.get('/search/', { params }),
+  autocomplete: (params: any) => api.get('/search/autocomplete/', { params }),
 };
 
 // Analytics API
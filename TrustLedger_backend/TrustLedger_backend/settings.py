@@ -90,6 +90,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts so concurrent
+            # writers queue on the busy timeout instead of failing.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # A file-backed test database so concurrency tests can use
+            # real per-thread connections.
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -150,7 +161,7 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
-        'rest_framework.filters.SearchFilter',
+        'core.filters.FullTextSearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
 }
@@ -183,6 +194,27 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Anomaly detection defaults (see core.services.AnomalyDetectionService)
+ANOMALY_DETECTION = {
+    'SPIKE_WINDOW_DAYS': 30,
+    'SPIKE_MULTIPLIER': 3,
+    # 'mean' compares against the average daily spend, 'median' against median + k * MAD
+    'SPIKE_BASELINE': 'mean',
+    'SPIKE_MIN_TRANSACTIONS': 2,
+    # On-write scoring against ProjectFlowStatistics (see core.services.StreamingAnomalyDetector)
+    'STREAM_ENABLED': True,
+    'STREAM_MIN_OBSERVATIONS': 5,
+    'STREAM_RECENT_SIZE': 20,
+}
+
+# Dashboard KPIs are served from analytics.DashboardMetrics snapshots captured
+# by `manage.py capture_dashboard_metrics`; schedule it at least this often (in
+# seconds), or reads find the newest snapshot too old and capture one
+# themselves. Snapshots older than the retention period are pruned by the same
+# command.
+DASHBOARD_SNAPSHOT_MAX_AGE = 300
+DASHBOARD_SNAPSHOT_RETENTION_DAYS = 30
+
 # CORS Configuration
 CORS_ALLOW_ALL_ORIGINS = True
 
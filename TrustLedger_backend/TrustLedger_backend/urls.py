@@ -6,6 +6,7 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from core.views import autocomplete_view, global_search_view
 
 # Swagger configuration
 schema_view = get_schema_view(
@@ -39,6 +40,8 @@ urlpatterns = [
     path('api/documents/', include('documents.urls')),
     path('api/analytics/', include('analytics.urls')),
     path('api/ai/', include('ai_services.urls')),
+    path('api/search/', global_search_view, name='global-search'),
+    path('api/search/autocomplete/', autocomplete_view, name='autocomplete'),
 ]
 
 # Serve media files in development
@@ -1,12 +1,12 @@
 from django.contrib import admin
 from .models import (
     DashboardMetrics, SearchFilter, Report, Notification, 
-    SystemConfiguration, AuditLog
+    SystemConfiguration, AuditLog, SpendingFact
 )
 
 @admin.register(DashboardMetrics)
 class DashboardMetricsAdmin(admin.ModelAdmin):
-    list_display = ['calculated_at', 'total_budget', 'utilized_funds', 'active_projects', 'anomalies_count']
+    list_display = ['calculated_at', 'total_budget', 'utilized_funds', 'active_projects', 'anomalies_count', 'trust_score', 'is_stale']
     list_filter = ['calculated_at']
     ordering = ['-calculated_at']
 
@@ -48,4 +48,11 @@ class AnalyticsAuditLogAdmin(admin.ModelAdmin):
     list_filter = ['action', 'model_name', 'timestamp']
     search_fields = ['user__username', 'model_name', 'object_repr']
     ordering = ['-timestamp']
-    raw_id_fields = ['user']
\ No newline at end of file
+    raw_id_fields = ['user']
+
+@admin.register(SpendingFact)
+class SpendingFactAdmin(admin.ModelAdmin):
+    list_display = ['month', 'source_type', 'department', 'project', 'category', 'status', 'total_amount', 'transaction_count']
+    list_filter = ['source_type', 'status', 'category', 'month']
+    ordering = ['-month']
+    raw_id_fields = ['department', 'project']
@@ -0,0 +1,25 @@
+"""
+Management command to capture a dashboard metrics snapshot (run on a schedule, e.g. cron)
+"""
+from django.core.management.base import BaseCommand
+from analytics.services import DashboardSnapshotService
+
+
+class Command(BaseCommand):
+    help = 'Capture a DashboardMetrics snapshot of the dashboard KPIs and prune old snapshots'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days', type=int, default=None,
+            help='Delete snapshots older than this many days (default: settings.DASHBOARD_SNAPSHOT_RETENTION_DAYS)',
+        )
+    
+    def handle(self, *args, **options):
+        snapshot = DashboardSnapshotService.capture()
+        pruned = DashboardSnapshotService.prune(options['keep_days'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Captured dashboard metrics snapshot {snapshot.pk} at {snapshot.calculated_at:%Y-%m-%d %H:%M:%S}; '
+                f'pruned {pruned} old snapshot(s).'
+            )
+        )
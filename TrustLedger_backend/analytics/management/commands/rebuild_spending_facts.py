@@ -0,0 +1,31 @@
+"""
+Management command to rebuild the spending fact cube from the transaction tables
+"""
+from django.core.management.base import BaseCommand
+from analytics.services import SpendingCubeService
+
+
+class Command(BaseCommand):
+    help = 'Recompute SpendingFact rows from project spending records and fund flows'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            action='append',
+            dest='projects',
+            help='Only rebuild the given project ID (repeatable)',
+        )
+        parser.add_argument(
+            '--department',
+            type=int,
+            action='append',
+            dest='departments',
+            help='Only rebuild the given department ID, including its projects (repeatable)',
+        )
+    
+    def handle(self, *args, **options):
+        rebuilt = SpendingCubeService.rebuild(options['projects'], options['departments'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {rebuilt} spending facts.')
+        )
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:15
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_dashboard_metrics_snapshot'),
+        ('core', '0007_department_trust_score_dirty'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendingFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_type', models.CharField(choices=[('spending', 'Project Spending'), ('fund_flow', 'Fund Flow')], max_length=20)),
+                ('category', models.CharField(blank=True, max_length=20)),
+                ('month', models.DateField(help_text='First day of the transaction month')),
+                ('status', models.CharField(max_length=20)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('transaction_count', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spending_facts', to='core.department')),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='spending_facts', to='core.project')),
+            ],
+            options={
+                'ordering': ['month', 'department', 'project', 'category'],
+                'indexes': [models.Index(fields=['month', 'source_type'], name='spending_fact_month'), models.Index(fields=['department', 'month'], name='spending_fact_department')],
+                'constraints': [models.UniqueConstraint(models.F('source_type'), models.F('department'), django.db.models.functions.comparison.Coalesce(models.F('project'), models.Value(0)), models.F('category'), models.F('month'), models.F('status'), name='unique_spending_fact_cell')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:13
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_searchfilter_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dashboardmetrics',
+            name='is_stale',
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_spending_facts(apps, schema_editor):
+    """Build the fact cube from the stored transactions once, as SpendingCubeService.rebuild()"""
+    FundFlow = apps.get_model('fund_flows', 'FundFlow')
+    ProjectSpending = apps.get_model('core', 'ProjectSpending')
+    SpendingFact = apps.get_model('analytics', 'SpendingFact')
+    
+    groups = [
+        ('spending', ProjectSpending.objects.all(), 'project__department_id', 'project_id', F('category')),
+        ('fund_flow', FundFlow.objects.filter(target_project__isnull=False),
+         'target_project__department_id', 'target_project_id', None),
+        ('fund_flow', FundFlow.objects.filter(target_project__isnull=True, target_department__isnull=False),
+         'target_department_id', None, None),
+    ]
+    rebuilt = []
+    for source_type, queryset, department_field, project_field, category in groups:
+        dimensions = {'fact_month': TruncMonth('transaction_date'), 'fact_department': F(department_field)}
+        if project_field:
+            dimensions['fact_project'] = F(project_field)
+        if category is not None:
+            dimensions['fact_category'] = category
+        rows = queryset.order_by().values(**dimensions, fact_status=F('status')).annotate(
+            total=Sum('amount'), count=Count('id'),
+        )
+        rebuilt.extend(
+            SpendingFact(
+                source_type=source_type,
+                department_id=row['fact_department'],
+                project_id=row.get('fact_project'),
+                category=row.get('fact_category', ''),
+                month=row['fact_month'],
+                status=row['fact_status'],
+                total_amount=row['total'],
+                transaction_count=row['count'],
+            )
+            for row in rows
+        )
+    SpendingFact.objects.all().delete()
+    SpendingFact.objects.bulk_create(rebuilt, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_dashboardmetrics_remove_is_stale'),
+        ('core', '0008_search_index'),
+        ('fund_flows', '0010_backfill_project_flow_statistics'),
+    ]
+    
+    # Run once here rather than on every deploy; `manage.py rebuild_spending_facts` repairs drift
+    operations = [
+        migrations.RunPython(backfill_spending_facts, migrations.RunPython.noop),
+    ]
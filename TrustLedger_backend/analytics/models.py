@@ -1,17 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 User = get_user_model()
 
 
 class DashboardMetrics(models.Model):
-    """Model for storing dashboard metrics"""
+    """Model for storing dashboard metrics snapshots (see analytics.services.DashboardSnapshotService)"""
     total_budget = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(0)])
     utilized_funds = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(0)])
     active_projects = models.PositiveIntegerField()
     anomalies_count = models.PositiveIntegerField()
-    calculated_at = models.DateTimeField(auto_now_add=True)
+    departments_count = models.PositiveIntegerField(default=0)
+    users_count = models.PositiveIntegerField(default=0)
+    documents_count = models.PositiveIntegerField(default=0)
+    fund_flows_count = models.PositiveIntegerField(default=0)
+    trust_score = models.PositiveIntegerField(default=0)
+    community_feedback_count = models.PositiveIntegerField(default=0)
+    pending_verifications = models.PositiveIntegerField(default=0)
+    calculated_at = models.DateTimeField(auto_now_add=True, db_index=True)
     
     class Meta:
         ordering = ['-calculated_at']
@@ -19,6 +31,12 @@ class DashboardMetrics(models.Model):
     def __str__(self):
         return f"Metrics - {self.calculated_at.strftime('%Y-%m-%d %H:%M')}"
     
+    @property
+    def is_stale(self):
+        """Older than settings.DASHBOARD_SNAPSHOT_MAX_AGE, i.e. the capture schedule has fallen behind"""
+        max_age = getattr(settings, 'DASHBOARD_SNAPSHOT_MAX_AGE', 300)
+        return self.calculated_at < timezone.now() - timedelta(seconds=max_age)
+    
     @property
     def utilization_percentage(self):
         """Calculate fund utilization percentage"""
@@ -38,6 +56,7 @@ class SearchFilter(models.Model):
     verification_status = models.CharField(max_length=50, blank=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_filters')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=False)
     
     class Meta:
@@ -45,6 +64,18 @@ class SearchFilter(models.Model):
     
     def __str__(self):
         return f"{self.name} by {self.created_by.username}"
+    
+    def search_filters(self):
+        """The stored configuration as SearchService.search_transactions filters"""
+        filters = {
+            'department_id': int(self.department_id) if self.department_id.isdigit() else None,
+            'status': self.status,
+            'min_amount': self.min_amount,
+            'max_amount': self.max_amount,
+            'year': int(self.year) if self.year.isdigit() else None,
+            'verification_status': self.verification_status,
+        }
+        return {name: value for name, value in filters.items() if value not in (None, '')}
 
 
 class AuditLog(models.Model):
@@ -145,4 +176,50 @@ class SystemConfiguration(models.Model):
         ordering = ['key']
     
     def __str__(self):
-        return f"{self.key}: {self.value}"
\ No newline at end of file
+        return f"{self.key}: {self.value}"
+
+
+class SpendingFact(models.Model):
+    """
+    Pre-aggregated spending and fund flow totals for analytics.
+    
+    One row per (source type, department, project, category, month, status)
+    holding the summed amount and number of transactions. Rows are adjusted
+    by deltas as ProjectSpending and FundFlow records change (see
+    analytics.signals) and can be rebuilt with `manage.py rebuild_spending_facts`.
+    """
+    SOURCE_TYPES = [
+        ('spending', 'Project Spending'),
+        ('fund_flow', 'Fund Flow'),
+    ]
+    DIMENSIONS = ['source_type', 'department', 'project', 'category', 'month', 'status']
+    
+    source_type = models.CharField(max_length=20, choices=SOURCE_TYPES)
+    department = models.ForeignKey('core.Department', on_delete=models.CASCADE, related_name='spending_facts')
+    # Null for fund flows that target a department directly
+    project = models.ForeignKey('core.Project', on_delete=models.CASCADE, null=True, blank=True, related_name='spending_facts')
+    # Spending category; blank for fund flows
+    category = models.CharField(max_length=20, blank=True)
+    month = models.DateField(help_text="First day of the transaction month")
+    status = models.CharField(max_length=20)
+    total_amount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    transaction_count = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['month', 'department', 'project', 'category']
+        constraints = [
+            # Coalesce so department-level rows (no project) are unique too
+            models.UniqueConstraint(
+                models.F('source_type'), models.F('department'),
+                Coalesce(models.F('project'), models.Value(0)),
+                models.F('category'), models.F('month'), models.F('status'),
+                name='unique_spending_fact_cell',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['month', 'source_type'], name='spending_fact_month'),
+            models.Index(fields=['department', 'month'], name='spending_fact_department'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_source_type_display()} {self.month:%Y-%m} {self.status}: ₹{self.total_amount}"
@@ -8,12 +8,15 @@ from .models import (
 class DashboardMetricsSerializer(serializers.ModelSerializer):
     """Serializer for DashboardMetrics model"""
     utilization_percentage = serializers.ReadOnlyField()
+    is_stale = serializers.ReadOnlyField()
     
     class Meta:
         model = DashboardMetrics
         fields = [
             'id', 'total_budget', 'utilized_funds', 'active_projects',
-            'anomalies_count', 'utilization_percentage', 'calculated_at'
+            'anomalies_count', 'departments_count', 'users_count', 'documents_count',
+            'fund_flows_count', 'trust_score', 'community_feedback_count',
+            'pending_verifications', 'utilization_percentage', 'is_stale', 'calculated_at'
         ]
         read_only_fields = ['calculated_at']
 
@@ -27,9 +30,9 @@ class SearchFilterSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'department_id', 'status', 'min_amount', 'max_amount',
             'year', 'verification_status', 'created_by', 'created_by_name',
-            'created_at', 'is_public'
+            'created_at', 'updated_at', 'is_public'
         ]
-        read_only_fields = ['created_at']
+        read_only_fields = ['created_at', 'updated_at']
 
 
 class SearchFilterCreateSerializer(serializers.ModelSerializer):
@@ -147,6 +150,7 @@ class AnalyticsDataSerializer(serializers.Serializer):
     users_count = serializers.IntegerField()
     documents_count = serializers.IntegerField()
     fund_flows_count = serializers.IntegerField()
+    as_of = serializers.DateTimeField(source='calculated_at')
 
 
 class DepartmentPerformanceSerializer(serializers.Serializer):
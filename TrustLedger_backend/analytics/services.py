@@ -0,0 +1,406 @@
+"""
+Services for analytics: dashboard KPI snapshots, the spending fact cube and saved searches
+"""
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, F, Max, Q, Sum
+from django.db.models.functions import TruncMonth, TruncQuarter, TruncYear
+from django.utils import timezone
+
+from accounts.models import User
+from core.cache import versioned_key
+from core.models import CommunityFeedback, Department, ImpactMetric, Project, ProjectSpending
+from core.search_index import SEARCH_SOURCES
+from core.services import SearchService
+from documents.models import Document
+from fund_flows.models import Anomaly, FundFlow, TrustIndicator
+from .models import DashboardMetrics, SpendingFact
+
+
+class DashboardSnapshotService:
+    """
+    Materialize the dashboard KPIs into DashboardMetrics rows.
+    
+    Snapshots are captured by `manage.py capture_dashboard_metrics`, run on a
+    schedule, which also prunes old ones. Dashboards read the newest row, and
+    capture a fresh one themselves when the schedule has fallen behind.
+    """
+    
+    @staticmethod
+    def compute():
+        """Compute every dashboard KPI into an unsaved snapshot"""
+        departments = Department.objects.aggregate(
+            total_budget=Sum('budget'),
+            departments_count=Count('id'),
+        )
+        projects = Project.objects.aggregate(
+            utilized_funds=Sum('spent'),
+            active_projects=Count('id', filter=Q(status='active')),
+        )
+        trust_score = TrustIndicator.objects.latest_per_department().aggregate(
+            average=Avg('overall_score')
+        )['average']
+        
+        return DashboardMetrics(
+            total_budget=departments['total_budget'] or 0,
+            utilized_funds=projects['utilized_funds'] or 0,
+            active_projects=projects['active_projects'],
+            anomalies_count=Anomaly.objects.filter(resolved=False).count(),
+            departments_count=departments['departments_count'],
+            users_count=User.objects.count(),
+            documents_count=Document.objects.count(),
+            fund_flows_count=FundFlow.objects.count(),
+            trust_score=int(trust_score or 0),
+            community_feedback_count=CommunityFeedback.objects.filter(status='pending').count(),
+            pending_verifications=ImpactMetric.objects.filter(verified=False).count(),
+            calculated_at=timezone.now(),
+        )
+    
+    @staticmethod
+    def capture():
+        """Store a new snapshot of every dashboard KPI"""
+        snapshot = DashboardSnapshotService.compute()
+        snapshot.save()
+        return snapshot
+    
+    @staticmethod
+    def prune(keep_days=None):
+        """Delete snapshots older than keep_days, always keeping the newest; returns the number deleted"""
+        if keep_days is None:
+            keep_days = getattr(settings, 'DASHBOARD_SNAPSHOT_RETENTION_DAYS', 30)
+        newest = DashboardMetrics.objects.order_by('-calculated_at').values_list('pk', flat=True).first()
+        deleted, _ = DashboardMetrics.objects.filter(
+            calculated_at__lt=timezone.now() - timedelta(days=keep_days)
+        ).exclude(pk=newest).delete()
+        return deleted
+    
+    @staticmethod
+    def latest(max_age=None):
+        """
+        The newest stored snapshot no older than max_age seconds.
+        
+        Past settings.DASHBOARD_SNAPSHOT_MAX_AGE (or with none stored) a fresh
+        snapshot is captured; past an explicit max_age the KPIs are computed
+        from live data without being stored.
+        """
+        explicit = max_age is not None
+        if not explicit:
+            max_age = getattr(settings, 'DASHBOARD_SNAPSHOT_MAX_AGE', 300)
+        snapshot = DashboardMetrics.objects.order_by('-calculated_at').first()
+        if snapshot is None or snapshot.calculated_at < timezone.now() - timedelta(seconds=max_age):
+            if explicit:
+                return DashboardSnapshotService.compute()
+            return DashboardSnapshotService.capture()
+        return snapshot
+    
+    @staticmethod
+    def latest_for_request(request):
+        """latest() honouring an optional ?max_age=<seconds> override"""
+        max_age = request.query_params.get('max_age')
+        if max_age is not None:
+            if not max_age.isdigit():
+                raise ValueError('max_age must be a non-negative number of seconds')
+            max_age = int(max_age)
+        return DashboardSnapshotService.latest(max_age)
+
+
+class SpendingCubeService:
+    """
+    Maintain and query the SpendingFact cube.
+    
+    Writes are folded in as deltas keyed by the fact dimensions, so a save
+    touches one or two cube rows; rebuild() recomputes any slice from the
+    source tables with one GROUP BY per source.
+    """
+    SOURCES = {ProjectSpending: 'spending', FundFlow: 'fund_flow'}
+    GROUP_BY = ['department', 'project', 'category', 'month', 'status', 'source_type']
+    GRANULARITIES = {'month': TruncMonth, 'quarter': TruncQuarter, 'year': TruncYear}
+    
+    @staticmethod
+    def fact_key(model, values, departments):
+        """
+        Cube key for one record's fact field values, or None if it adds no fact.
+        
+        departments maps project ids to their department ids.
+        """
+        month = model._meta.get_field('transaction_date').to_python(values['transaction_date']).replace(day=1)
+        if model is ProjectSpending:
+            project_id = values['project_id']
+            return ('spending', departments.get(project_id), project_id, values['category'], month, values['status'])
+        
+        project_id = values['target_project_id']
+        if project_id:
+            return ('fund_flow', departments.get(project_id), project_id, '', month, values['status'])
+        if values['target_department_id']:
+            return ('fund_flow', values['target_department_id'], None, '', month, values['status'])
+        return None
+    
+    @classmethod
+    def apply_changes(cls, model, changes):
+        """
+        Fold (old, new) pairs of FACT_FIELDS value dicts into the cube.
+        
+        old is None for new records and new is None for deleted ones.
+        """
+        project_field = 'project_id' if model is ProjectSpending else 'target_project_id'
+        project_ids = {
+            values[project_field]
+            for pair in changes for values in pair
+            if values is not None and values[project_field]
+        }
+        departments = dict(Project.objects.filter(pk__in=project_ids).values_list('pk', 'department_id'))
+        
+        deltas = defaultdict(lambda: [Decimal('0'), 0])
+        for old, new in changes:
+            for values, sign in ((old, -1), (new, 1)):
+                if values is None:
+                    continue
+                key = cls.fact_key(model, values, departments)
+                if key is None or key[1] is None:
+                    continue
+                amount = model._meta.get_field('amount').to_python(values['amount']) or Decimal('0')
+                deltas[key][0] += sign * amount
+                deltas[key][1] += sign
+        cls.apply_deltas(deltas)
+    
+    @staticmethod
+    def apply_deltas(deltas):
+        """Add {key: (amount, count)} to the cube, creating cells as needed"""
+        for key, (amount, count) in deltas.items():
+            if not amount and not count:
+                continue
+            source_type, department_id, project_id, category, month, fact_status = key
+            cell = SpendingFact.objects.filter(
+                source_type=source_type, department_id=department_id, project_id=project_id,
+                category=category, month=month, status=fact_status,
+            )
+            changes = {'total_amount': F('total_amount') + amount, 'transaction_count': F('transaction_count') + count}
+            if not cell.update(**changes):
+                try:
+                    with transaction.atomic():
+                        SpendingFact.objects.create(
+                            source_type=source_type, department_id=department_id, project_id=project_id,
+                            category=category, month=month, status=fact_status,
+                            total_amount=amount, transaction_count=count,
+                        )
+                except IntegrityError:
+                    # A concurrent writer created the cell first
+                    cell.update(**changes)
+            if count < 0:
+                cell.filter(transaction_count__lte=0).delete()
+    
+    @classmethod
+    def rebuild(cls, project_ids=None, department_ids=None):
+        """
+        Recompute the cube from ProjectSpending and FundFlow.
+        
+        With no arguments the whole cube is rebuilt; otherwise only the facts
+        of the given projects and departments. Returns the number of cells.
+        """
+        facts = SpendingFact.objects.all()
+        spending = ProjectSpending.objects.all()
+        project_flows = FundFlow.objects.filter(target_project__isnull=False)
+        department_flows = FundFlow.objects.filter(target_project__isnull=True, target_department__isnull=False)
+        if project_ids is not None or department_ids is not None:
+            project_ids = list(project_ids or [])
+            department_ids = list(department_ids or [])
+            facts = facts.filter(Q(project__in=project_ids) | Q(department__in=department_ids))
+            spending = spending.filter(Q(project__in=project_ids) | Q(project__department__in=department_ids))
+            project_flows = project_flows.filter(
+                Q(target_project__in=project_ids) | Q(target_project__department__in=department_ids)
+            )
+            department_flows = department_flows.filter(target_department__in=department_ids)
+        
+        groups = [
+            ('spending', spending, 'project__department_id', 'project_id', F('category')),
+            ('fund_flow', project_flows, 'target_project__department_id', 'target_project_id', None),
+            ('fund_flow', department_flows, 'target_department_id', None, None),
+        ]
+        rebuilt = []
+        for source_type, queryset, department_field, project_field, category in groups:
+            dimensions = {'fact_month': TruncMonth('transaction_date'), 'fact_department': F(department_field)}
+            if project_field:
+                dimensions['fact_project'] = F(project_field)
+            if category is not None:
+                dimensions['fact_category'] = category
+            rows = queryset.order_by().values(**dimensions, fact_status=F('status')).annotate(
+                total=Sum('amount'), count=Count('id'),
+            )
+            rebuilt.extend(
+                SpendingFact(
+                    source_type=source_type,
+                    department_id=row['fact_department'],
+                    project_id=row.get('fact_project'),
+                    category=row.get('fact_category', ''),
+                    month=row['fact_month'],
+                    status=row['fact_status'],
+                    total_amount=row['total'],
+                    transaction_count=row['count'],
+                )
+                for row in rows
+            )
+        
+        with transaction.atomic():
+            facts.delete()
+            SpendingFact.objects.bulk_create(rebuilt, batch_size=1000)
+        return len(rebuilt)
+    
+    @classmethod
+    def query(cls, facts, group_by=('month',), granularity='month'):
+        """
+        Sum facts over the requested dimensions.
+        
+        Rows carry the dimension values plus total_amount and
+        transaction_count; department and project rows also carry names.
+        """
+        fields, expressions = [], {}
+        for dimension in group_by:
+            if dimension == 'month':
+                expressions['period'] = cls.GRANULARITIES[granularity]('month')
+            elif dimension in ('department', 'project'):
+                fields.append(dimension)
+                expressions[f'{dimension}_name'] = F(f'{dimension}__name')
+            else:
+                fields.append(dimension)
+        
+        rows = facts.order_by().values(*fields, **expressions).annotate(
+            total=Sum('total_amount'),
+            count=Sum('transaction_count'),
+        ).order_by(*(['period'] if 'period' in expressions else []), *fields)
+        return [
+            {**{name: row[name] for name in [*fields, *expressions]},
+             'total_amount': row['total'], 'transaction_count': row['count']}
+            for row in rows
+        ]
+    
+    @staticmethod
+    def parse_month(value):
+        """date for a YYYY-MM string, raising ValueError on bad input"""
+        try:
+            year, month = value.split('-')
+            return date(int(year), int(month), 1)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid month "{value}". Use YYYY-MM.')
+
+
+class SavedSearchService:
+    """
+    Run saved SearchFilters against fund flows with cached result sets.
+    
+    The flows matching a filter are cached as one sorted array of keys
+    packing (transaction_date, id), so pages in SearchService order are
+    slices of it. Each cached set remembers the newest updated_at it has
+    seen; the next run re-checks only the flows updated since and patches
+    the set, and a run with no writes in between reads no flows at all.
+    
+    Deletes leave no updated_at behind, so deleting a flow bumps the
+    namespace and the next run of every filter starts over, as does
+    editing the filter. A write committed out of updated_at order can be
+    missed until the cached set expires after TIMEOUT.
+    
+    Users who may not see every flow page the filter's matches with one
+    keyset query that applies their visibility instead.
+    """
+    CACHE_NAMESPACE = 'saved_searches'
+    TIMEOUT = 3600
+    ID_BITS = 40
+    ID_MASK = (1 << ID_BITS) - 1
+    
+    @classmethod
+    def key(cls, flow_id, transaction_date):
+        return (transaction_date.toordinal() << cls.ID_BITS) | flow_id
+    
+    @classmethod
+    def split_key(cls, key):
+        """(transaction_date, flow id) packed in key; raises ValueError if it holds no valid date"""
+        ordinal = key >> cls.ID_BITS
+        if not 1 <= ordinal <= date.max.toordinal():
+            raise ValueError('key holds no valid date')
+        return date.fromordinal(ordinal), key & cls.ID_MASK
+    
+    @staticmethod
+    def matching(search_filter):
+        """Fund flows matching a saved filter, unordered"""
+        return SearchService.search_transactions('', search_filter.search_filters()).order_by()
+    
+    @classmethod
+    def results(cls, search_filter):
+        """
+        (sorted keys of the matching flows, how they were obtained); the
+        second is 'full', 'incremental' or 'cached'.
+        """
+        cache_key = versioned_key(cls.CACHE_NAMESPACE, f'{search_filter.pk}:{search_filter.updated_at.timestamp()}')
+        state = cache.get(cache_key)
+        matching = cls.matching(search_filter)
+        
+        if state is None:
+            # Take the watermark first, so flows written during the scan are re-checked next time
+            watermark = FundFlow.objects.aggregate(latest=Max('updated_at'))['latest']
+            rows = matching.values_list('id', 'transaction_date').iterator(chunk_size=5000)
+            state = {'keys': array('q', sorted(cls.key(pk, day) for pk, day in rows)), 'watermark': watermark}
+            how = 'full'
+        else:
+            changed = FundFlow.objects.order_by()
+            if state['watermark'] is not None:
+                changed = changed.filter(updated_at__gt=state['watermark'])
+            updated = dict(changed.values_list('id', 'updated_at'))
+            if not updated:
+                return state['keys'], 'cached'
+            
+            hits = matching.filter(pk__in=changed.values('pk')).values_list('id', 'transaction_date')
+            keys = [key for key in state['keys'] if key & cls.ID_MASK not in updated]
+            keys.extend(cls.key(pk, day) for pk, day in hits)
+            state = {'keys': array('q', sorted(keys)), 'watermark': max(updated.values())}
+            how = 'incremental'
+        
+        cache.set(cache_key, state, cls.TIMEOUT)
+        return state['keys'], how
+    
+    @classmethod
+    def page(cls, keys, matching, user, cursor_key=None, size=20):
+        """
+        Up to size flows visible to user, newest first, that come before
+        cursor_key. Returns (flows, key of the last flow or None when
+        nothing follows it).
+        
+        keys are the cached results of the filter whose flows are matching.
+        """
+        if not (user.is_admin or user.is_auditor):
+            return cls._visible_page(matching, user, cursor_key, size)
+        
+        end = bisect_left(keys, cursor_key) if cursor_key is not None else len(keys)
+        flows = []
+        while end > 0 and len(flows) < size:
+            batch = keys[max(0, end - size):end][::-1]
+            found = FundFlow.objects.select_related(
+                'source', 'target_department', 'target_project__department'
+            ).in_bulk([key & cls.ID_MASK for key in batch])
+            for key in batch:
+                end -= 1
+                flow = found.get(key & cls.ID_MASK)
+                if flow is not None:
+                    flows.append(flow)
+                    if len(flows) == size:
+                        break
+        # The page stopped at keys[end]; earlier keys remain if end > 0
+        return flows, keys[end] if end > 0 else None
+    
+    @classmethod
+    def _visible_page(cls, matching, user, cursor_key, size):
+        """page() for a user who may see only some flows, in one query"""
+        queryset = SEARCH_SOURCES['fund_flow'].visible(matching, user)
+        if cursor_key is not None:
+            day, flow_id = cls.split_key(cursor_key)
+            queryset = queryset.filter(Q(transaction_date__lt=day) | Q(transaction_date=day, pk__lt=flow_id))
+        flows = list(queryset.order_by(*SearchService.TRANSACTION_ORDERING)[:size + 1])
+        if len(flows) <= size:
+            return flows, None
+        last = flows[size - 1]
+        return flows[:size], cls.key(last.pk, last.transaction_date)
@@ -0,0 +1,94 @@
+"""
+Signal handlers that keep the spending fact cube in step with transaction
+writes and invalidate saved search results on deletes
+"""
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.cache import bump_data_version
+from core.models import Department, Project, ProjectSpending
+from core.signals import transactions_bulk_changed
+from fund_flows.models import FundFlow
+from .models import SpendingFact
+from .services import SavedSearchService, SpendingCubeService
+
+
+@receiver(post_save, sender=ProjectSpending)
+@receiver(post_save, sender=FundFlow)
+def update_spending_facts(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Move the record's contribution between cube cells"""
+    if raw:
+        return
+    # save() snapshots the locked stored row before writing it
+    previous = getattr(instance, '_fact_snapshot', None)
+    current = {name: getattr(instance, name) for name in sender.FACT_FIELDS}
+    if previous is not None and update_fields is not None:
+        # Fields left out of update_fields keep their stored values
+        written = {sender._meta.get_field(name).attname for name in update_fields}
+        current = {name: value if name in written else previous[name] for name, value in current.items()}
+    if created:
+        SpendingCubeService.apply_changes(sender, [(None, current)])
+    elif previous is not None:
+        if previous != current:
+            SpendingCubeService.apply_changes(sender, [(previous, current)])
+    else:
+        # Saved without a snapshot of the stored row, so the old cell is unknown
+        _rebuild_facts_for(sender, current)
+    instance._fact_snapshot = None
+
+
+@receiver(pre_delete, sender=ProjectSpending)
+@receiver(pre_delete, sender=FundFlow)
+def snapshot_deleted_spending_facts(sender, instance, **kwargs):
+    """Read the stored fact fields under a row lock while the row still exists"""
+    instance._fact_snapshot = (
+        sender.objects.select_for_update().filter(pk=instance.pk).values(*sender.FACT_FIELDS).first()
+    )
+
+
+@receiver(post_delete, sender=ProjectSpending)
+@receiver(post_delete, sender=FundFlow)
+def remove_spending_facts(sender, instance, origin=None, **kwargs):
+    """Subtract a deleted record from its cube cell"""
+    # Facts of a deleted project or department cascade with it
+    if isinstance(origin, (Project, Department)) or getattr(origin, 'model', None) in (Project, Department):
+        return
+    previous = getattr(instance, '_fact_snapshot', None)
+    if previous is not None:
+        SpendingCubeService.apply_changes(sender, [(previous, None)])
+
+
+@receiver(transactions_bulk_changed)
+def apply_bulk_spending_facts(sender, changes, **kwargs):
+    """Fold bulk creates and status changes into the cube"""
+    if sender in SpendingCubeService.SOURCES:
+        SpendingCubeService.apply_changes(sender, changes)
+
+
+@receiver(post_save, sender=Project)
+def move_project_spending_facts(sender, instance, created, raw=False, **kwargs):
+    """A project moved to another department takes its facts along"""
+    if created or raw:
+        return
+    # Project.save() snapshots the locked stored row before writing it
+    previous = getattr(instance, '_rollup_snapshot', None)
+    if previous is None or previous[0] != instance.department_id:
+        SpendingFact.objects.filter(project=instance).exclude(
+            department_id=instance.department_id
+        ).update(department_id=instance.department_id)
+
+
+def _rebuild_facts_for(sender, values):
+    """Rebuild the facts of the project or department a record belongs to"""
+    if sender is ProjectSpending:
+        SpendingCubeService.rebuild(project_ids=[values['project_id']])
+    elif values['target_project_id']:
+        SpendingCubeService.rebuild(project_ids=[values['target_project_id']])
+    elif values['target_department_id']:
+        SpendingCubeService.rebuild(department_ids=[values['target_department_id']])
+
+
+@receiver(post_delete, sender=FundFlow)
+def invalidate_saved_search_results(sender, instance, **kwargs):
+    """A deleted flow leaves no updated_at to refresh from, so cached results start over"""
+    bump_data_version(SavedSearchService.CACHE_NAMESPACE)
@@ -5,6 +5,7 @@ urlpatterns = [
     # Search Filters
     path('search-filters/', views.SearchFilterListView.as_view(), name='search-filter-list'),
     path('search-filters/<int:pk>/', views.SearchFilterDetailView.as_view(), name='search-filter-detail'),
+    path('search-filters/<int:pk>/execute/', views.execute_search_filter_view, name='search-filter-execute'),
     
     # Audit Logs
     path('audit-logs/', views.AuditLogListView.as_view(), name='audit-log-list'),
@@ -26,4 +27,5 @@ urlpatterns = [
     
     # Analytics Dashboard
     path('dashboard/', views.analytics_dashboard_view, name='analytics-dashboard'),
+    path('spending-cube/', views.spending_cube_view, name='spending-cube'),
 ]
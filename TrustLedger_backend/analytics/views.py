@@ -1,12 +1,12 @@
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Avg, Q
+from django.db.models import Count, Avg, Q
 from django.utils import timezone
 from datetime import timedelta
 from .models import (
     DashboardMetrics, SearchFilter, AuditLog, Report, 
-    Notification, SystemConfiguration
+    Notification, SystemConfiguration, SpendingFact
 )
 from .serializers import (
     DashboardMetricsSerializer, SearchFilterSerializer, SearchFilterCreateSerializer,
@@ -15,10 +15,10 @@ from .serializers import (
     SystemConfigurationSerializer, SystemConfigurationUpdateSerializer,
     AnalyticsDataSerializer, DepartmentPerformanceSerializer, ProjectStatusSerializer
 )
-from core.models import Department, Project
-from fund_flows.models import Anomaly, TrustIndicator
-from documents.models import Document
-from accounts.models import User
+from .services import DashboardSnapshotService, SavedSearchService, SpendingCubeService
+from core.pagination import InvalidCursor, decode_cursor, encode_cursor
+from fund_flows.models import TrustIndicator
+from fund_flows.serializers import FundFlowListSerializer
 
 
 class SearchFilterListView(generics.ListCreateAPIView):
@@ -158,29 +158,87 @@ class SystemConfigurationDetailView(generics.RetrieveUpdateDestroyAPIView):
 @permission_classes([permissions.IsAuthenticated])
 def analytics_dashboard_view(request):
     """View for analytics dashboard data"""
-    # Calculate metrics
-    total_budget = Department.objects.aggregate(total=Sum('budget'))['total'] or 0
-    utilized_funds = Project.objects.aggregate(total=Sum('spent'))['total'] or 0
-    active_projects = Project.objects.filter(status='active').count()
-    anomalies_count = Anomaly.objects.filter(resolved=False).count()
-    departments_count = Department.objects.count()
-    users_count = User.objects.count()
-    documents_count = Document.objects.count()
-    
-    analytics_data = {
-        'total_budget': float(total_budget),
-        'utilized_funds': float(utilized_funds),
-        'active_projects': active_projects,
-        'anomalies_count': anomalies_count,
-        'departments_count': departments_count,
-        'users_count': users_count,
-        'documents_count': documents_count,
-    }
+    try:
+        snapshot = DashboardSnapshotService.latest_for_request(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = AnalyticsDataSerializer(analytics_data)
+    serializer = AnalyticsDataSerializer(snapshot)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def spending_cube_view(request):
+    """
+    Slice the spending fact cube.
+    
+    ?group_by= any of department, project, category, month, status, source_type
+    (comma separated, default month); ?granularity=month|quarter|year buckets the
+    month dimension; department, project, category, status, source_type (default
+    spending, or "all"), from and to (YYYY-MM) filter the facts.
+    """
+    user = request.user
+    params = request.query_params
+    
+    # Get facts based on user role
+    if user.is_admin or user.is_auditor:
+        facts = SpendingFact.objects.all()
+    elif user.is_department_head and user.department_id:
+        facts = SpendingFact.objects.filter(department_id=user.department_id)
+    else:
+        facts = SpendingFact.objects.filter(project__manager=user)
+    
+    group_by = [name for name in params.get('group_by', 'month').split(',') if name]
+    unknown = [name for name in group_by if name not in SpendingCubeService.GROUP_BY]
+    if unknown or not group_by:
+        return Response(
+            {'error': f'group_by must be a comma separated list of: {", ".join(SpendingCubeService.GROUP_BY)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    granularity = params.get('granularity', 'month')
+    if granularity not in SpendingCubeService.GRANULARITIES:
+        return Response(
+            {'error': f'granularity must be one of: {", ".join(SpendingCubeService.GRANULARITIES)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    source_type = params.get('source_type', 'spending')
+    source_types = [value for value, _ in SpendingFact.SOURCE_TYPES]
+    if source_type not in source_types + ['all']:
+        return Response(
+            {'error': f'source_type must be one of: {", ".join(source_types + ["all"])}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if source_type != 'all':
+        facts = facts.filter(source_type=source_type)
+    for name in ('department', 'project'):
+        if params.get(name):
+            if not params[name].isdigit():
+                return Response({'error': f'{name} must be an ID'}, status=status.HTTP_400_BAD_REQUEST)
+            facts = facts.filter(**{f'{name}_id': int(params[name])})
+    for name in ('category', 'status'):
+        if params.get(name):
+            facts = facts.filter(**{name: params[name]})
+    try:
+        if params.get('from'):
+            facts = facts.filter(month__gte=SpendingCubeService.parse_month(params['from']))
+        if params.get('to'):
+            facts = facts.filter(month__lte=SpendingCubeService.parse_month(params['to']))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    rows = SpendingCubeService.query(facts, group_by, granularity)
+    for row in rows:
+        row['total_amount'] = float(row['total_amount'] or 0)
+    return Response({
+        'group_by': group_by,
+        'granularity': granularity,
+        'source_type': source_type,
+        'results': rows,
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def notification_mark_read_view(request, notification_id):
@@ -209,4 +267,57 @@ def notification_mark_all_read_view(request):
 def unread_notifications_count_view(request):
     """View for getting unread notifications count"""
     count = Notification.objects.filter(user=request.user, is_read=False).count()
-    return Response({'unread_count': count}, status=status.HTTP_200_OK)
\ No newline at end of file
+    return Response({'unread_count': count}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def execute_search_filter_view(request, pk):
+    """
+    Run a saved search filter against fund flows, a page at a time.
+    
+    The matching IDs are cached per filter and refreshed from flows updated
+    since the last run (see SavedSearchService). ?page_size= (max 200) and
+    the next_cursor of the previous page walk the results.
+    """
+    user = request.user
+    try:
+        search_filter = SearchFilter.objects.get(pk=pk)
+    except SearchFilter.DoesNotExist:
+        return Response({'error': 'Search filter not found'}, status=status.HTTP_404_NOT_FOUND)
+    if not (user.is_admin or user.is_auditor or search_filter.is_public or search_filter.created_by_id == user.id):
+        return Response({'error': 'Search filter not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        page_size = int(request.GET.get('page_size', 20))
+    except ValueError:
+        page_size = 0
+    if not 1 <= page_size <= 200:
+        return Response({'error': 'page_size must be between 1 and 200'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    cursor_key = None
+    if request.GET.get('cursor'):
+        try:
+            [cursor_key] = decode_cursor(request.GET['cursor'], 1)
+        except InvalidCursor:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            SavedSearchService.split_key(cursor_key)
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    keys, refreshed = SavedSearchService.results(search_filter)
+    flows, next_key = SavedSearchService.page(
+        keys, SavedSearchService.matching(search_filter), user, cursor_key, page_size
+    )
+    
+    data = {
+        'filter': {'id': search_filter.id, 'name': search_filter.name, **search_filter.search_filters()},
+        'results': FundFlowListSerializer(flows, many=True).data,
+        'next_cursor': encode_cursor([next_key]) if next_key is not None else None,
+        'refreshed': refreshed,
+    }
+    if user.is_admin or user.is_auditor:
+        # Everyone else may see only part of the matches
+        data['count'] = len(keys)
+    return Response(data, status=status.HTTP_200_OK)
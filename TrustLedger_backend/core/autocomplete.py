@@ -0,0 +1,275 @@
+"""
+Prefix autocomplete over project, department, fund source and user names.
+
+Every name is indexed under each of its word suffixes ("Ring Road Repair"
+under "ring road repair", "road repair" and "repair"), folded the way the
+full-text index folds words, in one sorted list; whole names are also kept
+in a second one. A lookup is a bisect to the first name, then the first
+term, starting with the typed prefix followed by a short scan of each.
+What each caller may see is decided from attributes held next to the
+names, so a suggestion request runs no queries at all.
+
+The index is built lazily in each process with one query per model.
+Writes patch the local index in place and append the change to the
+namespace's change log in core.cache, which other processes replay on
+their next lookup (see core.signals).
+"""
+import threading
+from bisect import bisect_left, insort
+
+from django.contrib.auth import get_user_model
+
+from fund_flows.models import FundSource
+from .cache import bump_data_version, change_sequence, changes_since, data_version, log_change
+from .models import Department, Project
+from .search_index import normalize, terms
+
+CACHE_NAMESPACE = 'autocomplete'
+
+KINDS = ['project', 'department', 'fund_source', 'user']
+
+DEFAULT_LIMIT = 10
+# Visible matches gathered from each list before ranking, and the most
+# entries read from each whatever their visibility; together they bound the
+# cost of one-letter prefixes
+SCAN_LIMIT = 500
+READ_LIMIT = 20000
+# How far behind the change log an index may fall before a rebuild is
+# cheaper than replaying it
+MAX_REPLAY = 1024
+
+
+def _project_entry(project):
+    return project.name, {'department_id': project.department_id, 'is_public': project.is_public}
+
+
+def _department_entry(department):
+    return department.name, {}
+
+
+def _fund_source_entry(source):
+    return source.name, {}
+
+
+def _user_entry(user):
+    name = f'{user.first_name} {user.last_name}'.strip()
+    label = f'{name} ({user.username})' if name else user.username
+    return label, {'department_id': user.department_id}
+
+
+ENTRIES = {
+    'project': _project_entry,
+    'department': _department_entry,
+    'fund_source': _fund_source_entry,
+    'user': _user_entry,
+}
+
+# Fields that change a kind's indexed name or visibility
+INDEXED_FIELDS = {
+    'project': {'name', 'department', 'department_id', 'is_public'},
+    'department': {'name'},
+    'fund_source': {'name'},
+    'user': {'first_name', 'last_name', 'username', 'department', 'department_id'},
+}
+
+
+def kind_of(model):
+    return {
+        Project: 'project',
+        Department: 'department',
+        FundSource: 'fund_source',
+        get_user_model(): 'user',
+    }.get(model)
+
+
+def _querysets():
+    return {
+        'project': Project.objects.only('id', 'name', 'department_id', 'is_public'),
+        'department': Department.objects.only('id', 'name'),
+        'fund_source': FundSource.objects.only('id', 'name'),
+        'user': get_user_model().objects.only('id', 'username', 'first_name', 'last_name', 'department_id'),
+    }
+
+
+class AutocompleteIndex:
+    """Sorted (term, kind, pk) lists with the label and visibility of every object"""
+    
+    def __init__(self, version=None, sequence=0):
+        self.version = version
+        self.sequence = sequence  # last change log entry applied
+        self.terms = []           # sorted (term, kind, pk) for every word suffix
+        self.names = []           # sorted (term, kind, pk) for whole names only
+        self.objects = {}         # (kind, pk) -> (label, attributes, terms)
+    
+    @classmethod
+    def build(cls, version=None, sequence=0):
+        index = cls(version, sequence)
+        for kind, queryset in _querysets().items():
+            for obj in queryset.iterator(chunk_size=5000):
+                index._store(kind, obj.pk, *ENTRIES[kind](obj))
+        index.terms.sort()
+        index.names.sort()
+        return index
+    
+    @staticmethod
+    def _suffixes(label):
+        words = [normalize(word) for word in terms(label)]
+        return {' '.join(words[position:]) for position in range(len(words))}
+    
+    @staticmethod
+    def _name(suffixes):
+        """The whole-name term among a label's suffixes"""
+        return max(suffixes, key=len) if suffixes else None
+    
+    def _store(self, kind, pk, label, attributes):
+        suffixes = self._suffixes(label)
+        self.objects[kind, pk] = (label, attributes, suffixes)
+        self.terms.extend((term, kind, pk) for term in suffixes)
+        if suffixes:
+            self.names.append((self._name(suffixes), kind, pk))
+    
+    def put(self, kind, pk, label, attributes):
+        """Add or replace one object"""
+        self.remove(kind, pk)
+        suffixes = self._suffixes(label)
+        self.objects[kind, pk] = (label, attributes, suffixes)
+        for term in suffixes:
+            insort(self.terms, (term, kind, pk))
+        if suffixes:
+            insort(self.names, (self._name(suffixes), kind, pk))
+    
+    def remove(self, kind, pk):
+        stored = self.objects.pop((kind, pk), None)
+        if stored is None:
+            return
+        suffixes = stored[2]
+        entries = [(self.terms, term) for term in suffixes]
+        if suffixes:
+            entries.append((self.names, self._name(suffixes)))
+        for sorted_entries, term in entries:
+            position = bisect_left(sorted_entries, (term, kind, pk))
+            if position < len(sorted_entries) and sorted_entries[position] == (term, kind, pk):
+                del sorted_entries[position]
+    
+    def apply(self, change):
+        """Replay a logged ('put', kind, pk, label, attributes) or ('remove', kind, pk)"""
+        if change[0] == 'put':
+            self.put(*change[1:])
+        else:
+            self.remove(*change[1:])
+    
+    def suggest(self, prefix, user, kinds=None, limit=DEFAULT_LIMIT):
+        """
+        Objects whose name has a word starting with prefix, visible to user.
+        
+        Names starting with the prefix rank first, then shorter names.
+        """
+        prefix = ' '.join(normalize(word) for word in terms(prefix))
+        if not prefix:
+            return []
+        kinds = set(kinds or KINDS)
+        visible = _visibility(user)
+        
+        found = {}
+        # Whole names come from their own list, so every name starting with
+        # the prefix is ranked, however many word matches sort before it
+        self._scan(self.names, prefix, kinds, visible, found)
+        self._scan(self.terms, prefix, kinds, visible, found)
+        ranked = sorted(found.values())[:limit]
+        return [{'kind': kind, 'id': pk, 'label': label} for *_, kind, pk, label in ranked]
+    
+    def _scan(self, entries, prefix, kinds, visible, found):
+        """Add up to SCAN_LIMIT new visible objects with a term in entries starting with prefix to found"""
+        position = bisect_left(entries, (prefix,))
+        end = min(len(entries), position + READ_LIMIT)
+        added = 0
+        while position < end and added < SCAN_LIMIT:
+            term, kind, pk = entries[position]
+            if not term.startswith(prefix):
+                break
+            position += 1
+            if kind not in kinds or (kind, pk) in found:
+                continue
+            label, attributes, suffixes = self.objects[kind, pk]
+            if visible(kind, attributes):
+                starts_name = self._name(suffixes).startswith(prefix)
+                found[kind, pk] = (not starts_name, len(label), label.lower(), kind, pk, label)
+                added += 1
+
+
+def _visibility(user):
+    """(kind, attributes) -> bool for what user may see, mirroring the list views"""
+    if user.is_admin or user.is_auditor:
+        return lambda kind, attributes: True
+    department_id = user.department_id
+    head = user.is_department_head and department_id
+    
+    def visible(kind, attributes):
+        if kind == 'project':
+            if head:
+                return attributes['department_id'] == department_id
+            return attributes['is_public'] or (department_id and attributes['department_id'] == department_id)
+        if kind == 'user':
+            # People are only suggested to heads, within their own department
+            return bool(head) and attributes['department_id'] == department_id
+        return True
+    return visible
+
+
+_lock = threading.RLock()
+_index = None
+
+
+def _catch_up(index):
+    """Replay the logged changes the index has not applied; False if it must be rebuilt instead"""
+    pending = changes_since(CACHE_NAMESPACE, index.version, index.sequence, MAX_REPLAY)
+    if pending is None:
+        return False
+    changes, sequence = pending
+    for change in changes:
+        index.apply(change)
+    index.sequence = sequence
+    return True
+
+
+def get_index():
+    """The process-wide index, caught up with other processes' writes or rebuilt"""
+    global _index
+    version = data_version(CACHE_NAMESPACE)
+    with _lock:
+        if _index is None or _index.version != version or not _catch_up(_index):
+            _index = AutocompleteIndex.build(version, change_sequence(CACHE_NAMESPACE, version))
+        return _index
+
+
+def suggest(prefix, user, kinds=None, limit=DEFAULT_LIMIT):
+    with _lock:
+        return get_index().suggest(prefix, user, kinds, limit)
+
+
+def _apply(change):
+    """Log a change for every process and apply it to the live index if that is caught up"""
+    with _lock:
+        version = data_version(CACHE_NAMESPACE)
+        sequence = log_change(CACHE_NAMESPACE, version, change)
+        if sequence is None:
+            # Readers can no longer tell what they missed
+            mark_stale()
+        elif _index is not None and _index.version == version and _index.sequence == sequence - 1:
+            _index.apply(change)
+            _index.sequence = sequence
+
+
+def index_object(obj):
+    """Put a saved object into the live index"""
+    kind = kind_of(type(obj))
+    _apply(('put', kind, obj.pk, *ENTRIES[kind](obj)))
+
+
+def remove_object(model, pk):
+    _apply(('remove', kind_of(model), pk))
+
+
+def mark_stale():
+    """Force a rebuild on the next lookup, here and in other processes"""
+    bump_data_version(CACHE_NAMESPACE)
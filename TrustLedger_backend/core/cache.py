@@ -0,0 +1,100 @@
+"""
+Versioned caching for read-heavy summaries.
+
+Each namespace has a version number stored in the cache. Cached values are
+keyed by that version, so invalidating a namespace is a single increment
+and stale entries simply stop being read until they expire.
+
+Processes holding an in-memory index of a namespace (see core.autocomplete
+and fund_flows.tracing) share small changes through a change log instead:
+each change is stored under the next sequence number of the current
+version and replayed by the other processes, so only a bump forces them
+to rebuild.
+
+With a per-process cache (the default LocMemCache) a bump is only seen by
+the process that made it, so keep timeouts short unless a shared backend
+such as Redis or Memcached is configured.
+"""
+from django.core.cache import cache
+
+DEFAULT_TIMEOUT = 300  # 5 minutes
+CHANGE_LOG_TIMEOUT = 60 * 60  # 1 hour
+
+
+def _version_key(namespace):
+    return f'data_version:{namespace}'
+
+
+def data_version(namespace):
+    """Current version of a namespace, starting at 1"""
+    return cache.get_or_set(_version_key(namespace), 1, timeout=None)
+
+
+def bump_data_version(namespace):
+    """Invalidate everything cached under a namespace"""
+    try:
+        return cache.incr(_version_key(namespace))
+    except ValueError:
+        # Key missing or evicted: start a fresh version
+        cache.set(_version_key(namespace), 2, timeout=None)
+        return 2
+
+
+def versioned_key(namespace, key=''):
+    """Cache key for key under the namespace's current version"""
+    return f'{namespace}:v{data_version(namespace)}:{key}'
+
+
+def get_or_build(namespace, key, build, timeout=DEFAULT_TIMEOUT):
+    """Return the cached value for key, building and storing it on a miss"""
+    cache_key = versioned_key(namespace, key)
+    value = cache.get(cache_key)
+    if value is None:
+        value = build()
+        cache.set(cache_key, value, timeout)
+    return value
+
+
+def _sequence_key(namespace, version):
+    return f'{namespace}:v{version}:changes'
+
+
+def change_key(namespace, version, sequence):
+    """Cache key of one logged change"""
+    return f'{namespace}:v{version}:change:{sequence}'
+
+
+def change_sequence(namespace, version):
+    """Number of the last change logged under a version of a namespace, starting at 0"""
+    return cache.get_or_set(_sequence_key(namespace, version), 0, timeout=None)
+
+
+def log_change(namespace, version, change, timeout=CHANGE_LOG_TIMEOUT):
+    """
+    Append change to the log of a namespace version; returns its sequence
+    number, or None if the log was evicted (bump the version instead).
+    """
+    key = _sequence_key(namespace, version)
+    cache.add(key, 0, timeout=None)
+    try:
+        sequence = cache.incr(key)
+    except ValueError:
+        return None
+    cache.set(change_key(namespace, version, sequence), change, timeout)
+    return sequence
+
+
+def changes_since(namespace, version, sequence, limit):
+    """
+    (changes logged after sequence in order, latest sequence number), or
+    None when they can't all be replayed: some expired, the log was reset
+    or more than limit are pending.
+    """
+    latest = change_sequence(namespace, version)
+    if latest < sequence or latest - sequence > limit:
+        return None
+    keys = [change_key(namespace, version, number) for number in range(sequence + 1, latest + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return None
+    return [changes[key] for key in keys], latest
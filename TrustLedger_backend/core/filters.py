@@ -0,0 +1,16 @@
+from rest_framework.filters import SearchFilter
+from .search_index import SearchIndex
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    ?search= through the full-text index on views that set
+    search_index_kind; other views keep DRF's icontains search.
+    """
+    
+    def filter_queryset(self, request, queryset, view):
+        kind = getattr(view, 'search_index_kind', None)
+        query = request.query_params.get(self.search_param, '').strip()
+        if kind is None or not query:
+            return super().filter_queryset(request, queryset, view)
+        return SearchIndex.filter(queryset, kind, query)
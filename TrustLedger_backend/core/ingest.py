@@ -0,0 +1,247 @@
+"""
+Bulk import of fund flows, project spending and fund allocations from CSV or JSONL
+"""
+import csv
+import json
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from fund_flows.models import FundFlow, FundSource
+from .models import Department, FundAllocation, Project, ProjectSpending
+from .search_index import SearchIndex
+from .services import StreamingAnomalyDetector
+from .signals import transactions_bulk_changed
+
+
+@dataclass(frozen=True)
+class ImportSpec:
+    """Describes how rows of one import kind map onto a model"""
+    model: type
+    fields: tuple
+    relations: dict = field(default_factory=dict)
+    user_field: str = None
+
+
+IMPORT_SPECS = {
+    'fund_flows': ImportSpec(
+        model=FundFlow,
+        fields=('source', 'target_department', 'target_project', 'amount', 'status',
+                'description', 'transaction_date'),
+        relations={'source': FundSource, 'target_department': Department, 'target_project': Project},
+    ),
+    'project_spending': ImportSpec(
+        model=ProjectSpending,
+        fields=('project', 'amount', 'description', 'category', 'transaction_date',
+                'supporting_documents', 'status'),
+        relations={'project': Project},
+        user_field='created_by',
+    ),
+    'fund_allocations': ImportSpec(
+        model=FundAllocation,
+        fields=('project', 'amount', 'allocation_type', 'source', 'description',
+                'allocation_date', 'effective_date', 'supporting_documents', 'notes'),
+        relations={'project': Project},
+        user_field='allocated_by',
+    ),
+}
+
+FORMATS = ('csv', 'jsonl')
+
+
+def detect_format(filename, default='csv'):
+    """Guess the import format from a file name"""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def _decode(lines, invalid):
+    """Decode byte lines as UTF-8, noting the numbers of lines that are not valid"""
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8-sig')
+            except UnicodeDecodeError:
+                invalid.add(number)
+                line = line.decode('utf-8-sig', errors='replace')
+        yield line
+
+
+def read_rows(lines, file_format):
+    """
+    Lazily parse text or UTF-8 byte lines into (row_number, row) pairs. Rows
+    that cannot be parsed or decoded are yielded as (row_number,
+    ValidationError) so they land in the error report instead of aborting
+    the import.
+    """
+    invalid = set()
+    lines = _decode(lines, invalid)
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        first_line = reader.line_num + 1
+        for row in reader:
+            # A quoted field can span several lines
+            if invalid.intersection(range(first_line, reader.line_num + 1)):
+                yield reader.line_num, ValidationError('Row is not valid UTF-8 text.')
+            else:
+                yield reader.line_num, row
+            first_line = reader.line_num + 1
+    elif file_format == 'jsonl':
+        for number, line in enumerate(lines, start=1):
+            if number in invalid:
+                yield number, ValidationError('Line is not valid UTF-8 text.')
+                continue
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, ValidationError(f'Invalid JSON: {e}')
+                continue
+            if not isinstance(row, dict):
+                yield number, ValidationError('Each line must be a JSON object.')
+                continue
+            yield number, row
+    else:
+        raise ValueError(f'Unsupported format "{file_format}". Use one of: {", ".join(FORMATS)}.')
+
+
+class BulkImportService:
+    """Validate rows in chunks and insert the valid ones with bulk_create"""
+    
+    def __init__(self, kind, user, chunk_size=1000):
+        if kind not in IMPORT_SPECS:
+            raise ValueError(f'Unknown import kind "{kind}". Use one of: {", ".join(IMPORT_SPECS)}.')
+        self.kind = kind
+        self.spec = IMPORT_SPECS[kind]
+        self.user = user
+        self.chunk_size = chunk_size
+    
+    def run(self, rows):
+        """Import (row_number, row) pairs and return a summary with per-row errors"""
+        report = {'kind': self.kind, 'total': 0, 'created': 0, 'failed': 0, 'errors': []}
+        
+        chunk = []
+        for item in rows:
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk, report)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk, report)
+        
+        return report
+    
+    def _import_chunk(self, chunk, report):
+        related = self._load_related(chunk)
+        
+        instances = []
+        for number, row in chunk:
+            report['total'] += 1
+            try:
+                if isinstance(row, ValidationError):
+                    raise row
+                instances.append(self._build_instance(row, related))
+            except ValidationError as e:
+                report['failed'] += 1
+                report['errors'].append({'row': number, 'errors': self._error_messages(e)})
+        
+        if instances:
+            with transaction.atomic():
+                self.spec.model.objects.bulk_create(instances, batch_size=self.chunk_size)
+                if self.spec.model is FundFlow:
+                    SearchIndex.index_objects(instances)
+                if self.spec.model is ProjectSpending:
+                    # Settle Project.spent once per touched project, committed with the rows
+                    spent_deltas = defaultdict(Decimal)
+                    for instance in instances:
+                        spent_deltas[instance.project_id] += instance.spent_contribution()
+                    for project_id, delta in spent_deltas.items():
+                        if delta:
+                            Project.apply_spent_delta(project_id, delta)
+            report['created'] += len(instances)
+            
+            if self.spec.model in (FundFlow, ProjectSpending):
+                # bulk_create skips post_save, so score and announce the new rows here
+                if StreamingAnomalyDetector.enabled():
+                    StreamingAnomalyDetector.observe_many(instances)
+                transactions_bulk_changed.send(sender=self.spec.model, changes=[
+                    (None, {name: getattr(instance, name) for name in self.spec.model.FACT_FIELDS})
+                    for instance in instances
+                ])
+    
+    def _load_related(self, chunk):
+        """Resolve every foreign key referenced by the chunk with one query per relation"""
+        related = {}
+        for name, model in self.spec.relations.items():
+            ids = set()
+            for _, row in chunk:
+                if isinstance(row, dict):
+                    value = self._parse_id(row.get(name))
+                    if isinstance(value, int):
+                        ids.add(value)
+            related[name] = model.objects.in_bulk(ids) if ids else {}
+        return related
+    
+    def _build_instance(self, row, related):
+        opts = self.spec.model._meta
+        values = {}
+        errors = {}
+        
+        for name in self.spec.fields:
+            raw = row.get(name)
+            model_field = opts.get_field(name)
+            
+            if name in self.spec.relations:
+                pk = self._parse_id(raw)
+                if pk is None:
+                    if not model_field.null:
+                        errors[name] = ['This field is required.']
+                    continue
+                if not isinstance(pk, int) or pk not in related[name]:
+                    errors[name] = [f'Invalid pk "{raw}" - object does not exist.']
+                    continue
+                values[name] = related[name][pk]
+            elif raw is None or (raw == '' and model_field.has_default()):
+                # Missing columns and blank cells fall back to the model default
+                continue
+            else:
+                values[name] = raw
+        
+        if errors:
+            raise ValidationError(errors)
+        
+        if self.spec.user_field:
+            values[self.spec.user_field] = self.user
+        
+        instance = self.spec.model(**values)
+        # Foreign keys were checked against the prefetched maps above, so keep
+        # full_clean from issuing one existence query per row.
+        instance.full_clean(
+            exclude=list(self.spec.relations) + ([self.spec.user_field] if self.spec.user_field else []),
+            validate_unique=False,
+            validate_constraints=False,
+        )
+        return instance
+    
+    @staticmethod
+    def _parse_id(value):
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return value
+    
+    @staticmethod
+    def _error_messages(error):
+        if hasattr(error, 'error_dict'):
+            return error.message_dict
+        return {'non_field_errors': error.messages}
@@ -0,0 +1,77 @@
+"""
+Management command to time full-text searches against a synthetic ledger
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from core.cache import bump_data_version
+from core.search_index import CACHE_NAMESPACE, SEARCH_SOURCES, SearchIndex, get_backend
+
+WORDS = [
+    'road', 'school', 'clinic', 'water', 'supply', 'maintenance', 'salary', 'equipment', 'repair',
+    'bridge', 'grant', 'training', 'vaccination', 'borehole', 'textbooks', 'fuel', 'transport',
+    'solar', 'irrigation', 'seeds', 'fertilizer', 'consulting', 'audit', 'construction', 'drainage',
+    'library', 'computers', 'furniture', 'uniforms', 'meals', 'sanitation', 'electricity', 'roofing',
+]
+NAMES = ['Central', 'Northern', 'Eastern', 'Riverside', 'Hillside', 'Lakeside', 'Harbor', 'Valley']
+QUERIES = ['road', 'borehole repair', 'vacc', 'solar irrigation', 'Riverside clinic', 'textbooks library']
+
+
+class Command(BaseCommand):
+    help = 'Index synthetic fund flows and time ranked searches; everything is rolled back afterwards'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Synthetic fund flows to index')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--seed', type=int, default=0)
+    
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if backend is None:
+            raise CommandError('This database has no full-text search backend.')
+        
+        rng = random.Random(options['seed'])
+        source = SEARCH_SOURCES['fund_flow']
+        # Zipf-like word frequencies, so some terms are common and most are rare
+        weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+        
+        with transaction.atomic():
+            started = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COALESCE(MAX(rowid), 0) FROM search_index')
+                first = (cursor.fetchone()[0] >> 3) + 1
+                batch = []
+                for pk in range(first, first + options['rows']):
+                    title = f'{rng.choice(NAMES)} Fund {rng.choice(NAMES)} {rng.choice(WORDS).title()} Project'
+                    body = ' '.join(rng.choices(WORDS, weights, k=rng.randint(4, 12)))
+                    batch.append((source.key(pk), title, body))
+                    if len(batch) == 10_000:
+                        backend.upsert(cursor, 'fund_flow', batch)
+                        batch = []
+                if batch:
+                    backend.upsert(cursor, 'fund_flow', batch)
+            self.stdout.write(f'Indexed {options["rows"]} rows in {time.perf_counter() - started:.1f}s')
+            
+            for query in QUERIES:
+                started = time.perf_counter()
+                SearchIndex.search(query)
+                cold = (time.perf_counter() - started) * 1000
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    hits = SearchIndex.search(query, limit=20)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                self.stdout.write(
+                    f'{query!r:24} cold {cold:7.2f}ms  median {statistics.median(timings):7.2f}ms  '
+                    f'p95 {p95:7.2f}ms  ({len(hits)} hits)'
+                )
+            
+            transaction.set_rollback(True)
+        # Drop term statistics cached from the synthetic rows
+        bump_data_version(CACHE_NAMESPACE)
+        self.stdout.write(self.style.SUCCESS('Benchmark finished; synthetic rows rolled back.'))
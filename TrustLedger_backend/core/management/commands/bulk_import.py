@@ -0,0 +1,55 @@
+"""
+Management command to bulk import fund flows, spending records or allocations
+"""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from core.ingest import BulkImportService, IMPORT_SPECS, FORMATS, detect_format, read_rows
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Bulk import fund flows, project spending or fund allocations from a CSV or JSONL file'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORT_SPECS), help='What the file contains')
+        parser.add_argument('path', help='Path to the CSV or JSONL file')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            dest='file_format',
+            help='File format (defaults to the file extension)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Rows validated and inserted per batch',
+        )
+        parser.add_argument(
+            '--user',
+            default='system',
+            help='Username recorded as creator of spending records and allocations',
+        )
+    
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["user"]}" does not exist')
+        
+        file_format = options['file_format'] or detect_format(options['path'])
+        service = BulkImportService(options['kind'], user, chunk_size=options['chunk_size'])
+        
+        with open(options['path'], 'rb') as handle:
+            report = service.run(read_rows(handle, file_format))
+        
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f'  - Row {error["row"]}: {error["errors"]}'))
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Imported {report["created"]} of {report["total"]} {report["kind"]} rows '
+                f'({report["failed"]} failed).'
+            )
+        )
@@ -0,0 +1,41 @@
+"""
+Management command to rebuild the denormalized Department rollups
+"""
+from django.core.management.base import BaseCommand
+from core.models import Department
+
+
+class Command(BaseCommand):
+    help = 'Recompute Department spend/project rollups from projects and report any drift'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drift without writing the corrected values',
+        )
+        parser.add_argument(
+            '--department',
+            type=int,
+            action='append',
+            dest='departments',
+            help='Only rebuild the given department ID (repeatable)',
+        )
+    
+    def handle(self, *args, **options):
+        drift = Department.refresh_rollups(options['departments'], dry_run=options['dry_run'])
+        
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Department rollups are in sync.'))
+            return
+        
+        for department, field, stored, actual in drift:
+            self.stdout.write(
+                self.style.WARNING(f'  - {department.name}: {field} stored={stored} actual={actual}')
+            )
+        
+        departments = len({department.pk for department, *_ in drift})
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(
+            self.style.SUCCESS(f'{verb} {len(drift)} drifted rollups across {departments} departments.')
+        )
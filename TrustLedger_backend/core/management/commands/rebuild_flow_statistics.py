@@ -0,0 +1,24 @@
+"""
+Management command to rebuild the per-project running statistics used for on-write anomaly scoring
+"""
+from django.core.management.base import BaseCommand
+from core.services import StreamingAnomalyDetector
+
+
+class Command(BaseCommand):
+    help = 'Recompute ProjectFlowStatistics from stored fund flows and spending records'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            action='append',
+            dest='projects',
+            help='Only rebuild the given project ID (repeatable)',
+        )
+    
+    def handle(self, *args, **options):
+        rebuilt = StreamingAnomalyDetector.rebuild(options['projects'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {rebuilt} project flow statistics.')
+        )
@@ -0,0 +1,27 @@
+"""
+Management command to rebuild the full-text search index
+"""
+from django.core.management.base import BaseCommand, CommandError
+from core.search_index import SEARCH_SOURCES, SearchIndex, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Re-index fund flows, projects, documents and community feedback for full-text search'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            action='append',
+            dest='kinds',
+            choices=list(SEARCH_SOURCES),
+            help='Only rebuild the given kind (repeatable)',
+        )
+    
+    def handle(self, *args, **options):
+        if get_backend() is None:
+            raise CommandError('This database has no full-text search backend.')
+        written = SearchIndex.rebuild(options['kinds'])
+        summary = ', '.join(f'{count} {kind}' for kind, count in written.items())
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt the search index: {summary}.')
+        )
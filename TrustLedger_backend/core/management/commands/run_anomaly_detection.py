@@ -1,9 +1,12 @@
 """
 Management command to run anomaly detection
 """
-from django.core.management.base import BaseCommand
-from core.services import AnomalyDetectionService, TrustScoreCalculator
-from core.models import Department
+import time
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from core.batch import detect_anomalies_in_range, id_ranges, run_partitioned, score_departments_in_range
+from core.models import Department, Project
 
 
 class Command(BaseCommand):
@@ -25,31 +28,76 @@ class Command(BaseCommand):
             action='store_true',
             help='Run all services',
         )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recalculate trust scores for every department, not only those changed since the last run',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes (default: 1, run in this process)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Projects or departments per id-range partition (default: 1000)',
+        )
     
     def handle(self, *args, **options):
+        workers = options['workers']
+        chunk_size = options['chunk_size']
+        if workers < 1 or chunk_size < 1:
+            raise CommandError('--workers and --chunk-size must be positive.')
+        
         if options['all'] or options['anomaly_detection']:
             self.stdout.write('Running anomaly detection...')
-            results = AnomalyDetectionService.run_all_detections()
+            started = time.perf_counter()
+            report = run_partitioned(
+                detect_anomalies_in_range, id_ranges(Project.objects.all(), chunk_size), workers
+            )
+            counts = report['counts']
             
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'Anomaly detection completed. Found {results["total_detected"]} anomalies:'
+                    f'Anomaly detection completed. Found {sum(counts.values())} anomalies:'
                 )
             )
-            self.stdout.write(f'  - Budget overruns: {len(results["budget_overruns"])}')
-            self.stdout.write(f'  - Unusual spending: {len(results["unusual_spending"])}')
-            self.stdout.write(f'  - Delayed projects: {len(results["delayed_projects"])}')
+            self.stdout.write(f'  - Budget overruns: {counts.get("budget_overruns", 0)}')
+            self.stdout.write(f'  - Unusual spending: {counts.get("unusual_spending", 0)}')
+            self.stdout.write(f'  - Delayed projects: {counts.get("delayed_projects", 0)}')
+            self.write_report(report, time.perf_counter() - started)
         
         if options['all'] or options['trust_scores']:
             self.stdout.write('Calculating trust scores...')
-            
+            started = time.perf_counter()
             departments = Department.objects.all()
-            for department in departments:
-                trust_indicator = TrustScoreCalculator.calculate_department_trust_score(department)
+            if not options['force']:
+                departments = departments.filter(trust_score_dirty=True)
+            report = run_partitioned(
+                partial(score_departments_in_range, force=options['force']),
+                id_ranges(departments, chunk_size),
+                workers,
+            )
+            if not report['items']:
+                self.stdout.write('  No departments changed since the last calculation.')
+            for name, overall_score in report['items']:
                 self.stdout.write(
-                    f'  - {department.name}: {trust_indicator.overall_score}/100'
+                    f'  - {name}: {overall_score}/100'
                 )
             
             self.stdout.write(
                 self.style.SUCCESS('Trust score calculation completed.')
             )
+            self.write_report(report, time.perf_counter() - started)
+    
+    def write_report(self, report, elapsed):
+        """Print per-step timings and peak memory for a partitioned run"""
+        self.stdout.write(f'  {report["ranges"]} partition(s) in {elapsed:.2f}s wall time')
+        # Step timings are summed across partitions, so they can exceed wall time with --workers
+        for name, seconds in report['timings'].items():
+            self.stdout.write(f'    {name}: {seconds:.2f}s')
+        if report['peak_memory_kb'] is not None:
+            self.stdout.write(f'  Peak memory per process: {report["peak_memory_kb"] / 1024:.1f} MiB')
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:53
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rollups(apps, schema_editor):
+    Department = apps.get_model('core', 'Department')
+    Project = apps.get_model('core', 'Project')
+    
+    rows = Project.objects.order_by().values('department_id').annotate(
+        spent_amount=Sum('spent', filter=Q(status__in=['active', 'completed'])),
+        projects_count=Count('id'),
+        active_projects_count=Count('id', filter=Q(status='active')),
+        completed_projects_count=Count('id', filter=Q(status='completed')),
+    )
+    for row in rows:
+        Department.objects.filter(pk=row.pop('department_id')).update(
+            **dict(row, spent_amount=row['spent_amount'] or 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_projectspending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='active_projects_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='completed_projects_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='projects_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='spent_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_department_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='trust_score_dirty',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from core.search_index import get_backend
+    backend = get_backend(schema_editor.connection.vendor)
+    if backend is not None:
+        with schema_editor.connection.cursor() as cursor:
+            backend.create(cursor)
+
+
+def drop_search_index(apps, schema_editor):
+    from core.search_index import get_backend
+    backend = get_backend(schema_editor.connection.vendor)
+    if backend is not None:
+        with schema_editor.connection.cursor() as cursor:
+            backend.drop(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_department_trust_score_dirty'),
+    ]
+
+    # Rows are filled by 0009_fill_search_index
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def fill_search_index(apps, schema_editor):
+    """Index every existing object once, as `manage.py rebuild_search_index`"""
+    from core.search_index import SEARCH_SOURCES, SearchIndex, get_backend
+    if get_backend(schema_editor.connection.vendor) is None:
+        return
+    for kind, source in SEARCH_SOURCES.items():
+        model = apps.get_model(source.model._meta.label)
+        SearchIndex.index_queryset(kind, model.objects.all())
+
+
+def clear_search_index(apps, schema_editor):
+    from core.search_index import SEARCH_SOURCES, get_backend
+    backend = get_backend(schema_editor.connection.vendor)
+    if backend is not None:
+        with schema_editor.connection.cursor() as cursor:
+            for kind in SEARCH_SOURCES:
+                backend.clear(cursor, kind)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_search_index'),
+        ('documents', '0001_initial'),
+        ('fund_flows', '0010_backfill_project_flow_statistics'),
+    ]
+    
+    # Run once here rather than on every deploy; the signals in core.signals
+    # keep the rows current and `manage.py rebuild_search_index` repairs drift
+    operations = [
+        migrations.RunPython(fill_search_index, clear_search_index),
+    ]
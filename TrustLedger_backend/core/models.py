@@ -1,4 +1,7 @@
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -13,34 +16,100 @@ class Department(models.Model):
     budget = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(0)])
     head = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='headed_departments')
     is_active = models.BooleanField(default=True)
+    
+    # Rollups maintained on every Project save and delete (see Project.save
+    # and core.signals); queryset updates bypass them, and
+    # `manage.py rebuild_department_rollups` repairs drift.
+    spent_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    projects_count = models.PositiveIntegerField(default=0)
+    active_projects_count = models.PositiveIntegerField(default=0)
+    completed_projects_count = models.PositiveIntegerField(default=0)
+    # Set when projects, feedback or documents change; cleared when the
+    # trust score is recalculated (see TrustScoreCalculator.recalculate_dirty).
+    trust_score_dirty = models.BooleanField(default=True, db_index=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    ROLLUP_FIELDS = ['spent_amount', 'projects_count', 'active_projects_count', 'completed_projects_count']
+    
     class Meta:
         ordering = ['name']
     
     def __str__(self):
         return self.name
     
-    @property
-    def spent_amount(self):
-        """Calculate total amount spent by this department"""
-        return sum(project.spent for project in self.projects.filter(status__in=['active', 'completed']))
-    
     @property
     def remaining_budget(self):
         """Calculate remaining budget"""
         return self.budget - self.spent_amount
     
-    @property
-    def active_projects_count(self):
-        """Count of active projects"""
-        return self.projects.filter(status='active').count()
-    
-    @property
-    def completed_projects_count(self):
-        """Count of completed projects"""
-        return self.projects.filter(status='completed').count()
+    @classmethod
+    def apply_rollup_delta(cls, department_id, delta):
+        """Atomically add a per-field delta to the stored rollups of a department"""
+        changes = {
+            field: models.F(field) + value
+            for field, value in delta.items() if value
+        }
+        if department_id and changes:
+            cls.objects.filter(pk=department_id).update(trust_score_dirty=True, **changes)
+    
+    @classmethod
+    def mark_trust_dirty(cls, **lookup):
+        """Flag the matching departments for trust score recalculation"""
+        cls.objects.filter(trust_score_dirty=False, **lookup).update(trust_score_dirty=True)
+    
+    @classmethod
+    def compute_rollups(cls, department_ids=None):
+        """Compute the true rollups from projects with a single grouped query"""
+        projects = Project.objects.all()
+        if department_ids is not None:
+            projects = projects.filter(department_id__in=department_ids)
+        
+        rows = projects.order_by().values('department_id').annotate(
+            spent_amount=Sum('spent', filter=Q(status__in=Project.ROLLUP_SPENT_STATUSES)),
+            projects_count=Count('id'),
+            active_projects_count=Count('id', filter=Q(status='active')),
+            completed_projects_count=Count('id', filter=Q(status='completed')),
+        )
+        return {
+            row.pop('department_id'): dict(row, spent_amount=row['spent_amount'] or Decimal('0'))
+            for row in rows
+        }
+    
+    @classmethod
+    def refresh_rollups(cls, department_ids=None, dry_run=False):
+        """
+        Recompute stored rollups from projects and persist the ones that drifted.
+        Returns a list of (department, field, stored, actual) tuples.
+        """
+        actual = cls.compute_rollups(department_ids)
+        departments = cls.objects.all()
+        if department_ids is not None:
+            departments = departments.filter(pk__in=department_ids)
+        
+        empty = {'spent_amount': Decimal('0'), 'projects_count': 0,
+                 'active_projects_count': 0, 'completed_projects_count': 0}
+        drift = []
+        changed = []
+        with transaction.atomic():
+            for department in departments.select_for_update().only('name', *cls.ROLLUP_FIELDS):
+                values = actual.get(department.pk, empty)
+                dirty = False
+                for field in cls.ROLLUP_FIELDS:
+                    stored = getattr(department, field)
+                    if stored != values[field]:
+                        drift.append((department, field, stored, values[field]))
+                        setattr(department, field, values[field])
+                        dirty = True
+                if dirty:
+                    department.trust_score_dirty = True
+                    changed.append(department)
+            
+            if changed and not dry_run:
+                cls.objects.bulk_update(changed, cls.ROLLUP_FIELDS + ['trust_score_dirty'])
+        
+        return drift
 
 
 class Project(models.Model):
@@ -60,6 +129,9 @@ class Project(models.Model):
         ('critical', 'Critical'),
     ]
     
+    # Statuses whose spent amount counts towards Department.spent_amount
+    ROLLUP_SPENT_STATUSES = ['active', 'completed']
+    
     name = models.CharField(max_length=200)
     description = models.TextField()
     budget = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(0)])
@@ -82,6 +154,116 @@ class Project(models.Model):
     def __str__(self):
         return f"{self.name} ({self.department.name})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # save() tells an explicit spent assignment from the value loaded here
+        instance._loaded_spent = instance.__dict__.get('spent')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """
+        Override save to keep the department rollups in step.
+        
+        Only save() and delete() maintain the rollups: a queryset update()
+        of status, spent or department must be followed by
+        Department.refresh_rollups() (as recalculate_spent() does), or
+        drift is left for `manage.py rebuild_department_rollups`.
+        
+        An unchanged spent is refreshed from the locked row before writing,
+        so approvals applied meanwhile by apply_spent_delta() are kept.
+        """
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            written = {self._meta.get_field(name).attname for name in update_fields}
+        else:
+            written = {field.attname for field in self._meta.concrete_fields} - self.get_deferred_fields()
+        
+        with transaction.atomic():
+            previous = None
+            stored = None
+            budget = None
+            if self.pk and not self._state.adding:
+                # What the stored row contributes, read under a row lock so
+                # concurrent saves of one project apply their deltas in turn
+                stored = (
+                    Project.objects.select_for_update()
+                    .filter(pk=self.pk).values('department_id', 'status', 'spent', 'budget').first()
+                )
+                if stored:
+                    budget = stored.pop('budget')
+                    previous = (stored['department_id'], Project(**stored).rollup_contribution())
+                    if 'spent' not in written or (
+                        update_fields is None and self.spent == getattr(self, '_loaded_spent', None)
+                    ):
+                        self.spent = stored['spent']
+            # post_save handlers (e.g. the spending facts and the trace index) read the previous state here
+            self._rollup_snapshot = previous
+            self._budget_snapshot = budget
+            super().save(*args, **kwargs)
+            self._loaded_spent = self.spent
+            
+            # The row now holds the written fields over the stored ones
+            state = {'department_id': self.department_id, 'status': self.status, 'spent': self.spent}
+            if stored:
+                state.update({name: stored[name] for name in state if name not in written})
+            department_id = state['department_id']
+            current = Project(**state).rollup_contribution()
+            if previous and previous[0] == department_id:
+                Department.apply_rollup_delta(department_id, {
+                    field: current[field] - previous[1][field] for field in current
+                })
+            else:
+                if previous:
+                    Department.apply_rollup_delta(previous[0], {
+                        field: -value for field, value in previous[1].items()
+                    })
+                Department.apply_rollup_delta(department_id, current)
+        
+        self._rollup_snapshot = (department_id, current)
+        self._budget_snapshot = self.budget if stored is None or 'budget' in written else budget
+    
+    @classmethod
+    def apply_spent_delta(cls, project_id, delta):
+        """Atomically add delta to a project's spent amount and its department rollup"""
+        with transaction.atomic():
+            cls.objects.filter(pk=project_id).update(spent=models.F('spent') + delta)
+            Department.objects.filter(
+                projects=project_id,
+                projects__status__in=cls.ROLLUP_SPENT_STATUSES,
+            ).update(spent_amount=models.F('spent_amount') + delta)
+    
+    @classmethod
+    def recalculate_spent(cls, project_ids):
+        """
+        Recompute spent from approved spending records for the given projects
+        with one UPDATE, then refresh the affected department rollups.
+        """
+        project_ids = list(project_ids)
+        if not project_ids:
+            return
+        
+        approved_total = ProjectSpending.objects.filter(
+            project=models.OuterRef('pk'), status='approved'
+        ).order_by().values('project').annotate(total=Sum('amount')).values('total')
+        
+        with transaction.atomic():
+            cls.objects.filter(pk__in=project_ids).update(
+                spent=Coalesce(models.Subquery(approved_total), Decimal('0'))
+            )
+            department_ids = cls.objects.filter(pk__in=project_ids).values_list('department_id', flat=True)
+            Department.refresh_rollups(set(department_ids))
+    
+    def rollup_contribution(self):
+        """What this project adds to each Department rollup field"""
+        spent = self._meta.get_field('spent').to_python(self.spent) or Decimal('0')
+        return {
+            'spent_amount': spent if self.status in self.ROLLUP_SPENT_STATUSES else Decimal('0'),
+            'projects_count': 1,
+            'active_projects_count': int(self.status == 'active'),
+            'completed_projects_count': int(self.status == 'completed'),
+        }
+    
     @property
     def remaining_budget(self):
         """Calculate remaining budget for this project"""
@@ -315,6 +497,9 @@ class ProjectSpending(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Fields that place a record in the analytics spending facts
+    FACT_FIELDS = ('project_id', 'category', 'transaction_date', 'status', 'amount')
+    
     class Meta:
         ordering = ['-transaction_date', '-created_at']
         verbose_name = 'Project Spending'
@@ -332,26 +517,51 @@ class ProjectSpending(models.Model):
         return self.status == 'pending'
     
     def save(self, *args, **kwargs):
-        """Override save to update project spent amount"""
-        old_status = None
-        if self.pk:
-            try:
-                old_instance = ProjectSpending.objects.get(pk=self.pk)
-                old_status = old_instance.status
-            except ProjectSpending.DoesNotExist:
-                pass
+        """Override save to apply the change in approved amount to the project"""
+        with transaction.atomic():
+            previous = None
+            stored = None
+            if self.pk and not self._state.adding:
+                # Read what the stored row contributes under a row lock, so two
+                # requests approving the same record cannot both add its amount
+                stored = (
+                    ProjectSpending.objects.select_for_update()
+                    .filter(pk=self.pk).values(*self.FACT_FIELDS).first()
+                )
+                if stored:
+                    previous = (stored['project_id'], ProjectSpending(**stored).spent_contribution())
+            # post_save handlers (e.g. the fund trace index and the spending
+            # facts) read the previous state here
+            self._spent_snapshot = previous
+            self._fact_snapshot = stored
+            super().save(*args, **kwargs)
+            current = self.spent_contribution()
+            # Only crossings to/from approved, or edits of an approved amount,
+            # move the project's spent total.
+            if previous and previous[0] != self.project_id:
+                self._apply_spent_delta(previous[0], -previous[1])
+                self._apply_spent_delta(self.project_id, current)
+            else:
+                self._apply_spent_delta(self.project_id, current - (previous[1] if previous else 0))
         
-        super().save(*args, **kwargs)
+        self._spent_snapshot = (self.project_id, current)
+    
+    def spent_contribution(self):
+        """Amount this record adds to Project.spent"""
+        if self.status != 'approved':
+            return Decimal('0')
+        return self._meta.get_field('amount').to_python(self.amount) or Decimal('0')
+    
+    def _apply_spent_delta(self, project_id, delta):
+        if not delta:
+            return
+        Project.apply_spent_delta(project_id, delta)
         
-        # Update project spent amount when status changes
-        if old_status != self.status:
-            self.update_project_spent()
+        # Keep an already loaded project instance consistent with the row
+        project = self._state.fields_cache.get('project')
+        if project is not None and project.pk == project_id:
+            project.spent += delta
     
     def update_project_spent(self):
-        """Update the project's spent amount based on approved spending records"""
-        project = self.project
-        approved_spending = project.spending_records.filter(status='approved').aggregate(
-            total=models.Sum('amount')
-        )['total'] or 0
-        project.spent = approved_spending
-        project.save(update_fields=['spent'])
\ No newline at end of file
+        """Recalculate the project's spent amount from all approved spending records"""
+        Project.recalculate_spent([self.project_id])
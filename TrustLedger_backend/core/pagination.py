@@ -0,0 +1,95 @@
+"""
+Keyset (seek) pagination.
+
+A page is fetched with a WHERE clause on the ordering columns of the last
+row already seen rather than with OFFSET, so every page costs the same
+index range scan however deep it is, and rows inserted meanwhile neither
+repeat nor go missing. Cursors are opaque URL-safe tokens holding those
+last values.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, length):
+    """The ordering values in a cursor token; raises InvalidCursor if it is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def _cursor_values(model, ordering, values):
+    """Decoded cursor values as their fields' Python types; raises InvalidCursor if any doesn't fit"""
+    converted = []
+    for field, value in zip(ordering, values):
+        field = model._meta.get_field(field.lstrip('-'))
+        try:
+            value = field.to_python(value)
+            if value is None:
+                raise ValidationError('Cursor values cannot be null')
+            # Range validators keep out-of-range integers away from the database
+            field.run_validators(value)
+        except (ValidationError, TypeError, ValueError) as e:
+            raise InvalidCursor('Invalid cursor') from e
+        converted.append(value)
+    return converted
+
+
+def _after(ordering, values):
+    """Q for rows strictly after values in the given ordering"""
+    condition = Q()
+    for position, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[position]})
+        for earlier, value in zip(ordering[:position], values):
+            step &= Q(**{earlier.lstrip('-'): value})
+        condition |= step
+    # Redundant bound on the leading column, so the database can seek into its index
+    first = ordering[0]
+    bound = Q(**{f'{first.lstrip("-")}__{"lte" if first.startswith("-") else "gte"}': values[0]})
+    return bound & condition
+
+
+def keyset_page(queryset, ordering, cursor=None, size=20):
+    """
+    One page of queryset in the given ordering, which must end in a unique
+    field. Returns (rows, next cursor or None); raises InvalidCursor for a
+    malformed or tampered cursor.
+    """
+    if cursor:
+        values = _cursor_values(queryset.model, ordering, decode_cursor(cursor, len(ordering)))
+        queryset = queryset.filter(_after(ordering, values))
+    rows = list(queryset.order_by(*ordering)[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+
+
+def keyset_chunks(queryset, ordering, size=1000):
+    """Every row of queryset in ordering, read one keyset page at a time"""
+    cursor = None
+    while True:
+        rows, cursor = keyset_page(queryset, ordering, cursor, size)
+        if rows:
+            yield rows
+        if cursor is None:
+            return
@@ -0,0 +1,563 @@
+"""
+Full-text search index over fund flows, projects, documents and feedback.
+
+Every indexed object is one row in a `search_index` table holding a title
+and a body of denormalized text (a flow's source and target names, a
+project's department, ...). The table is managed by a backend chosen from
+the database vendor:
+
+- SQLite: an FTS5 virtual table ranked with bm25()
+- PostgreSQL: a table with a generated, GIN-indexed tsvector ranked with
+  ts_rank_cd()
+
+Set SEARCH_INDEX_BACKEND to a dotted path to plug in another backend. On
+any other database there is no index and callers fall back to icontains
+filters.
+
+Rows are keyed by `object_id * 8 + kind code`, so the index can be joined
+back to its tables with plain integer arithmetic. They are written in the
+same transaction as the objects (see core.signals) and can be rebuilt
+with `manage.py rebuild_search_index`.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import ExpressionWrapper, F, IntegerField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from documents.models import Document
+from fund_flows.models import FundFlow
+from .cache import get_or_build
+from .models import CommunityFeedback, Project
+
+TABLE = 'search_index'
+KEY_BITS = 3
+CACHE_NAMESPACE = 'search_index'
+SNIPPET_WORDS = 16
+
+
+@dataclass(frozen=True)
+class SearchSource:
+    """How objects of one kind are turned into index rows"""
+    model: type
+    code: int
+    select_related: tuple
+    title: callable
+    body: callable
+    # Q limiting a non-admin, non-auditor user to what they may see
+    visible_to: callable
+    # Fields searched with icontains when the database has no index
+    fallback_fields: tuple = ()
+    
+    def key(self, pk):
+        return (pk << KEY_BITS) + self.code
+    
+    def visible(self, queryset, user):
+        """queryset narrowed to the objects user may see"""
+        if user.is_admin or user.is_auditor:
+            return queryset
+        return queryset.filter(self.visible_to(user))
+    
+    def entry(self, obj):
+        return self.key(obj.pk), ' '.join(self.title(obj).split()), ' '.join(self.body(obj).split())
+
+
+def _flow_title(flow):
+    target = flow.target_project or flow.target_department
+    return f"{flow.source.name} {target.name if target else ''}"
+
+
+def _flow_visibility(user):
+    if user.is_department_head and user.department:
+        return Q(target_department=user.department) | Q(target_project__department=user.department)
+    return Q(target_project__manager=user) | Q(target_department__head=user)
+
+
+def _project_visibility(user):
+    if user.is_department_head and user.department:
+        return Q(department=user.department)
+    return Q(manager=user)
+
+
+def _document_visibility(user):
+    if user.is_department_head and user.department:
+        return Q(project__department=user.department) | Q(fund_flow__target_department=user.department)
+    return Q(uploaded_by=user) | Q(project__manager=user) | Q(fund_flow__target_project__manager=user)
+
+
+def _document_body(document):
+    parts = [document.get_document_type_display()]
+    if document.project:
+        parts.append(document.project.name)
+    if document.fund_flow:
+        parts.append(document.fund_flow.source.name)
+    return ' '.join(parts)
+
+
+SEARCH_SOURCES = {
+    'fund_flow': SearchSource(
+        model=FundFlow,
+        code=1,
+        select_related=('source', 'target_department', 'target_project'),
+        title=_flow_title,
+        body=lambda flow: flow.description,
+        visible_to=_flow_visibility,
+        fallback_fields=('description', 'source__name', 'target_department__name', 'target_project__name'),
+    ),
+    'project': SearchSource(
+        model=Project,
+        code=2,
+        select_related=('department',),
+        title=lambda project: project.name,
+        body=lambda project: f'{project.description} {project.department.name}',
+        visible_to=_project_visibility,
+        fallback_fields=('name', 'description', 'department__name'),
+    ),
+    'document': SearchSource(
+        model=Document,
+        code=3,
+        select_related=('project', 'fund_flow__source'),
+        title=lambda document: document.name,
+        body=_document_body,
+        visible_to=_document_visibility,
+        fallback_fields=('name',),
+    ),
+    'feedback': SearchSource(
+        model=CommunityFeedback,
+        code=4,
+        select_related=(),
+        title=lambda feedback: feedback.title,
+        body=lambda feedback: feedback.description,
+        visible_to=lambda user: Q(is_public=True),
+        fallback_fields=('title', 'description'),
+    ),
+}
+KINDS_BY_MODEL = {source.model: kind for kind, source in SEARCH_SOURCES.items()}
+
+
+def terms(query):
+    """Word tokens of a user query; punctuation and operators are dropped"""
+    return re.findall(r'\w+', query or '')
+
+
+def normalize(word):
+    """Fold case and diacritics the way the unicode61 tokenizer does"""
+    if word.isascii():
+        return word.lower()
+    decomposed = unicodedata.normalize('NFKD', word.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokens(text):
+    return terms(normalize(text))
+
+
+def snippet(text, words, size=SNIPPET_WORDS):
+    """
+    About size words of text around the first matching word, with matches
+    wrapped in <mark>; the last query word matches as a prefix.
+    """
+    found = list(re.finditer(r'\w+', text))
+    
+    def matches(token):
+        token = normalize(token)
+        return any(token == word or (i == len(words) - 1 and token.startswith(word)) for i, word in enumerate(words))
+    
+    first = next((i for i, token in enumerate(found) if matches(token.group())), 0)
+    start = max(0, min(first - size // 4, len(found) - size))
+    window = found[start:start + size]
+    if not window:
+        return ''
+    parts = []
+    position = window[0].start()
+    for token in window:
+        parts.append(text[position:token.start()])
+        parts.append(f'<mark>{token.group()}</mark>' if matches(token.group()) else token.group())
+        position = token.end()
+    return (
+        ('…' if start > 0 else '')
+        + ''.join(parts)
+        + ('…' if start + size < len(found) else '')
+    )
+
+
+class SQLiteSearchBackend:
+    """
+    FTS5 virtual table; the last query term matches as a prefix.
+    
+    FTS5's bm25() reads the whole posting list of every term to count
+    documents, which costs tens of milliseconds per common term at a
+    million rows. Instead the newest CANDIDATES matches are read in rowid
+    order (cheap) and scored here with the same formula, using document
+    frequencies cached for DF_TIMEOUT. Older matches follow them newest
+    first, so every page is cut from the same ordering. Snippets are cut
+    here as well.
+    """
+    CANDIDATES = 1000
+    DF_TIMEOUT = 600
+    # bm25 column weights: kind, title, body
+    WEIGHTS = (0.0, 10.0, 1.0)
+    K1 = 1.2
+    B = 0.75
+    
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "kind UNINDEXED, title, body, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+        )
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE}_terms USING fts5vocab({TABLE}, 'row')")
+    
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}_terms')
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+    
+    def upsert(self, cursor, kind, entries):
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(key,) for key, _, _ in entries])
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, kind, title, body) VALUES (%s, %s, %s, %s)',
+            [(key, kind, title, body) for key, title, body in entries],
+        )
+    
+    def delete(self, cursor, keys):
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(key,) for key in keys])
+    
+    def clear(self, cursor, kind):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE kind = %s', [kind])
+    
+    def match(self, query):
+        words = terms(query)
+        if not words:
+            return None
+        return ' '.join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+    
+    def matching_keys_sql(self, query, kind):
+        return f'SELECT rowid AS entry_key FROM {TABLE} WHERE {TABLE} MATCH %s AND kind = %s', [self.match(query), kind]
+    
+    def search(self, cursor, query, kinds, limit, offset, scopes=None):
+        in_scope, scope_params = scoped_kinds_sql(kinds, scopes or {})
+        matches = f'SELECT rowid, kind, title, body FROM {TABLE} WHERE {TABLE} MATCH %s AND {in_scope}'
+        params = [self.match(query), *scope_params]
+        cursor.execute(f'{matches} ORDER BY rowid DESC LIMIT %s', [*params, self.CANDIDATES])
+        candidates = self._documents(cursor.fetchall())
+        words = [normalize(word) for word in terms(query)]
+        statistics = self._statistics(cursor, words)
+        average_length = sum(document[-1] for document in candidates) / len(candidates) if candidates else 1
+        
+        scored = self._score(candidates, words, statistics, average_length)
+        scored.sort(key=lambda row: (-row[0], -row[1]))
+        hits = scored[offset:offset + limit]
+        if len(candidates) == self.CANDIDATES and offset + limit > self.CANDIDATES:
+            # Past the candidates: older matches, newest first
+            cursor.execute(
+                f'{matches} AND rowid < %s ORDER BY rowid DESC LIMIT %s OFFSET %s',
+                [*params, candidates[-1][0], offset + limit - max(offset, self.CANDIDATES),
+                 max(offset - self.CANDIDATES, 0)],
+            )
+            hits += self._score(self._documents(cursor.fetchall()), words, statistics, average_length)
+        return [
+            (key, kind, title, snippet(body, words), score)
+            for score, key, kind, title, body in hits
+        ]
+    
+    @staticmethod
+    def _documents(rows):
+        """(key, kind, title, body, per-column token counts, length) for each matched row"""
+        documents = []
+        for key, kind, title, body in rows:
+            columns = (tokens(title), tokens(body))
+            length = sum(len(column) for column in columns)
+            documents.append((key, kind, title, body, [Counter(column) for column in columns], length))
+        return documents
+    
+    def _score(self, documents, words, statistics, average_length):
+        """[(bm25 score, key, kind, title, body), ...] in the order of documents"""
+        total, frequencies = statistics
+        scored = []
+        for key, kind, title, body, columns, length in documents:
+            score = 0.0
+            for position, word in enumerate(words):
+                prefix = position == len(words) - 1
+                frequency = sum(
+                    weight * (
+                        sum(count for token, count in column.items() if token.startswith(word))
+                        if prefix else column[word]
+                    )
+                    for weight, column in zip(self.WEIGHTS[1:], columns)
+                )
+                idf = max(math.log((total - frequencies[word] + 0.5) / (frequencies[word] + 0.5)), 1e-6)
+                score += idf * frequency * (self.K1 + 1) / (
+                    frequency + self.K1 * (1 - self.B + self.B * length / average_length)
+                )
+            scored.append((score, key, kind, title, body))
+        return scored
+    
+    def _statistics(self, cursor, words):
+        """Indexed row count and per-word document counts (prefix counts for the last word)"""
+        def count_rows():
+            cursor.execute(f'SELECT COUNT(*) FROM {TABLE}')
+            return cursor.fetchone()[0]
+        
+        def count_documents(word, prefix):
+            if prefix:
+                # Rows holding several words with the prefix are counted once per word
+                cursor.execute(
+                    f'SELECT COALESCE(SUM(doc), 0) FROM {TABLE}_terms WHERE term >= %s AND term < %s',
+                    [word, word[:-1] + chr(ord(word[-1]) + 1)],
+                )
+            else:
+                cursor.execute(f'SELECT COALESCE(SUM(doc), 0) FROM {TABLE}_terms WHERE term = %s', [word])
+            return cursor.fetchone()[0]
+        
+        total = get_or_build(CACHE_NAMESPACE, 'rows', count_rows, self.DF_TIMEOUT)
+        frequencies = {}
+        for position, word in enumerate(words):
+            prefix = position == len(words) - 1
+            frequencies[word] = get_or_build(
+                CACHE_NAMESPACE, f'df:{word}{"*" if prefix else ""}',
+                lambda: count_documents(word, prefix), self.DF_TIMEOUT,
+            )
+        return max(total, 1), frequencies
+
+
+class PostgresSearchBackend:
+    """Generated tsvector column (title weighted A, body B) behind a GIN index"""
+    
+    @property
+    def config(self):
+        return getattr(settings, 'SEARCH_INDEX_CONFIG', 'english')
+    
+    def create(self, cursor):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+            'rowid bigint PRIMARY KEY, kind varchar(20) NOT NULL, title text NOT NULL, body text NOT NULL, '
+            f"document tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('{self.config}', title), 'A') || "
+            f"setweight(to_tsvector('{self.config}', body), 'B')) STORED)"
+        )
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING GIN (document)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_kind ON {TABLE} (kind)')
+    
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+    
+    def upsert(self, cursor, kind, entries):
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, kind, title, body) VALUES (%s, %s, %s, %s) '
+            'ON CONFLICT (rowid) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body',
+            [(key, kind, title, body) for key, title, body in entries],
+        )
+    
+    def delete(self, cursor, keys):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = ANY(%s)', [list(keys)])
+    
+    def clear(self, cursor, kind):
+        cursor.execute(f'DELETE FROM {TABLE} WHERE kind = %s', [kind])
+    
+    def match(self, query):
+        words = [word.lower() for word in terms(query)]
+        if not words:
+            return None
+        return ' & '.join(words[:-1] + [f'{words[-1]}:*'])
+    
+    def matching_keys_sql(self, query, kind):
+        return (
+            f'SELECT rowid AS entry_key FROM {TABLE} WHERE document @@ to_tsquery(%s, %s) AND kind = %s',
+            [self.config, self.match(query), kind],
+        )
+    
+    def search(self, cursor, query, kinds, limit, offset, scopes=None):
+        in_scope, scope_params = scoped_kinds_sql(kinds, scopes or {})
+        cursor.execute(
+            'SELECT rowid, kind, title, '
+            "ts_headline(%s, body, q, 'StartSel=<mark>, StopSel=</mark>, MaxWords=24, MinWords=8'), "
+            'ts_rank_cd(document, q) AS score '
+            f'FROM {TABLE}, to_tsquery(%s, %s) q WHERE document @@ q AND {in_scope} '
+            'ORDER BY score DESC LIMIT %s OFFSET %s',
+            [self.config, self.config, self.match(query), *scope_params, limit, offset],
+        )
+        return cursor.fetchall()
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def scoped_kinds_sql(kinds, scopes):
+    """
+    SQL condition limiting index rows to kinds, and the kinds in scopes
+    ({kind: (sql, params)} selecting visible keys) to those keys.
+    """
+    conditions, params = [], []
+    for kind in kinds:
+        if kind in scopes:
+            sql, scope_params = scopes[kind]
+            conditions.append(f'(kind = %s AND rowid IN ({sql}))')
+            params += [kind, *scope_params]
+        else:
+            conditions.append('kind = %s')
+            params.append(kind)
+    return f'({" OR ".join(conditions)})', params
+
+
+def get_backend(vendor=None):
+    """The index backend for a database vendor, or None if it has no index"""
+    path = getattr(settings, 'SEARCH_INDEX_BACKEND', None)
+    if path:
+        return import_string(path)()
+    backend = BACKENDS.get(vendor or connection.vendor)
+    return backend() if backend else None
+
+
+class SearchIndex:
+    """Keep the full-text index in step with the database and query it"""
+    
+    @staticmethod
+    def index_objects(objects):
+        """Write index rows for model instances of one indexed kind"""
+        objects = list(objects)
+        backend = get_backend()
+        if not objects or backend is None:
+            return 0
+        kind = KINDS_BY_MODEL[type(objects[0])]
+        source = SEARCH_SOURCES[kind]
+        # Reload with the related names in one query
+        objects = source.model.objects.select_related(*source.select_related).filter(
+            pk__in=[obj.pk for obj in objects]
+        )
+        return SearchIndex._write(backend, kind, objects)
+    
+    @staticmethod
+    def index_queryset(kind, queryset, chunk_size=2000):
+        """Write index rows for every object in queryset"""
+        backend = get_backend()
+        if backend is None:
+            return 0
+        source = SEARCH_SOURCES[kind]
+        queryset = queryset.select_related(*source.select_related).order_by()
+        return SearchIndex._write(backend, kind, queryset.iterator(chunk_size=chunk_size), chunk_size)
+    
+    @staticmethod
+    def _write(backend, kind, objects, chunk_size=2000):
+        source = SEARCH_SOURCES[kind]
+        written = 0
+        batch = []
+        with connection.cursor() as cursor:
+            for obj in objects:
+                batch.append(source.entry(obj))
+                if len(batch) >= chunk_size:
+                    backend.upsert(cursor, kind, batch)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                backend.upsert(cursor, kind, batch)
+                written += len(batch)
+        return written
+    
+    @staticmethod
+    def remove(kind, pks):
+        backend = get_backend()
+        if backend is None or not pks:
+            return
+        source = SEARCH_SOURCES[kind]
+        with connection.cursor() as cursor:
+            backend.delete(cursor, [source.key(pk) for pk in pks])
+    
+    @staticmethod
+    def rebuild(kinds=None):
+        """Re-index every object of the given kinds (default all); returns rows written per kind"""
+        backend = get_backend()
+        if backend is None:
+            return {}
+        written = {}
+        for kind in kinds or SEARCH_SOURCES:
+            with connection.cursor() as cursor:
+                backend.clear(cursor, kind)
+            written[kind] = SearchIndex.index_queryset(kind, SEARCH_SOURCES[kind].model.objects.all())
+        return written
+    
+    @staticmethod
+    def filter(queryset, kind, query):
+        """
+        Narrow queryset to objects matching query.
+        
+        Uses the index when there is one and icontains over the source's
+        fallback fields otherwise.
+        """
+        source = SEARCH_SOURCES[kind]
+        backend = get_backend()
+        if backend is None:
+            condition = Q()
+            for field in source.fallback_fields:
+                condition |= Q(**{f'{field}__icontains': query})
+            return queryset.filter(condition)
+        if backend.match(query) is None:
+            return queryset.none()
+        sql, params = backend.matching_keys_sql(query, kind)
+        # Keys are pk * 8 + code, so the pk is the key shifted back
+        return queryset.filter(pk__in=RawSQL(f'SELECT entry_key / {1 << KEY_BITS} FROM ({sql}) matches', params))
+    
+    @staticmethod
+    def keys_sql(queryset, kind):
+        """SQL selecting the index keys of the objects in queryset, with its params"""
+        code = SEARCH_SOURCES[kind].code
+        keys = queryset.order_by().annotate(
+            entry_key=ExpressionWrapper(F('pk') * (1 << KEY_BITS) + code, output_field=IntegerField())
+        ).values('entry_key')
+        return keys.query.sql_with_params()
+    
+    @staticmethod
+    def search(query, kinds=None, limit=20, offset=0, scopes=None):
+        """
+        Ranked hits with snippets: [{'kind', 'id', 'title', 'snippet', 'score'}, ...]
+        
+        scopes ({kind: (sql, params)}, see keys_sql()) limits those kinds to
+        the selected keys before hits are ranked.
+        """
+        backend = get_backend()
+        kinds = list(kinds or SEARCH_SOURCES)
+        if backend is None or backend.match(query) is None:
+            return []
+        with connection.cursor() as cursor:
+            rows = backend.search(cursor, query, kinds, limit, offset, scopes)
+        return [
+            {'kind': kind, 'id': key >> KEY_BITS, 'title': title, 'snippet': snippet, 'score': round(score, 4)}
+            for key, kind, title, snippet, score in rows
+        ]
+    
+    @staticmethod
+    def search_for(user, query, kinds=None, limit=20, offset=0):
+        """SearchIndex.search() restricted to what user may see"""
+        querysets = {
+            kind: SEARCH_SOURCES[kind].visible(SEARCH_SOURCES[kind].model.objects.all(), user)
+            for kind in kinds or SEARCH_SOURCES
+        }
+        return SearchIndex.search_within(querysets, query, limit, offset)
+    
+    @staticmethod
+    def search_within(querysets, query, limit=20, offset=0):
+        """
+        SearchIndex.search() over the kinds in querysets ({kind: queryset}),
+        keeping only hits inside each kind's queryset.
+        
+        Filtered querysets become subqueries of index keys, so hits outside
+        them are dropped by the database before ranking and one query
+        gives the page.
+        """
+        if not querysets:
+            return []
+        scopes = {
+            kind: SearchIndex.keys_sql(queryset, kind)
+            for kind, queryset in querysets.items()
+            # Unfiltered querysets hold every indexed object of their kind
+            if queryset.query.has_filters()
+        }
+        return SearchIndex.search(query, list(querysets), limit, offset, scopes)
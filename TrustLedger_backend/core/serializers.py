@@ -8,7 +8,7 @@ class DepartmentSerializer(serializers.ModelSerializer):
     head_name = serializers.CharField(source='head.get_full_name', read_only=True)
     spent_amount = serializers.ReadOnlyField()
     remaining_budget = serializers.ReadOnlyField()
-    projects_count = serializers.SerializerMethodField()
+    projects_count = serializers.ReadOnlyField()
     
     class Meta:
         model = Department
@@ -18,17 +18,13 @@ class DepartmentSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
-    
-    def get_projects_count(self, obj):
-        """Get count of projects in this department"""
-        return obj.projects.count()
 
 
 class DepartmentListSerializer(serializers.ModelSerializer):
     """Simplified serializer for department lists"""
     spent_amount = serializers.ReadOnlyField()
     remaining_budget = serializers.ReadOnlyField()
-    projects_count = serializers.SerializerMethodField()
+    projects_count = serializers.ReadOnlyField()
     
     class Meta:
         model = Department
@@ -36,10 +32,6 @@ class DepartmentListSerializer(serializers.ModelSerializer):
             'id', 'name', 'budget', 'spent_amount', 'remaining_budget',
             'projects_count', 'created_at'
         ]
-    
-    def get_projects_count(self, obj):
-        """Get count of projects in this department"""
-        return obj.projects.count()
 
 
 class ImpactMetricSerializer(serializers.ModelSerializer):
@@ -292,3 +284,39 @@ class ProjectSpendingCreateSerializer(serializers.ModelSerializer):
             'project', 'amount', 'description', 'category', 'transaction_date',
             'supporting_documents', 'status'
         ]
+
+
+class ProjectSpendingReviewFilterSerializer(serializers.Serializer):
+    """Filter selecting spending records for a bulk review"""
+    project = serializers.IntegerField(required=False, min_value=1)
+    category = serializers.ChoiceField(choices=ProjectSpending.CATEGORY_CHOICES, required=False)
+    status = serializers.ChoiceField(choices=ProjectSpending.STATUS_CHOICES, required=False)
+    transaction_date_from = serializers.DateField(required=False)
+    transaction_date_to = serializers.DateField(required=False)
+    
+    LOOKUPS = {
+        'project': 'project_id',
+        'category': 'category',
+        'status': 'status',
+        'transaction_date_from': 'transaction_date__gte',
+        'transaction_date_to': 'transaction_date__lte',
+    }
+    
+    def to_internal_value(self, data):
+        """Translate the filter into queryset lookups"""
+        values = super().to_internal_value(data)
+        return {self.LOOKUPS[key]: value for key, value in values.items()}
+
+
+class ProjectSpendingBulkReviewSerializer(serializers.Serializer):
+    """Serializer for approving or rejecting many spending records at once"""
+    status = serializers.ChoiceField(choices=['approved', 'rejected'])
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    filter = ProjectSpendingReviewFilterSerializer(required=False)
+    rejection_reason = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def validate(self, attrs):
+        """Require an explicit selection so a bare request cannot touch every record"""
+        if not attrs.get('ids') and not attrs.get('filter'):
+            raise serializers.ValidationError("Provide either ids or a non-empty filter.")
+        return attrs
@@ -1,30 +1,101 @@
 """
 Services for anomaly detection and other business logic
 """
-from django.db.models import Q, Avg, Sum, Count
+import math
+import statistics
+from collections import defaultdict
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q, F, Avg, Sum, Count, Exists, OuterRef, ExpressionWrapper, DurationField, Case, When, Value
+from django.db.models.functions import Coalesce, ExtractYear
 from django.utils import timezone
-from datetime import timedelta, datetime
+from datetime import date, timedelta, datetime
 from decimal import Decimal
-from .models import Project, Department, CommunityFeedback
-from fund_flows.models import FundFlow, Anomaly, TrustIndicator
+from .cache import bump_data_version
+from .models import Project, Department, CommunityFeedback, ProjectSpending
+from .search_index import SEARCH_SOURCES, SearchIndex
+from .signals import transactions_bulk_changed
+from fund_flows.models import FundFlow, Anomaly, ProjectFlowStatistics, TrustIndicator
+
+
+# Fingerprints looked up per query when checking for open anomalies
+FINGERPRINT_LOOKUP_BATCH = 500
+
+
+def _create_new_anomalies(anomalies, details, attempts=3):
+    """
+    Insert the anomalies whose fingerprint is not already open and return
+    the details (one per anomaly) of those actually inserted.
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                fingerprints = [anomaly.fingerprint for anomaly in anomalies]
+                existing = set()
+                # Chunked to stay under the database's bound-parameter limit
+                for start in range(0, len(fingerprints), FINGERPRINT_LOOKUP_BATCH):
+                    existing.update(Anomaly.objects.filter(
+                        fingerprint__in=fingerprints[start:start + FINGERPRINT_LOOKUP_BATCH],
+                        resolved=False
+                    ).values_list('fingerprint', flat=True))
+                new = [
+                    (anomaly, detail) for anomaly, detail in zip(anomalies, details)
+                    if anomaly.fingerprint not in existing
+                ]
+                Anomaly.objects.bulk_create([anomaly for anomaly, _ in new], batch_size=1000)
+            return [detail for _, detail in new]
+        except IntegrityError:
+            # A concurrent run raised one of the same fingerprints after the
+            # check; look again so only rows inserted here are reported
+            if attempt == attempts - 1:
+                raise
+
+
+def _grouped_median(values, groups, starts, counts):
+    """Median of each contiguous group of values (groups must already be sorted)"""
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    lower = starts + (counts - 1) // 2
+    upper = starts + counts // 2
+    return (ordered[lower] + ordered[upper]) / 2
+
+
+def _in_range(queryset, field, id_range):
+    """Restrict a queryset to an inclusive (first, last) id range, if one is given"""
+    if id_range is None:
+        return queryset
+    first, last = id_range
+    return queryset.filter(**{f'{field}__gte': first, f'{field}__lte': last})
 
 
 class AnomalyDetectionService:
     """Service for detecting anomalies in fund flows and budgets"""
     
     @staticmethod
-    def detect_budget_overruns():
-        """Detect projects with budget overruns"""
-        anomalies = []
+    def detect_budget_overruns(project_range=None):
+        """Detect projects with budget overruns in a fixed number of queries"""
+        open_overrun = Anomaly.objects.filter(
+            fingerprint=Anomaly.fingerprint_expression('budget_overrun', 'project', OuterRef('pk')),
+            resolved=False,
+        )
         
-        # Find projects where spent > budget
-        overrun_projects = Project.objects.filter(
-            spent__gt=models.F('budget')
+        # One annotated query with an anti-join finds the overruns not yet reported
+        overrun_projects = (
+            _in_range(Project.objects.filter(spent__gt=F('budget')), 'pk', project_range)
+            .annotate(overrun_amount=F('spent') - F('budget'))
+            .filter(~Exists(open_overrun))
+            .only('id', 'name', 'budget', 'spent')
+            .order_by('pk')
+            .iterator(chunk_size=2000)
         )
         
+        anomalies = []
+        new_anomalies = []
         for project in overrun_projects:
-            overrun_amount = project.spent - project.budget
-            overrun_percentage = (overrun_amount / project.budget) * 100
+            overrun_amount = project.overrun_amount
+            # A project without budget is entirely overrun
+            overrun_percentage = (overrun_amount / project.budget) * 100 if project.budget else Decimal('100')
             
             severity = 'low'
             if overrun_percentage > 50:
@@ -34,103 +105,141 @@ class AnomalyDetectionService:
             elif overrun_percentage > 10:
                 severity = 'medium'
             
-            # Check if anomaly already exists
-            existing_anomaly = Anomaly.objects.filter(
-                fund_flow__target_project=project,
-                description__icontains='Budget overrun',
-                resolved=False
-            ).first()
-            
-            if not existing_anomaly:
-                # Create fund flow for the overrun
-                fund_flow = FundFlow.objects.create(
-                    source_id=1,  # Default source
-                    target_project=project,
-                    amount=overrun_amount,
-                    status='anomaly',
-                    description=f'Budget overrun detected: {overrun_percentage:.1f}% over budget',
-                    transaction_date=timezone.now().date()
-                )
-                
-                # Create anomaly
-                Anomaly.objects.create(
-                    fund_flow=fund_flow,
-                    description=f'Project "{project.name}" has exceeded budget by ₹{overrun_amount:,.2f} ({overrun_percentage:.1f}%)',
-                    severity=severity,
-                    detected_by_id=1  # System user
-                )
-                
-                anomalies.append({
-                    'project': project.name,
-                    'overrun_amount': float(overrun_amount),
-                    'overrun_percentage': float(overrun_percentage),
-                    'severity': severity
-                })
-        
-        return anomalies
+            new_anomalies.append(Anomaly(
+                project=project,
+                description=f'Project "{project.name}" has exceeded budget by ₹{overrun_amount:,.2f} ({overrun_percentage:.1f}%)',
+                severity=severity,
+                detected_by_id=1,  # System user
+                fingerprint=Anomaly.make_fingerprint('budget_overrun', 'project', project.pk),
+            ))
+            anomalies.append({
+                'project': project.name,
+                'overrun_amount': float(overrun_amount),
+                'overrun_percentage': float(overrun_percentage),
+                'severity': severity
+            })
+        
+        return _create_new_anomalies(new_anomalies, anomalies)
     
     @staticmethod
-    def detect_unusual_spending_patterns():
-        """Detect unusual spending patterns"""
-        anomalies = []
-        
-        # Find projects with sudden spending spikes
-        projects = Project.objects.filter(status='active')
+    def detect_unusual_spending_patterns(window_days=None, multiplier=None, baseline=None, min_transactions=None,
+                                         project_range=None):
+        """
+        Detect spending spikes across all active projects in one pass.
+        
+        Flows in the window are read as columns, each project's baseline is
+        computed with NumPy group reductions, and new anomalies are written
+        with bulk_create. Defaults come from settings.ANOMALY_DETECTION.
+        Pass project_range=(first_id, last_id) to scan one partition.
+        """
+        config = getattr(settings, 'ANOMALY_DETECTION', {})
+        if window_days is None:
+            window_days = config.get('SPIKE_WINDOW_DAYS', 30)
+        if multiplier is None:
+            multiplier = config.get('SPIKE_MULTIPLIER', 3)
+        if baseline is None:
+            baseline = config.get('SPIKE_BASELINE', 'mean')
+        if min_transactions is None:
+            min_transactions = config.get('SPIKE_MIN_TRANSACTIONS', 2)
+        if baseline not in ('mean', 'median'):
+            raise ValueError("baseline must be 'mean' or 'median'")
+        if window_days < 1:
+            raise ValueError('window_days must be at least 1')
+        
+        since = timezone.now().date() - timedelta(days=window_days)
+        rows = _in_range(FundFlow.objects.filter(
+            target_project__status='active',
+            transaction_date__gte=since
+        ), 'target_project_id', project_range).order_by('target_project_id', 'pk').values_list('pk', 'target_project_id', 'transaction_date', 'amount')
+        
+        flow_ids, project_ids, dates, amounts = [], [], [], []
+        for flow_id, project_id, transaction_date, amount in rows.iterator(chunk_size=5000):
+            flow_ids.append(flow_id)
+            project_ids.append(project_id)
+            dates.append(transaction_date.toordinal())
+            amounts.append(float(amount))
+        if not flow_ids:
+            return []
+        
+        flow_ids = np.array(flow_ids, dtype=np.int64)
+        project_ids = np.array(project_ids, dtype=np.int64)
+        dates = np.array(dates, dtype=np.int64)
+        amounts = np.array(amounts, dtype=np.float64)
+        
+        # Rows are ordered by project, so every project is one contiguous run
+        _, starts, counts = np.unique(project_ids, return_index=True, return_counts=True)
+        
+        if baseline == 'mean':
+            # Average daily spend over the window, as before
+            baselines = np.add.reduceat(amounts, starts) / window_days
+            thresholds = baselines * multiplier
+        else:
+            # Median plus a multiple of the (normal-consistent) MAD, robust to the spike itself
+            baselines = _grouped_median(amounts, project_ids, starts, counts)
+            deviations = np.abs(amounts - np.repeat(baselines, counts))
+            spread = 1.4826 * _grouped_median(deviations, project_ids, starts, counts)
+            # Fall back to the mean absolute deviation when over half the amounts are identical
+            mean_deviation = 1.2533 * np.add.reduceat(deviations, starts) / counts
+            spread = np.where(spread > 0, spread, mean_deviation)
+            thresholds = np.where(spread > 0, baselines + multiplier * spread, np.inf)
+        
+        thresholds = np.where(counts >= min_transactions, thresholds, np.inf)
+        row_baselines = np.repeat(baselines, counts)
+        row_thresholds = np.repeat(thresholds, counts)
+        spikes = np.flatnonzero(amounts > row_thresholds)
+        if not spikes.size:
+            return []
+        
+        projects = Project.objects.only('name').in_bulk({int(project_ids[i]) for i in spikes})
+        label = 'daily average' if baseline == 'mean' else 'median/MAD baseline'
         
-        for project in projects:
-            # Get recent fund flows for this project
-            recent_flows = FundFlow.objects.filter(
-                target_project=project,
-                transaction_date__gte=timezone.now().date() - timedelta(days=30)
-            ).order_by('transaction_date')
-            
-            if recent_flows.count() < 2:
-                continue
-            
-            # Calculate average daily spending
-            total_recent = sum(flow.amount for flow in recent_flows)
-            avg_daily = total_recent / 30
-            
-            # Check for spikes (3x average)
-            for flow in recent_flows:
-                if flow.amount > avg_daily * 3:
-                    # Check if anomaly already exists
-                    existing_anomaly = Anomaly.objects.filter(
-                        fund_flow=flow,
-                        description__icontains='Unusual spending spike',
-                        resolved=False
-                    ).first()
-                    
-                    if not existing_anomaly:
-                        Anomaly.objects.create(
-                            fund_flow=flow,
-                            description=f'Unusual spending spike detected: ₹{flow.amount:,.2f} on {flow.transaction_date} (3x daily average)',
-                            severity='medium',
-                            detected_by_id=1  # System user
-                        )
-                        
-                        anomalies.append({
-                            'project': project.name,
-                            'amount': float(flow.amount),
-                            'date': flow.transaction_date,
-                            'average_daily': float(avg_daily)
-                        })
-        
-        return anomalies
+        anomalies = []
+        new_anomalies = []
+        for i in spikes:
+            transaction_date = date.fromordinal(int(dates[i]))
+            new_anomalies.append(Anomaly(
+                fund_flow_id=int(flow_ids[i]),
+                description=f'Unusual spending spike detected: ₹{amounts[i]:,.2f} on {transaction_date} ({multiplier}x {label})',
+                severity='medium',
+                detected_by_id=1,  # System user
+                fingerprint=Anomaly.make_fingerprint('spending_spike', 'fund_flow', int(flow_ids[i])),
+            ))
+            anomalies.append({
+                'project': projects[int(project_ids[i])].name,
+                'amount': float(amounts[i]),
+                'date': transaction_date,
+                'baseline': float(row_baselines[i]),
+                'threshold': float(row_thresholds[i]),
+            })
+        
+        # Spikes already flagged by an earlier run or on write are left out
+        return _create_new_anomalies(new_anomalies, anomalies)
     
     @staticmethod
-    def detect_delayed_projects():
+    def detect_delayed_projects(project_range=None):
         """Detect projects that are significantly delayed"""
-        anomalies = []
+        today = timezone.now().date()
+        open_delay = Anomaly.objects.filter(
+            fingerprint=Anomaly.fingerprint_expression('project_delay', 'project', OuterRef('pk')),
+            resolved=False,
+        )
         
-        # Find projects that should have been completed but aren't
-        overdue_projects = Project.objects.filter(
-            status__in=['planning', 'active'],
-            end_date__lt=timezone.now().date()
+        # Projects that should have been completed but aren't, and are not yet reported
+        overdue_projects = (
+            _in_range(Project.objects.filter(
+                status__in=['planning', 'active'],
+                end_date__lt=today
+            ), 'pk', project_range)
+            .filter(~Exists(open_delay))
+            .only('id', 'name', 'end_date')
+            .order_by('pk')
+            .iterator(chunk_size=2000)
         )
         
+        anomalies = []
+        new_anomalies = []
         for project in overdue_projects:
-            days_overdue = (timezone.now().date() - project.end_date).days
+            days_overdue = (today - project.end_date).days
             
             severity = 'low'
             if days_overdue > 90:
@@ -140,48 +249,34 @@ class AnomalyDetectionService:
             elif days_overdue > 30:
                 severity = 'medium'
             
-            # Check if anomaly already exists
-            existing_anomaly = Anomaly.objects.filter(
-                fund_flow__target_project=project,
-                description__icontains='Project delay',
-                resolved=False
-            ).first()
-            
-            if not existing_anomaly:
-                # Create fund flow for the delay
-                fund_flow = FundFlow.objects.create(
-                    source_id=1,  # Default source
-                    target_project=project,
-                    amount=0,  # No financial impact, just tracking
-                    status='anomaly',
-                    description=f'Project delay detected: {days_overdue} days overdue',
-                    transaction_date=timezone.now().date()
-                )
-                
-                # Create anomaly
-                Anomaly.objects.create(
-                    fund_flow=fund_flow,
-                    description=f'Project "{project.name}" is {days_overdue} days overdue (end date: {project.end_date})',
-                    severity=severity,
-                    detected_by_id=1  # System user
-                )
-                
-                anomalies.append({
-                    'project': project.name,
-                    'days_overdue': days_overdue,
-                    'end_date': project.end_date,
-                    'severity': severity
-                })
-        
-        return anomalies
+            new_anomalies.append(Anomaly(
+                project=project,
+                description=f'Project "{project.name}" is {days_overdue} days overdue (end date: {project.end_date})',
+                severity=severity,
+                detected_by_id=1,  # System user
+                fingerprint=Anomaly.make_fingerprint('project_delay', 'project', project.pk),
+            ))
+            anomalies.append({
+                'project': project.name,
+                'days_overdue': days_overdue,
+                'end_date': project.end_date,
+                'severity': severity
+            })
+        
+        return _create_new_anomalies(new_anomalies, anomalies)
+    
+    DETECTORS = {
+        'budget_overruns': 'detect_budget_overruns',
+        'unusual_spending': 'detect_unusual_spending_patterns',
+        'delayed_projects': 'detect_delayed_projects',
+    }
     
     @staticmethod
-    def run_all_detections():
-        """Run all anomaly detection methods"""
+    def run_all_detections(project_range=None):
+        """Run all anomaly detection methods, optionally over one project id range"""
         results = {
-            'budget_overruns': AnomalyDetectionService.detect_budget_overruns(),
-            'unusual_spending': AnomalyDetectionService.detect_unusual_spending_patterns(),
-            'delayed_projects': AnomalyDetectionService.detect_delayed_projects(),
+            name: getattr(AnomalyDetectionService, method)(project_range=project_range)
+            for name, method in AnomalyDetectionService.DETECTORS.items()
         }
         
         total_anomalies = sum(len(anomalies) for anomalies in results.values())
@@ -190,75 +285,320 @@ class AnomalyDetectionService:
         return results
 
 
+class StreamingAnomalyDetector:
+    """
+    Score new fund flows and spending records as they are written.
+    
+    Each project keeps one ProjectFlowStatistics row per stream, so a new
+    amount is compared with the project's history and folded into it in
+    constant time. Spikes use the same SPIKE_MULTIPLIER and SPIKE_BASELINE
+    settings as the batch detector and share its fingerprints, so a flow
+    flagged here is not raised again by the nightly run.
+    """
+    
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'ANOMALY_DETECTION', {}).get('STREAM_ENABLED', True)
+    
+    @staticmethod
+    def _subject(instance):
+        """(stream, project_id, subject field, fingerprint subject type) for a scored instance"""
+        if isinstance(instance, FundFlow):
+            if instance.target_project_id is None:
+                return None
+            return 'fund_flow', instance.target_project_id, 'fund_flow', 'fund_flow'
+        if isinstance(instance, ProjectSpending):
+            return 'spending', instance.project_id, 'spending_record', 'spending_record'
+        return None
+    
+    @staticmethod
+    def threshold(stats, multiplier, baseline, min_observations):
+        """Amount above which the next transaction counts as a spike, or None while history is too short"""
+        if stats.count < min_observations:
+            return None
+        if baseline == 'median':
+            center = statistics.median(stats.recent)
+            spread = 1.4826 * statistics.median(abs(amount - center) for amount in stats.recent)
+        else:
+            center = stats.mean
+            spread = math.sqrt(stats.variance)
+        # Identical history: anything well above the usual amount is a spike
+        return center + multiplier * spread if spread > 0 else center * multiplier
+    
+    @classmethod
+    def observe(cls, instance):
+        """Score and record one new transaction"""
+        return cls.observe_many([instance])
+    
+    @classmethod
+    def observe_many(cls, instances):
+        """Score and record new transactions in order, returning the anomalies raised"""
+        scored = [(instance, cls._subject(instance)) for instance in instances]
+        scored = [(instance, subject) for instance, subject in scored if subject is not None]
+        if not scored:
+            return []
+        
+        config = getattr(settings, 'ANOMALY_DETECTION', {})
+        multiplier = config.get('SPIKE_MULTIPLIER', 3)
+        baseline = config.get('SPIKE_BASELINE', 'mean')
+        min_observations = config.get('STREAM_MIN_OBSERVATIONS', 5)
+        recent_size = config.get('STREAM_RECENT_SIZE', 20)
+        
+        keys = {(stream, project_id) for _, (stream, project_id, _, _) in scored}
+        new_anomalies = []
+        with transaction.atomic():
+            ProjectFlowStatistics.objects.bulk_create(
+                [ProjectFlowStatistics(stream=stream, project_id=project_id) for stream, project_id in keys],
+                ignore_conflicts=True,
+            )
+            # Row locks serialise concurrent writers to the same project and stream
+            stats = {
+                (row.stream, row.project_id): row
+                for row in ProjectFlowStatistics.objects.select_for_update().filter(
+                    project_id__in={project_id for _, project_id in keys},
+                    stream__in={stream for stream, _ in keys},
+                )
+            }
+            
+            for instance, (stream, project_id, subject_field, subject_type) in scored:
+                row = stats[(stream, project_id)]
+                limit = cls.threshold(row, multiplier, baseline, min_observations)
+                amount = float(instance.amount)
+                if limit is not None and amount > limit:
+                    severity = 'high' if amount > 2 * limit else 'medium'
+                    new_anomalies.append(Anomaly(
+                        description=(
+                            f'Unusual spending spike detected: ₹{amount:,.2f} on {instance.transaction_date} '
+                            f'(threshold ₹{limit:,.2f} from {row.count} prior transactions)'
+                        ),
+                        severity=severity,
+                        detected_by_id=1,  # System user
+                        fingerprint=Anomaly.make_fingerprint('spending_spike', subject_type, instance.pk),
+                        **{f'{subject_field}_id': instance.pk},
+                    ))
+                row.observe(amount, recent_size)
+            
+            # bulk_update skips auto_now, so stamp the rows explicitly
+            now = timezone.now()
+            for row in stats.values():
+                row.updated_at = now
+            ProjectFlowStatistics.objects.bulk_update(list(stats.values()), ['count', 'mean', 'm2', 'recent', 'updated_at'])
+            new_anomalies = _create_new_anomalies(new_anomalies, new_anomalies)
+        return new_anomalies
+    
+    @staticmethod
+    def rebuild(project_ids=None):
+        """Recompute the running statistics from stored transactions, streaming rows per stream"""
+        recent_size = getattr(settings, 'ANOMALY_DETECTION', {}).get('STREAM_RECENT_SIZE', 20)
+        sources = {
+            'fund_flow': FundFlow.objects.filter(target_project__isnull=False)
+            .values_list('target_project_id', 'amount').order_by('target_project_id', 'transaction_date', 'pk'),
+            'spending': ProjectSpending.objects.values_list('project_id', 'amount')
+            .order_by('project_id', 'transaction_date', 'pk'),
+        }
+        with transaction.atomic():
+            existing = ProjectFlowStatistics.objects.all()
+            if project_ids is not None:
+                existing = existing.filter(project_id__in=project_ids)
+            existing.delete()
+            
+            rebuilt = []
+            for stream, rows in sources.items():
+                if project_ids is not None:
+                    field = 'target_project_id' if stream == 'fund_flow' else 'project_id'
+                    rows = rows.filter(**{f'{field}__in': project_ids})
+                current = None
+                for project_id, amount in rows.iterator(chunk_size=5000):
+                    if current is None or current.project_id != project_id:
+                        current = ProjectFlowStatistics(project_id=project_id, stream=stream)
+                        rebuilt.append(current)
+                    current.observe(amount, recent_size)
+            ProjectFlowStatistics.objects.bulk_create(rebuilt, batch_size=1000)
+        return len(rebuilt)
+
+
+class SpendingReviewService:
+    """Service for approving or rejecting spending records in batches"""
+    
+    @staticmethod
+    def review(queryset, new_status, user, ids=None, rejection_reason=''):
+        """
+        Move every record in queryset (optionally narrowed to ids) to new_status
+        with one UPDATE, then apply the change in approved amounts to each
+        affected project exactly once.
+        """
+        now = timezone.now()
+        applied = []
+        skipped = []
+        spent_deltas = defaultdict(Decimal)
+        
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        
+        with transaction.atomic():
+            rows = list(
+                queryset.select_for_update().order_by('pk').values_list('pk', *ProjectSpending.FACT_FIELDS)
+            )
+            
+            fact_changes = []
+            for pk, *fact_values in rows:
+                old = dict(zip(ProjectSpending.FACT_FIELDS, fact_values))
+                project_id, old_status, amount = old['project_id'], old['status'], old['amount']
+                if old_status == new_status:
+                    skipped.append({'id': pk, 'reason': f'already {new_status}'})
+                    continue
+                applied.append(pk)
+                fact_changes.append((old, {**old, 'status': new_status}))
+                if new_status == 'approved':
+                    spent_deltas[project_id] += amount
+                elif old_status == 'approved':
+                    spent_deltas[project_id] -= amount
+            
+            if applied:
+                changes = {'status': new_status, 'updated_at': now}
+                if new_status == 'approved':
+                    changes.update(approved_by=user, approved_at=now)
+                else:
+                    changes.update(approved_by=None, approved_at=None, rejection_reason=rejection_reason)
+                ProjectSpending.objects.filter(pk__in=applied).update(**changes)
+            
+            for project_id, delta in spent_deltas.items():
+                if delta:
+                    Project.apply_spent_delta(project_id, delta)
+            
+            if fact_changes:
+                transactions_bulk_changed.send(sender=ProjectSpending, changes=fact_changes)
+        
+        if ids is not None:
+            found = {row[0] for row in rows}
+            skipped.extend({'id': pk, 'reason': 'not found'} for pk in ids if pk not in found)
+        
+        return {
+            'status': new_status,
+            'applied': applied,
+            'applied_count': len(applied),
+            'skipped': skipped,
+            'skipped_count': len(skipped),
+            'projects_updated': len([delta for delta in spent_deltas.values() if delta]),
+        }
+
+
 class TrustScoreCalculator:
-    """Service for calculating trust scores"""
+    """
+    Service for calculating trust scores.
+    
+    All four sub-scores are derived from per-department aggregates: project
+    counts come from the Department rollup columns, and feedback and
+    document figures come from one GROUP BY query each. Scoring any number
+    of departments therefore takes a constant number of queries.
+    
+    Every calculation appends a new TrustIndicator, so the table holds each
+    department's score history.
+    """
     
     @staticmethod
     def calculate_department_trust_score(department):
         """Calculate trust score for a department"""
-        # Transparency score (based on document completeness and verification)
-        transparency_score = TrustScoreCalculator._calculate_transparency_score(department)
-        
-        # Community oversight score (based on feedback and responses)
-        community_score = TrustScoreCalculator._calculate_community_score(department)
-        
-        # Response time score (based on how quickly they respond to feedback)
-        response_score = TrustScoreCalculator._calculate_response_score(department)
-        
-        # Document completeness score
-        document_score = TrustScoreCalculator._calculate_document_score(department)
-        
-        # Create or update trust indicator
-        trust_indicator, created = TrustIndicator.objects.get_or_create(
-            department=department,
-            defaults={
-                'transparency_score': transparency_score,
-                'community_oversight_score': community_score,
-                'response_time_score': response_score,
-                'document_completeness_score': document_score,
-            }
-        )
+        return TrustScoreCalculator.calculate_trust_scores(
+            Department.objects.filter(pk=department.pk)
+        )[department.pk]
+    
+    @staticmethod
+    def calculate_trust_scores(departments=None):
+        """Score every department in the queryset and return {department_id: TrustIndicator}"""
+        from documents.models import Document
+        
+        if departments is None:
+            departments = Department.objects.all()
+        departments = list(departments.only('id', 'projects_count', 'completed_projects_count'))
+        if not departments:
+            return {}
+        department_ids = [department.pk for department in departments]
+        
+        feedback = {
+            row['department_id']: row
+            for row in CommunityFeedback.objects.filter(department_id__in=department_ids)
+            .order_by().values('department_id').annotate(
+                public_count=Count('id', filter=Q(is_public=True)),
+                responded_count=Count('id', filter=Q(status__in=['responded', 'resolved'])),
+                avg_response_time=Avg(
+                    ExpressionWrapper(F('responded_at') - F('created_at'), output_field=DurationField()),
+                    filter=Q(responded_at__isnull=False),
+                ),
+            )
+        }
+        documents = {
+            row['project__department_id']: row
+            for row in Document.objects.filter(project__department_id__in=department_ids)
+            .order_by().values('project__department_id').annotate(
+                total=Count('id'),
+                verified=Count('id', filter=Q(verified=True)),
+            )
+        }
         
-        if not created:
-            trust_indicator.transparency_score = transparency_score
-            trust_indicator.community_oversight_score = community_score
-            trust_indicator.response_time_score = response_score
-            trust_indicator.document_completeness_score = document_score
-            trust_indicator.save()
+        indicators = {}
+        for department in departments:
+            department_feedback = feedback.get(department.pk, {})
+            department_documents = documents.get(department.pk, {})
+            scores = {
+                'transparency_score': TrustScoreCalculator._transparency_score(
+                    department.projects_count, department.completed_projects_count
+                ),
+                'community_oversight_score': TrustScoreCalculator._community_score(
+                    department_feedback.get('public_count', 0), department_feedback.get('responded_count', 0)
+                ),
+                'response_time_score': TrustScoreCalculator._response_score(
+                    department_feedback.get('avg_response_time')
+                ),
+                'document_completeness_score': TrustScoreCalculator._document_score(
+                    department.projects_count, department_documents.get('total', 0), department_documents.get('verified', 0)
+                ),
+            }
+            indicators[department.pk] = TrustIndicator(department=department, **scores)
         
-        return trust_indicator
+        TrustIndicator.objects.bulk_create(indicators.values(), batch_size=500)
+        # bulk_create sends no post_save, so invalidate cached summaries here
+        bump_data_version(TrustIndicator.CACHE_NAMESPACE)
+        return indicators
+    
+    @staticmethod
+    def recalculate_dirty(departments=None):
+        """
+        Score only the departments flagged as changed since their last calculation.
+        
+        Flags are cleared before scoring, so a write that lands mid-calculation
+        flags its department again for the next run instead of being lost. If
+        scoring fails the departments are flagged again before the error is
+        raised.
+        """
+        if departments is None:
+            departments = Department.objects.all()
+        with transaction.atomic():
+            department_ids = list(
+                departments.filter(trust_score_dirty=True).select_for_update().values_list('pk', flat=True)
+            )
+            Department.objects.filter(pk__in=department_ids).update(trust_score_dirty=False)
+        if not department_ids:
+            return {}
+        try:
+            return TrustScoreCalculator.calculate_trust_scores(Department.objects.filter(pk__in=department_ids))
+        except Exception:
+            Department.mark_trust_dirty(pk__in=department_ids)
+            raise
     
     @staticmethod
-    def _calculate_transparency_score(department):
+    def _transparency_score(total_projects, completed_projects):
         """Calculate transparency score based on project visibility"""
-        projects = department.projects.all()
-        if not projects.exists():
+        if not total_projects:
             return 50  # Neutral score for departments with no projects
         
-        # Score based on project status distribution
-        total_projects = projects.count()
-        completed_projects = projects.filter(status='completed').count()
-        active_projects = projects.filter(status='active').count()
-        
         # Higher score for more completed projects
         completion_ratio = completed_projects / total_projects
         return min(int(completion_ratio * 100), 100)
     
     @staticmethod
-    def _calculate_community_score(department):
+    def _community_score(feedback_count, responded_count):
         """Calculate community oversight score"""
-        # Count public feedback for this department
-        feedback_count = CommunityFeedback.objects.filter(
-            department=department,
-            is_public=True
-        ).count()
-        
-        # Count responses to feedback
-        responded_count = CommunityFeedback.objects.filter(
-            department=department,
-            status__in=['responded', 'resolved']
-        ).count()
-        
         if feedback_count == 0:
             return 50  # Neutral score if no feedback
         
@@ -266,23 +606,12 @@ class TrustScoreCalculator:
         return min(int(response_ratio * 100), 100)
     
     @staticmethod
-    def _calculate_response_score(department):
-        """Calculate response time score"""
-        feedback_with_responses = CommunityFeedback.objects.filter(
-            department=department,
-            responded_at__isnull=False
-        )
-        
-        if not feedback_with_responses.exists():
+    def _response_score(avg_response_time):
+        """Calculate response time score from the average time to respond"""
+        if avg_response_time is None:
             return 50  # Neutral score if no responses
         
-        # Calculate average response time
-        total_response_time = 0
-        for feedback in feedback_with_responses:
-            response_time = feedback.responded_at - feedback.created_at
-            total_response_time += response_time.total_seconds()
-        
-        avg_response_hours = total_response_time / (feedback_with_responses.count() * 3600)
+        avg_response_hours = avg_response_time.total_seconds() / 3600
         
         # Score based on response time (lower is better)
         if avg_response_hours < 24:
@@ -295,20 +624,11 @@ class TrustScoreCalculator:
             return 40
     
     @staticmethod
-    def _calculate_document_score(department):
+    def _document_score(total_projects, total_documents, verified_documents):
         """Calculate document completeness score"""
-        projects = department.projects.all()
-        if not projects.exists():
+        if not total_projects:
             return 50
         
-        total_documents = 0
-        verified_documents = 0
-        
-        for project in projects:
-            project_docs = project.documents.all()
-            total_documents += project_docs.count()
-            verified_documents += project_docs.filter(verified=True).count()
-        
         if total_documents == 0:
             return 30  # Low score if no documents
         
@@ -319,18 +639,42 @@ class TrustScoreCalculator:
 class SearchService:
     """Service for advanced search functionality"""
     
+    # Keyset ordering of transaction results; id breaks ties within a day
+    TRANSACTION_ORDERING = ('-transaction_date', '-id')
+    
+    # Facet columns of global search per kind, by facet name
+    FACETS = {
+        'fund_flow': {
+            'status': F('status'),
+            'department': Coalesce('target_department_id', 'target_project__department_id'),
+            'year': ExtractYear('transaction_date'),
+            'verification': Case(When(verified_by__isnull=True, then=Value('unverified')), default=Value('verified')),
+        },
+        'project': {
+            'status': F('status'),
+            'department': F('department_id'),
+            'year': ExtractYear('start_date'),
+        },
+        'document': {
+            'document_type': F('document_type'),
+            'department': Coalesce('project__department_id', 'fund_flow__target_department_id'),
+            'year': ExtractYear('uploaded_at'),
+            'verification': Case(When(verified=True, then=Value('verified')), default=Value('unverified')),
+        },
+        'feedback': {
+            'status': F('status'),
+            'department': F('department_id'),
+            'year': ExtractYear('created_at'),
+        },
+    }
+    
     @staticmethod
     def search_transactions(query, filters=None):
         """Search transactions with advanced filters"""
-        queryset = FundFlow.objects.all()
+        queryset = FundFlow.objects.select_related('source', 'target_department', 'target_project__department')
         
         if query:
-            queryset = queryset.filter(
-                Q(description__icontains=query) |
-                Q(source__name__icontains=query) |
-                Q(target_department__name__icontains=query) |
-                Q(target_project__name__icontains=query)
-            )
+            queryset = SearchIndex.filter(queryset, 'fund_flow', query)
         
         if filters:
             if filters.get('department_id'):
@@ -354,7 +698,7 @@ class SearchService:
                 elif filters['verification_status'] == 'unverified':
                     queryset = queryset.filter(verified_by__isnull=True)
         
-        return queryset.order_by('-transaction_date')
+        return queryset.order_by(*SearchService.TRANSACTION_ORDERING)
     
     @staticmethod
     def search_projects(query, filters=None):
@@ -362,11 +706,7 @@ class SearchService:
         queryset = Project.objects.all()
         
         if query:
-            queryset = queryset.filter(
-                Q(name__icontains=query) |
-                Q(description__icontains=query) |
-                Q(department__name__icontains=query)
-            )
+            queryset = SearchIndex.filter(queryset, 'project', query)
         
         if filters:
             if filters.get('department_id'):
@@ -382,3 +722,51 @@ class SearchService:
                 queryset = queryset.filter(budget__lte=filters['max_budget'])
         
         return queryset.order_by('-created_at')
+    
+    @staticmethod
+    def global_search(user, query, kinds=None, filters=None, limit=20, offset=0):
+        """
+        Ranked hits across every searchable kind plus facet counts over all
+        of the user's matches.
+        
+        filters maps facet names to values; kinds without that facet drop
+        out. Hits come from one ranked index query and each kind's facets
+        from one GROUP BY over its facet columns, rolled up here.
+        """
+        filters = filters or {}
+        scoped, matched = {}, {}
+        for kind in kinds or SEARCH_SOURCES:
+            facets = SearchService.FACETS[kind]
+            if any(name not in facets for name in filters):
+                continue
+            source = SEARCH_SOURCES[kind]
+            queryset = source.visible(source.model.objects.all(), user)
+            if filters:
+                queryset = queryset.alias(
+                    **{f'facet_{name}': facets[name] for name in filters}
+                ).filter(**{f'facet_{name}': value for name, value in filters.items()})
+            scoped[kind] = queryset
+            matched[kind] = SearchIndex.filter(queryset, kind, query)
+        
+        counts = defaultdict(lambda: defaultdict(int))
+        for kind, queryset in matched.items():
+            columns = {f'facet_{name}': expression for name, expression in SearchService.FACETS[kind].items()}
+            for row in queryset.order_by().values(**columns).annotate(total=Count('pk')):
+                counts['kind'][kind] += row['total']
+                for column in columns:
+                    if row[column] is not None:
+                        counts[column[len('facet_'):]][row[column]] += row['total']
+        
+        departments = dict(Department.objects.filter(pk__in=counts['department']).values_list('id', 'name'))
+        facets = {
+            name: [
+                {'value': value, 'count': count, **({'name': departments.get(value)} if name == 'department' else {})}
+                for value, count in sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+            ]
+            for name, values in counts.items()
+        }
+        return {
+            'results': SearchIndex.search_within(scoped, query, limit, offset),
+            'total': sum(counts['kind'].values()),
+            'facets': facets,
+        }
@@ -0,0 +1,154 @@
+"""
+Signal handlers that keep denormalized data in step with writes
+"""
+import threading
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from documents.models import Document
+from fund_flows.models import FundFlow, FundSource
+from . import autocomplete
+from .models import CommunityFeedback, Department, Project, ProjectSpending
+from .search_index import KINDS_BY_MODEL, SEARCH_SOURCES, SearchIndex
+
+# Sent after bulk writes that bypass post_save (bulk_create, queryset.update)
+# with sender=<model> and changes=[(old, new), ...], where old and new are
+# dicts of the model's FACT_FIELDS (None for created or deleted records).
+transactions_bulk_changed = Signal()
+
+# Index kinds embedding each model's name, with the lookup from the kind to it
+RENAME_DEPENDENTS = {
+    FundSource: {'fund_flow': 'source', 'document': 'fund_flow__source'},
+    Department: {'project': 'department', 'fund_flow': 'target_department'},
+    Project: {'fund_flow': 'target_project', 'document': 'project'},
+}
+
+# Objects renamed on this thread whose dependents are not yet re-indexed; a
+# rename rolled back with its savepoint is harmlessly re-indexed with the next
+_pending_renames = threading.local()
+
+
+@receiver(post_delete, sender=Project)
+def remove_project_from_department_rollups(sender, instance, **kwargs):
+    """Subtract a deleted project's contribution from its department rollups"""
+    Department.apply_rollup_delta(instance.department_id, {
+        field: -value for field, value in instance.rollup_contribution().items()
+    })
+
+
+@receiver(post_delete, sender=ProjectSpending)
+def remove_spending_from_project_spent(sender, instance, origin=None, **kwargs):
+    """Subtract a deleted approved spending record from its project"""
+    # When the project itself is being deleted its own handler settles the rollups
+    if _deletion_started_by(origin, (Project, Department)):
+        return
+    
+    contribution = instance.spent_contribution()
+    if contribution:
+        Project.apply_spent_delta(instance.project_id, -contribution)
+
+
+@receiver(post_save, sender=CommunityFeedback)
+@receiver(post_delete, sender=CommunityFeedback)
+def mark_feedback_department_trust_dirty(sender, instance, **kwargs):
+    """Feedback and responses feed the community and response-time scores"""
+    if instance.department_id:
+        Department.mark_trust_dirty(pk=instance.department_id)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def mark_document_department_trust_dirty(sender, instance, **kwargs):
+    """Project documents feed the document completeness score"""
+    if instance.project_id:
+        Department.mark_trust_dirty(projects=instance.project_id)
+
+
+@receiver(post_save, sender=FundFlow)
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=CommunityFeedback)
+def index_for_search(sender, instance, **kwargs):
+    """Write the object's full-text index row in the same transaction"""
+    SearchIndex.index_objects([instance])
+
+
+@receiver(post_delete, sender=FundFlow)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Document)
+@receiver(post_delete, sender=CommunityFeedback)
+def remove_from_search_index(sender, instance, **kwargs):
+    SearchIndex.remove(KINDS_BY_MODEL[sender], [instance.pk])
+
+
+@receiver(pre_save, sender=FundSource)
+@receiver(pre_save, sender=Department)
+@receiver(pre_save, sender=Project)
+def remember_indexed_name(sender, instance, update_fields=None, **kwargs):
+    """Note the stored name so a rename can re-index the rows that embed it"""
+    instance._indexed_name = None
+    if instance.pk and (update_fields is None or 'name' in update_fields):
+        instance._indexed_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=FundSource)
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Project)
+def reindex_after_rename(sender, instance, created, **kwargs):
+    """Flows, projects and documents carry source, department and project names in their rows"""
+    old_name = getattr(instance, '_indexed_name', None)
+    if created or old_name is None or old_name == instance.name:
+        return
+    
+    # Dependents can run to thousands of rows: re-index them once the rename
+    # commits, together with any other renames in the same transaction
+    if not hasattr(_pending_renames, 'pks'):
+        _pending_renames.pks = defaultdict(set)
+    _pending_renames.pks[sender].add(instance.pk)
+    transaction.on_commit(reindex_renamed_dependents, robust=True)
+
+
+def reindex_renamed_dependents():
+    """Re-index the rows embedding every pending renamed name, one pass per index kind"""
+    pending = getattr(_pending_renames, 'pks', None)
+    if not pending:
+        return
+    _pending_renames.pks = defaultdict(set)
+    conditions = defaultdict(Q)
+    for model, pks in pending.items():
+        for kind, lookup in RENAME_DEPENDENTS[model].items():
+            conditions[kind] |= Q(**{f'{lookup}__in': pks})
+    for kind, condition in conditions.items():
+        SearchIndex.index_queryset(kind, SEARCH_SOURCES[kind].model.objects.filter(condition))
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=FundSource)
+@receiver(post_save, sender=get_user_model())
+def update_autocomplete_index(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Patch the in-memory name index once the write commits"""
+    if raw:
+        return
+    if update_fields and not autocomplete.INDEXED_FIELDS[autocomplete.kind_of(sender)] & set(update_fields):
+        # e.g. the last_login update on every sign-in
+        return
+    transaction.on_commit(lambda: autocomplete.index_object(instance), robust=True)
+
+
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=FundSource)
+@receiver(post_delete, sender=get_user_model())
+def remove_from_autocomplete_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete.remove_object(sender, pk), robust=True)
+
+
+def _deletion_started_by(origin, models):
+    """Whether a cascading delete originated from one of the given models"""
+    return isinstance(origin, models) or getattr(origin, 'model', None) in models
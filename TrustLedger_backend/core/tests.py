@@ -1,3 +1,1904 @@
-from django.test import TestCase
+import json
+import random
+import statistics
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import close_old_connections, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from analytics.models import DashboardMetrics, SearchFilter, SpendingFact
+from analytics.services import DashboardSnapshotService, SpendingCubeService
+from documents.models import Document
+from fund_flows import tracing
+from fund_flows.layout import count_crossings, sankey_layout
+from fund_flows.models import Anomaly, FundFlow, FundSource, ProjectFlowStatistics, TrustIndicator
+from . import autocomplete
+from .batch import detect_anomalies_in_range, id_ranges, run_partitioned
+from .cache import bump_data_version, change_key
+from .ingest import BulkImportService
+from .models import CommunityFeedback, Department, Project, ProjectSpending
+from .pagination import encode_cursor
+from .search_index import CACHE_NAMESPACE as SEARCH_CACHE_NAMESPACE, SQLiteSearchBackend, SearchIndex
+from .services import (
+    AnomalyDetectionService, SearchService, SpendingReviewService, StreamingAnomalyDetector, TrustScoreCalculator,
+    _create_new_anomalies,
+)
+from .signals import reindex_renamed_dependents
+
+User = get_user_model()
+
+
+def make_project(department, **kwargs):
+    defaults = {
+        'name': 'Road Repair',
+        'description': 'Resurface the ring road',
+        'budget': Decimal('100000.00'),
+        'status': 'active',
+        'start_date': date(2025, 1, 1),
+        'department': department,
+    }
+    defaults.update(kwargs)
+    return Project.objects.create(**defaults)
+
+
+def make_spending(project, user, amount, **kwargs):
+    return ProjectSpending.objects.create(
+        project=project,
+        amount=Decimal(amount),
+        description='Asphalt',
+        category='materials',
+        transaction_date=date(2025, 2, 1),
+        created_by=user,
+        **kwargs
+    )
+
+
+class DepartmentRollupTests(TestCase):
+    """Department spend and project counts follow project writes"""
+    
+    def setUp(self):
+        self.works = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.health = Department.objects.create(name='Health', budget=Decimal('500000.00'))
+    
+    def assertRollups(self, department, spent, projects, active, completed):
+        department.refresh_from_db()
+        self.assertEqual(
+            [department.spent_amount, department.projects_count,
+             department.active_projects_count, department.completed_projects_count],
+            [Decimal(spent), projects, active, completed],
+        )
+    
+    def test_saves_moves_and_deletes(self):
+        project = make_project(self.works, spent=Decimal('100.00'))
+        make_project(self.works, status='planning', spent=Decimal('40.00'))
+        self.assertRollups(self.works, '100.00', 2, 1, 0)
+        
+        project.status = 'completed'
+        project.save()
+        self.assertRollups(self.works, '100.00', 2, 0, 1)
+        
+        project.status = 'cancelled'
+        project.save()
+        self.assertRollups(self.works, '0.00', 2, 0, 0)
+        
+        project.status = 'active'
+        project.department = self.health
+        project.save()
+        self.assertRollups(self.works, '0.00', 1, 0, 0)
+        self.assertRollups(self.health, '100.00', 1, 1, 0)
+        
+        project.delete()
+        self.assertRollups(self.health, '0.00', 0, 0, 0)
+    
+    def test_stale_instances_apply_their_changes_in_turn(self):
+        project = make_project(self.works, spent=Decimal('100.00'))
+        first = Project.objects.get(pk=project.pk)
+        second = Project.objects.get(pk=project.pk)
+        first.status = 'completed'
+        first.save()
+        second.status = 'completed'
+        second.save()
+        self.assertRollups(self.works, '100.00', 1, 0, 1)
+    
+    def test_rebuild_command_reports_and_repairs_drift(self):
+        make_project(self.works, spent=Decimal('100.00'))
+        # Queryset updates bypass the rollups
+        Project.objects.update(status='completed')
+        
+        out = StringIO()
+        call_command('rebuild_department_rollups', '--dry-run', stdout=out)
+        self.assertIn('Found 2 drifted rollups across 1 departments.', out.getvalue())
+        self.assertRollups(self.works, '100.00', 1, 1, 0)
+        
+        call_command('rebuild_department_rollups', stdout=StringIO())
+        self.assertRollups(self.works, '100.00', 1, 0, 1)
+        out = StringIO()
+        call_command('rebuild_department_rollups', stdout=out)
+        self.assertIn('Department rollups are in sync.', out.getvalue())
+    
+    def test_department_list_is_one_page_query(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='citizen', password='x'))
+        for i in range(5):
+            make_project(self.works, name=f'Project {i}', spent=Decimal('10.00'))
+            department = Department.objects.create(name=f'Department {i}', budget=Decimal('1000.00'))
+            make_project(department, name=f'Other {i}')
+        
+        # The page count and the page itself, however many departments and projects
+        with self.assertNumQueries(2):
+            response = client.get(reverse('department-list'))
+        self.assertEqual(response.status_code, 200)
+        rows = {row['name']: row for row in response.data['results']}
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows['Public Works']['projects_count'], 5)
+        self.assertEqual(Decimal(rows['Public Works']['spent_amount']), Decimal('50.00'))
+
+
+class ProjectSpentMaintenanceTests(TestCase):
+    """Project.spent follows approved spending records through deltas"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.project = make_project(self.department)
+    
+    def assertSpent(self, expected):
+        self.project.refresh_from_db()
+        self.department.refresh_from_db()
+        self.assertEqual(self.project.spent, Decimal(expected))
+        self.assertEqual(self.department.spent_amount, Decimal(expected))
+    
+    def test_status_crossings_and_amount_edits(self):
+        spending = make_spending(self.project, self.user, '250.00')
+        self.assertSpent('0.00')
+        
+        spending.status = 'approved'
+        spending.save()
+        self.assertSpent('250.00')
+        
+        spending.amount = Decimal('300.00')
+        spending.save()
+        self.assertSpent('300.00')
+        
+        spending.status = 'rejected'
+        spending.save()
+        self.assertSpent('0.00')
+    
+    def test_pending_edits_do_not_touch_project(self):
+        spending = make_spending(self.project, self.user, '250.00')
+        spending = ProjectSpending.objects.get(pk=spending.pk)
+        spending.amount = Decimal('400.00')
+        
+        with CaptureQueriesContext(connection) as ctx:
+            spending.save()
+        
+        # Only the spending row itself is written; no project or department UPDATE
+        # (the analytics spending fact cell moves by the amount delta)
+        updates = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith('UPDATE') and '"analytics_spendingfact"' not in q['sql']
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"core_projectspending"', updates[0])
+    
+    def test_stale_instances_approving_one_record_count_it_once(self):
+        spending = make_spending(self.project, self.user, '250.00')
+        first = ProjectSpending.objects.get(pk=spending.pk)
+        second = ProjectSpending.objects.get(pk=spending.pk)
+        for instance in (first, second):
+            instance.status = 'approved'
+            instance.save()
+        self.assertSpent('250.00')
+    
+    def test_stale_project_save_keeps_approvals_applied_meanwhile(self):
+        stale = Project.objects.get(pk=self.project.pk)
+        make_spending(self.project, self.user, '250.00', status='approved')
+        
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertSpent('250.00')
+        
+        stale.status = 'completed'
+        stale.save(update_fields=['status'])
+        self.assertSpent('250.00')
+    
+    def test_update_fields_only_counts_the_written_fields(self):
+        self.project.status = 'planning'
+        self.project.spent = Decimal('90.00')
+        self.project.save(update_fields=['spent'])
+        # The status change was never written, so the project still counts
+        self.assertSpent('90.00')
+    
+    def test_delete_approved_record(self):
+        spending = make_spending(self.project, self.user, '120.00', status='approved')
+        self.assertSpent('120.00')
+        
+        spending.delete()
+        self.assertSpent('0.00')
+    
+    def test_recalculate_spent_repairs_drift(self):
+        make_spending(self.project, self.user, '75.00', status='approved')
+        Project.objects.filter(pk=self.project.pk).update(spent=Decimal('1.00'))
+        
+        Project.recalculate_spent([self.project.pk])
+        self.assertSpent('75.00')
+
+
+class BulkImportTests(TestCase):
+    """Uploads are validated per row and committed chunk by chunk"""
+    
+    HEADER = b'project,amount,description,category,transaction_date,status\n'
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.project = make_project(self.department)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def row(self, amount, status='approved', description='Bolts'):
+        return f'{self.project.pk},{amount},{description},materials,2025-01-05,{status}\n'.encode()
+    
+    def upload(self, content, name='spending.csv', **data):
+        upload = SimpleUploadedFile(name, content)
+        return self.client.post(reverse('bulk-import', args=['project_spending']), {'file': upload, **data})
+    
+    def test_csv_upload_reports_row_errors_and_settles_spent(self):
+        response = self.upload(self.HEADER + self.row('10.00') + self.row('oops') + self.row('5.00', 'pending')
+                               + self.row('2.50'), chunk_size=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({key: response.data[key] for key in ('total', 'created', 'failed')},
+                         {'total': 4, 'created': 3, 'failed': 1})
+        self.assertEqual(response.data['errors'][0]['row'], 3)
+        self.assertIn('amount', response.data['errors'][0]['errors'])
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.spent, Decimal('12.50'))
+    
+    def test_invalid_utf8_fails_only_its_row(self):
+        content = self.HEADER + self.row('10.00') + b'%d,3.00,Caf\xe9,materials,2025-01-05,approved\n' % self.project.pk
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+        self.assertEqual(response.data['errors'][0]['row'], 3)
+        
+        line = b'{"project": %d, "amount": "1.00", "description": "Caf\xe9", "category": "labor", ' \
+               b'"transaction_date": "2025-01-05"}\n' % self.project.pk
+        response = self.upload(line, name='spending.jsonl')
+        self.assertEqual((response.status_code, response.data['failed']), (200, 1))
+    
+    def test_committed_chunks_keep_their_spent_when_a_later_chunk_fails(self):
+        def rows():
+            yield 1, {'project': self.project.pk, 'amount': '10.00', 'description': 'Bolts',
+                      'category': 'materials', 'transaction_date': '2025-01-05', 'status': 'approved'}
+            raise RuntimeError('connection lost')
+        
+        with self.assertRaises(RuntimeError):
+            BulkImportService('project_spending', self.user, chunk_size=1).run(rows())
+        self.assertEqual(ProjectSpending.objects.count(), 1)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.spent, Decimal('10.00'))
+
+
+class SpendingReviewTests(TestCase):
+    """Bulk and single-record reviews stamp approvals and move Project.spent alike"""
+    
+    def setUp(self):
+        self.auditor = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.project = make_project(self.department)
+        self.client = APIClient()
+        self.client.force_authenticate(self.auditor)
+    
+    def test_bulk_review_applies_each_change_once(self):
+        first = make_spending(self.project, self.auditor, '100.00')
+        second = make_spending(self.project, self.auditor, '50.00', status='approved')
+        response = self.client.post(reverse('project-spending-bulk-review'),
+                                    {'status': 'approved', 'ids': [first.pk, second.pk, 999]}, format='json')
+        self.assertEqual(response.data['applied'], [first.pk])
+        self.assertEqual(sorted(item['reason'] for item in response.data['skipped']), ['already approved', 'not found'])
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.spent, Decimal('150.00'))
+        
+        response = self.client.post(reverse('project-spending-bulk-review'),
+                                    {'status': 'rejected', 'filter': {'project': self.project.pk},
+                                     'rejection_reason': 'No invoice'}, format='json')
+        self.assertEqual(response.data['applied_count'], 2)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.spent, Decimal('0.00'))
+        self.assertEqual(
+            set(ProjectSpending.objects.values_list('approved_by', 'approved_at', 'rejection_reason')),
+            {(None, None, 'No invoice')},
+        )
+        self.assertEqual(self.client.post(reverse('project-spending-bulk-review'), {'status': 'approved'},
+                                          format='json').status_code, 400)
+    
+    def test_single_reject_clears_the_approver_like_bulk(self):
+        spending = make_spending(self.project, self.auditor, '100.00')
+        url = reverse('project-spending-detail', args=[spending.pk])
+        self.client.patch(url, {'status': 'approved'}, format='json')
+        spending.refresh_from_db()
+        self.assertEqual(spending.approved_by, self.auditor)
+        self.assertIsNotNone(spending.approved_at)
+        
+        self.client.patch(url, {'status': 'rejected', 'rejection_reason': 'No invoice'}, format='json')
+        spending.refresh_from_db()
+        self.project.refresh_from_db()
+        self.assertEqual((spending.approved_by, spending.approved_at, spending.rejection_reason),
+                         (None, None, 'No invoice'))
+        self.assertEqual(self.project.spent, Decimal('0.00'))
+    
+    def test_department_heads_review_only_their_department(self):
+        other = make_project(Department.objects.create(name='Health', budget=Decimal('500000.00')))
+        outside = make_spending(other, self.auditor, '100.00')
+        head = User.objects.create_user(username='head', password='x', role='department_head',
+                                        department=self.department)
+        self.client.force_authenticate(head)
+        response = self.client.post(reverse('project-spending-bulk-review'),
+                                    {'status': 'approved', 'ids': [outside.pk]}, format='json')
+        self.assertEqual(response.data['skipped'], [{'id': outside.pk, 'reason': 'not found'}])
+        outside.refresh_from_db()
+        self.assertEqual(outside.status, 'pending')
+
+
+class ConcurrentApprovalTests(TransactionTestCase):
+    """Parallel approvals against one project must not lose updates"""
+    
+    workers = 8
+    
+    def test_parallel_approvals(self):
+        user = User.objects.create_user(username='auditor', password='x', role='auditor')
+        department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        project = make_project(department)
+        spending_ids = [
+            make_spending(project, user, f'{100 + i}.00').pk
+            for i in range(self.workers)
+        ]
+        
+        barrier = threading.Barrier(self.workers)
+        errors = []
+        
+        def approve(spending_id):
+            try:
+                spending = ProjectSpending.objects.get(pk=spending_id)
+                spending.status = 'approved'
+                barrier.wait()
+                spending.save()
+            except Exception as exc:  # pragma: no cover - surfaced below
+                errors.append(exc)
+            finally:
+                close_old_connections()
+                connection.close()
+        
+        threads = [threading.Thread(target=approve, args=(pk,)) for pk in spending_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        expected = sum(Decimal(f'{100 + i}.00') for i in range(self.workers))
+        project.refresh_from_db()
+        department.refresh_from_db()
+        self.assertEqual(project.spent, expected)
+        self.assertEqual(department.spent_amount, expected)
+    
+    def test_parallel_approvals_of_one_record(self):
+        user = User.objects.create_user(username='auditor', password='x', role='auditor')
+        department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        project = make_project(department)
+        spending_id = make_spending(project, user, '100.00').pk
+        
+        barrier = threading.Barrier(self.workers)
+        errors = []
+        
+        def approve():
+            try:
+                spending = ProjectSpending.objects.get(pk=spending_id)
+                spending.status = 'approved'
+                barrier.wait()
+                spending.save()
+            except Exception as exc:  # pragma: no cover - surfaced below
+                errors.append(exc)
+            finally:
+                close_old_connections()
+                connection.close()
+        
+        threads = [threading.Thread(target=approve) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        project.refresh_from_db()
+        department.refresh_from_db()
+        self.assertEqual(project.spent, Decimal('100.00'))
+        self.assertEqual(department.spent_amount, Decimal('100.00'))
+
+
+class DetectorWriteTests(TestCase):
+    """Overrun and delay detection write anomalies only, never placeholder fund flows"""
+    
+    projects = 20
+    
+    def setUp(self):
+        self.system = User.objects.create_user(id=1, username='system', password='x', role='admin')
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000000.00'))
+        FundFlow.objects.create(
+            source=source,
+            target_department=self.department,
+            amount=Decimal('500000.00'),
+            status='verified',
+            transaction_date=date(2025, 1, 1),
+        )
+        for i in range(self.projects):
+            make_project(
+                self.department,
+                name=f'Project {i}',
+                spent=Decimal('150000.00'),
+                end_date=date(2025, 6, 30),
+            )
+    
+    def test_detection_writes_one_insert_per_detector(self):
+        with CaptureQueriesContext(connection) as ctx:
+            overruns = AnomalyDetectionService.detect_budget_overruns()
+            delays = AnomalyDetectionService.detect_delayed_projects()
+        
+        self.assertEqual(len(overruns), self.projects)
+        self.assertEqual(len(delays), self.projects)
+        inserts = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        # Previously each detector issued a fund flow INSERT as well as the anomaly INSERT
+        self.assertEqual(len(inserts), 2)
+        self.assertFalse(any('fund_flows_fundflow' in sql.split('(')[0] for sql in inserts))
+        self.assertEqual(FundFlow.objects.count(), 1)
+        self.assertEqual(Anomaly.objects.filter(project__department=self.department).count(), 2 * self.projects)
+    
+    def test_fund_flow_endpoints_only_scan_real_flows(self):
+        AnomalyDetectionService.detect_budget_overruns()
+        AnomalyDetectionService.detect_delayed_projects()
+        
+        client = APIClient()
+        client.force_authenticate(self.system)
+        response = client.get(reverse('fund-flow-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        
+        response = client.get(reverse('fund-flow-diagram'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['links']), 1)
+
+
+class PartitionedDetectionTests(TransactionTestCase):
+    """Detection split into id ranges, in-process or across workers, finds every anomaly once"""
+    
+    def setUp(self):
+        User.objects.create_user(id=1, username='system', password='x', role='admin')
+        department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000000.00'))
+        self.projects = [
+            make_project(department, name=f'Project {i}', budget=Decimal('100.00'), spent=Decimal('150.00'),
+                         end_date=date(2025, 6, 30))
+            for i in range(5)
+        ]
+        today = timezone.now().date()
+        for project in self.projects:
+            for amount in ['100.00', '100.00', '5000.00']:
+                FundFlow.objects.create(source=source, target_project=project, amount=Decimal(amount),
+                                        transaction_date=today)
+    
+    def test_id_ranges_split_at_chunk_boundaries(self):
+        pks = [project.pk for project in self.projects]
+        self.projects[2].delete()
+        del pks[2]
+        ranges = list(id_ranges(Project.objects.all(), 2))
+        self.assertEqual(ranges, [(pks[0], pks[1]), (pks[2], pks[3])])
+        self.assertEqual(list(id_ranges(Project.objects.all(), 3)), [(pks[0], pks[2]), (pks[3], pks[3])])
+        self.assertEqual(list(id_ranges(Project.objects.all(), 10)), [(pks[0], pks[3])])
+        self.assertEqual(list(id_ranges(Project.objects.none(), 2)), [])
+    
+    def test_in_process_partitions_cover_every_project(self):
+        report = run_partitioned(detect_anomalies_in_range, id_ranges(Project.objects.all(), 2))
+        self.assertEqual(report['ranges'], 3)
+        self.assertEqual(report['counts'], {'budget_overruns': 5, 'unusual_spending': 5, 'delayed_projects': 5})
+        self.assertEqual(Anomaly.objects.count(), 15)
+    
+    def test_worker_processes_match_a_single_partition(self):
+        out = StringIO()
+        call_command('run_anomaly_detection', '--anomaly-detection', '--workers', '2', '--chunk-size', '2',
+                     stdout=out)
+        self.assertIn('Found 15 anomalies', out.getvalue())
+        self.assertIn('3 partition(s)', out.getvalue())
+        self.assertEqual(Anomaly.objects.count(), 15)
+        
+        # Nothing is raised twice when the run is repeated in one partition
+        report = run_partitioned(detect_anomalies_in_range, id_ranges(Project.objects.all(), 100))
+        self.assertEqual((report['ranges'], sum(report['counts'].values())), (1, 0))
+
+
+class AnomalyDeduplicationTests(TestCase):
+    """Detectors report only the anomalies they actually inserted"""
+    
+    def setUp(self):
+        User.objects.create_user(id=1, username='system', password='x', role='admin')
+        department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.project = make_project(department, budget=Decimal('100.00'), spent=Decimal('150.00'),
+                                    end_date=date(2025, 6, 30))
+    
+    def test_reruns_report_nothing_until_an_anomaly_is_resolved(self):
+        self.assertEqual(AnomalyDetectionService.run_all_detections()['total_detected'], 2)
+        results = AnomalyDetectionService.run_all_detections()
+        self.assertEqual(results['total_detected'], 0)
+        self.assertEqual(Anomaly.objects.count(), 2)
+        
+        overrun = Anomaly.objects.get(fingerprint=f'budget_overrun:project:{self.project.pk}')
+        overrun.resolved = True
+        overrun.save()
+        results = AnomalyDetectionService.run_all_detections()
+        self.assertEqual((len(results['budget_overruns']), results['total_detected']), (1, 1))
+    
+    def test_candidates_raised_meanwhile_are_not_reported(self):
+        def candidate(detector):
+            return Anomaly(project=self.project, description=detector, detected_by_id=1,
+                           fingerprint=Anomaly.make_fingerprint(detector, 'project', self.project.pk))
+        
+        # e.g. another worker inserted the overrun after this run's scan
+        candidate('budget_overrun').save()
+        created = _create_new_anomalies([candidate('budget_overrun'), candidate('project_delay')],
+                                        ['overrun', 'delay'])
+        self.assertEqual(created, ['delay'])
+        self.assertEqual(Anomaly.objects.filter(fingerprint__startswith='budget_overrun').count(), 1)
+
+
+class StreamingAnomalyDetectorTests(TestCase):
+    """New transactions are scored against Welford statistics once their write commits"""
+    
+    def setUp(self):
+        User.objects.create_user(id=1, username='system', password='x', role='admin')
+        department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.project = make_project(department)
+        self.source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000000.00'))
+    
+    def add_flow(self, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            return FundFlow.objects.create(source=self.source, target_project=self.project, amount=Decimal(amount),
+                                           transaction_date=timezone.now().date())
+    
+    def stats(self):
+        return ProjectFlowStatistics.objects.get(project=self.project, stream='fund_flow')
+    
+    def test_welford_update_matches_the_statistics_module(self):
+        amounts = [120.0, 80.5, 101.25, 99.0, 150.0, 70.0, 110.0]
+        row = ProjectFlowStatistics(project=self.project, stream='fund_flow')
+        for amount in amounts:
+            row.observe(amount, recent_size=5)
+        self.assertEqual(row.count, len(amounts))
+        self.assertAlmostEqual(row.mean, statistics.fmean(amounts))
+        self.assertAlmostEqual(row.variance, statistics.variance(amounts))
+        self.assertEqual(row.recent, amounts[-5:])
+    
+    def test_threshold(self):
+        row = ProjectFlowStatistics(project=self.project, stream='fund_flow')
+        for amount in [100, 110, 90, 100]:
+            row.observe(amount, recent_size=20)
+        self.assertIsNone(StreamingAnomalyDetector.threshold(row, 3, 'mean', min_observations=5))
+        self.assertAlmostEqual(StreamingAnomalyDetector.threshold(row, 3, 'mean', min_observations=4),
+                               100 + 3 * statistics.stdev([100, 110, 90, 100]))
+        # median 100, MAD 5
+        self.assertAlmostEqual(StreamingAnomalyDetector.threshold(row, 3, 'median', min_observations=4),
+                               100 + 3 * 1.4826 * 5)
+        
+        flat = ProjectFlowStatistics(project=self.project, stream='spending')
+        for _ in range(5):
+            flat.observe(100, recent_size=20)
+        self.assertEqual(StreamingAnomalyDetector.threshold(flat, 3, 'mean', min_observations=5), 300)
+    
+    def test_spikes_are_flagged_on_commit_and_not_again_by_the_batch_run(self):
+        for amount in ['100.00', '110.00', '90.00', '105.00', '95.00']:
+            self.add_flow(amount)
+        self.assertFalse(Anomaly.objects.exists())
+        
+        spike = self.add_flow('5000.00')
+        anomaly = Anomaly.objects.get()
+        self.assertEqual(anomaly.fund_flow, spike)
+        self.assertEqual(anomaly.fingerprint, f'spending_spike:fund_flow:{spike.pk}')
+        self.assertEqual(self.stats().count, 6)
+        
+        # The nightly detector shares the fingerprint, so it reports nothing new
+        self.assertEqual(AnomalyDetectionService.detect_unusual_spending_patterns(baseline='median'), [])
+        self.assertEqual(Anomaly.objects.count(), 1)
+    
+    def test_rolled_back_writes_are_not_scored(self):
+        self.add_flow('100.00')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                FundFlow.objects.create(source=self.source, target_project=self.project, amount=Decimal('9999.00'),
+                                        transaction_date=timezone.now().date())
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.stats().count, 1)
+    
+    def test_rebuild_matches_incremental_statistics(self):
+        for amount in ['100.00', '250.00', '75.50']:
+            self.add_flow(amount)
+        incremental = self.stats()
+        StreamingAnomalyDetector.rebuild()
+        rebuilt = self.stats()
+        self.assertEqual((rebuilt.count, rebuilt.recent), (incremental.count, incremental.recent))
+        self.assertAlmostEqual(rebuilt.mean, incremental.mean)
+        self.assertAlmostEqual(rebuilt.m2, incremental.m2)
+
+
+class SpendingSpikeDetectionTests(TestCase):
+    """The NumPy spike baselines match a per-project reference computation"""
+    
+    def setUp(self):
+        User.objects.create_user(id=1, username='system', password='x', role='admin')
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000000.00'))
+        self.today = timezone.now().date()
+    
+    def add_flows(self, amounts, **project_kwargs):
+        project = make_project(self.department, name=f'Project {Project.objects.count()}', **project_kwargs)
+        for day, amount in enumerate(amounts):
+            FundFlow.objects.create(source=self.source, target_project=project, amount=Decimal(amount),
+                                    transaction_date=self.today - timedelta(days=day))
+        return project
+    
+    def test_median_baseline_uses_median_and_mad(self):
+        self.add_flows(['100', '100', '110', '90', '105', '2000'])
+        spikes = AnomalyDetectionService.detect_unusual_spending_patterns(baseline='median')
+        self.assertEqual([spike['amount'] for spike in spikes], [2000.0])
+        # median 102.5, MAD 5
+        self.assertEqual(spikes[0]['baseline'], 102.5)
+        self.assertAlmostEqual(spikes[0]['threshold'], 102.5 + 3 * 1.4826 * 5)
+    
+    def test_median_baseline_matches_reference_across_projects(self):
+        rng = random.Random(7)
+        histories = [[str(rng.randint(50, 150)) for _ in range(rng.randint(1, 12))] + ['900'] for _ in range(15)]
+        histories.append(['100', '100', '100', '100', '500'])  # zero MAD: mean absolute deviation fallback
+        histories.append(['100', '900'])
+        for amounts in histories:
+            self.add_flows(amounts)
+        self.add_flows(['100', '5000'], status='planning')
+        
+        expected = []
+        for amounts in histories:
+            values = [float(amount) for amount in amounts]
+            center = statistics.median(values)
+            deviations = [abs(value - center) for value in values]
+            spread = 1.4826 * statistics.median(deviations) or 1.2533 * statistics.fmean(deviations)
+            expected.extend(value for value in values if value > center + 3 * spread)
+        
+        spikes = AnomalyDetectionService.detect_unusual_spending_patterns(baseline='median')
+        self.assertEqual(sorted(spike['amount'] for spike in spikes), sorted(expected))
+        self.assertIn(500.0, expected)
+    
+    def test_mean_baseline_and_explicit_arguments(self):
+        self.add_flows(['100', '100', '2000'])
+        spikes = AnomalyDetectionService.detect_unusual_spending_patterns(baseline='mean')
+        # Average daily spend over the 30 day window
+        self.assertEqual([(spike['amount'], spike['baseline']) for spike in spikes], [(2000.0, 2200 / 30)])
+        
+        with self.assertRaises(ValueError):
+            AnomalyDetectionService.detect_unusual_spending_patterns(window_days=0)
+        # An explicit zero multiplier is honoured: every amount above the baseline
+        # not already flagged, rather than the configured default
+        self.add_flows(['100', '100'])
+        spikes = AnomalyDetectionService.detect_unusual_spending_patterns(multiplier=0, baseline='mean')
+        self.assertEqual(sorted((spike['project'], spike['amount']) for spike in spikes),
+                         [('Project 0', 100.0), ('Project 0', 100.0), ('Project 1', 100.0), ('Project 1', 100.0)])
+    
+    def test_open_anomaly_lookup_is_chunked(self):
+        for _ in range(5):
+            self.add_flows(['100', '100', '100', '101', '5000'])
+        with mock.patch('core.services.FINGERPRINT_LOOKUP_BATCH', 2):
+            self.assertEqual(len(AnomalyDetectionService.detect_unusual_spending_patterns(baseline='median')), 5)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(AnomalyDetectionService.detect_unusual_spending_patterns(baseline='median'), [])
+        lookups = [q['sql'] for q in ctx.captured_queries if '"fund_flows_anomaly"' in q['sql']]
+        self.assertEqual(len(lookups), 3)
+
+
+def reference_trust_scores(department):
+    """The per-department scoring the grouped aggregates replaced, one query per figure"""
+    projects = department.projects.all()
+    feedback = CommunityFeedback.objects.filter(department=department)
+    total_projects = projects.count()
+    completed = projects.filter(status='completed').count()
+    public_count = feedback.filter(is_public=True).count()
+    responded_count = feedback.filter(status__in=['responded', 'resolved']).count()
+    responses = [item.responded_at - item.created_at for item in feedback.filter(responded_at__isnull=False)]
+    documents = Document.objects.filter(project__department=department)
+    return {
+        'transparency_score': TrustScoreCalculator._transparency_score(total_projects, completed),
+        'community_oversight_score': TrustScoreCalculator._community_score(public_count, responded_count),
+        'response_time_score': TrustScoreCalculator._response_score(
+            sum(responses, timedelta()) / len(responses) if responses else None
+        ),
+        'document_completeness_score': TrustScoreCalculator._document_score(
+            total_projects, documents.count(), documents.filter(verified=True).count()
+        ),
+    }
+
+
+class TrustScoreAggregationTests(TestCase):
+    """The grouped scorer gives every department the scores the per-department scorer did"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditor', password='x', role='auditor')
+    
+    def add_feedback(self, department, hours=None, **kwargs):
+        feedback = CommunityFeedback.objects.create(user=self.user, department=department, feedback_type='concern',
+                                                    title='Potholes', description='Still there', **kwargs)
+        if hours is not None:
+            created = timezone.now() - timedelta(days=30)
+            CommunityFeedback.objects.filter(pk=feedback.pk).update(
+                created_at=created, responded_at=created + timedelta(hours=hours), status='responded'
+            )
+    
+    def add_document(self, project, verified):
+        # bulk_create: Document.save() reads the size of a stored file
+        Document.objects.bulk_create([Document(name='Invoice', document_type='invoice', file='documents/invoice.pdf',
+                                               size=1, uploaded_by=self.user, project=project, verified=verified)])
+    
+    def test_matches_the_per_department_scorer(self):
+        rng = random.Random(11)
+        departments = [Department.objects.create(name='Empty', budget=Decimal('1000.00'))]
+        for i in range(12):
+            department = Department.objects.create(name=f'Department {i}', budget=Decimal('1000.00'))
+            departments.append(department)
+            for j in range(rng.randint(0, 4)):
+                project = make_project(department, name=f'Project {i}.{j}',
+                                       status=rng.choice(['planning', 'active', 'completed']))
+                for _ in range(rng.randint(0, 3)):
+                    self.add_document(project, verified=rng.random() < 0.5)
+            for _ in range(rng.randint(0, 5)):
+                # Response times either side of the 24h, 72h and one week buckets
+                hours = rng.choice([None, 2.5, 23.9, 24.1, 71, 73, 167, 170, 400])
+                self.add_feedback(department, hours, is_public=rng.random() < 0.7)
+        fast = Department.objects.create(name='Fast', budget=Decimal('1000.00'))
+        departments.append(fast)
+        self.add_feedback(fast, hours=2.5)
+        
+        with self.assertNumQueries(4):
+            indicators = TrustScoreCalculator.calculate_trust_scores()
+        for department in departments:
+            indicator = indicators[department.pk]
+            scores = {name: getattr(indicator, name) for name in reference_trust_scores(department)}
+            self.assertEqual(scores, reference_trust_scores(department), department.name)
+        # Every response time bucket was exercised
+        self.assertEqual({indicator.response_time_score for indicator in indicators.values()}, {100, 80, 60, 50, 40})
+    
+    def test_average_response_time_over_a_duration(self):
+        department = Department.objects.create(name='Health', budget=Decimal('1000.00'))
+        # 10h and 40h average to 25h: above the one-day bucket, though neither alone is
+        self.add_feedback(department, hours=10)
+        self.add_feedback(department, hours=40)
+        self.add_feedback(department)
+        indicator = TrustScoreCalculator.calculate_department_trust_score(department)
+        self.assertEqual(indicator.response_time_score, 80)
+        self.assertEqual(indicator.community_oversight_score, 66)
+
+
+class TrustScoreHistoryTests(TestCase):
+    """Only changed departments are rescored, and every score is kept as history"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.works = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.health = Department.objects.create(name='Health', budget=Decimal('500000.00'))
+    
+    def dirty(self):
+        return set(Department.objects.filter(trust_score_dirty=True).values_list('name', flat=True))
+    
+    def test_only_flagged_departments_are_rescored(self):
+        self.assertEqual(set(TrustScoreCalculator.recalculate_dirty()), {self.works.pk, self.health.pk})
+        self.assertEqual(self.dirty(), set())
+        self.assertEqual(TrustScoreCalculator.recalculate_dirty(), {})
+        
+        CommunityFeedback.objects.create(user=self.user, department=self.health, feedback_type='concern',
+                                         title='Queues', description='Long waits')
+        self.assertEqual(self.dirty(), {'Health'})
+        make_project(self.works)
+        self.assertEqual(self.dirty(), {'Health', 'Public Works'})
+        self.assertEqual(set(TrustScoreCalculator.recalculate_dirty(Department.objects.filter(name='Health'))),
+                         {self.health.pk})
+        self.assertEqual(self.dirty(), {'Public Works'})
+        self.assertEqual(TrustIndicator.objects.filter(department=self.health).count(), 2)
+    
+    def test_failed_scoring_flags_the_departments_again(self):
+        with mock.patch.object(TrustScoreCalculator, 'calculate_trust_scores', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                TrustScoreCalculator.recalculate_dirty()
+        self.assertEqual(self.dirty(), {'Public Works', 'Health'})
+        self.assertEqual(len(TrustScoreCalculator.recalculate_dirty()), 2)
+    
+    def test_trend_averages_history_into_buckets(self):
+        for calculated_at, score in [(datetime(2025, 1, 3), 40), (datetime(2025, 1, 20), 60),
+                                     (datetime(2025, 2, 5), 90)]:
+            indicator = TrustIndicator.objects.create(
+                department=self.works, transparency_score=score, community_oversight_score=score,
+                response_time_score=score, document_completeness_score=score,
+            )
+            TrustIndicator.objects.filter(pk=indicator.pk).update(
+                calculated_at=timezone.make_aware(calculated_at)
+            )
+        TrustIndicator.objects.create(department=self.health, transparency_score=10, community_oversight_score=10,
+                                      response_time_score=10, document_completeness_score=10)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('trust-indicators-trend')
+        
+        response = client.get(url, {'interval': 'month', 'department': self.works.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['period'].date(), row['overall_score'], row['samples']) for row in response.data['results']],
+            [(date(2025, 1, 1), 50.0, 2), (date(2025, 2, 1), 90.0, 1)],
+        )
+        response = client.get(url, {'interval': 'month', 'since': '2025-02-01'})
+        self.assertEqual([row['department_name'] for row in response.data['results']], ['Health', 'Public Works'])
+        self.assertEqual(client.get(url, {'interval': 'year'}).status_code, 400)
+        self.assertEqual(client.get(url, {'since': 'soon'}).status_code, 400)
+
+
+class AggregateEndpointQueryCountTests(TestCase):
+    """Summary endpoints stay at one query regardless of role or department count"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='admin', password='x', role='admin')
+        self.add_departments(3)
+    
+    def add_departments(self, count):
+        start = Department.objects.count()
+        for i in range(start, start + count):
+            department = Department.objects.create(name=f'Department {i}', budget=Decimal('500000.00'))
+            for status_name in ['planning', 'active', 'completed']:
+                make_project(department, name=f'{department.name} {status_name}', status=status_name,
+                             spent=Decimal('1000.00'))
+        return department
+    
+    def get(self, name, user):
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def test_project_status_summary_is_one_query_for_every_scope(self):
+        department = Department.objects.first()
+        head = User.objects.create_user(username='head', password='x', role='department_head', department=department)
+        manager = User.objects.create_user(username='manager', password='x', role='citizen')
+        Project.objects.filter(pk=department.projects.first().pk).update(manager=manager)
+        
+        for user, expected_total in [(self.admin, 9), (head, 3), (manager, 1)]:
+            with self.assertNumQueries(1):
+                data = self.get('project-status-summary', user)
+            self.assertEqual(data['total_projects'], expected_total)
+            self.assertEqual(sum(data['status_counts'].values()), expected_total)
+    
+    def test_department_performance_does_not_grow_with_departments(self):
+        with self.assertNumQueries(1):
+            data = self.get('department-performance', self.admin)
+        self.assertEqual(len(data), 3)
+        
+        self.add_departments(5)
+        with self.assertNumQueries(1):
+            data = self.get('department-performance', self.admin)
+        self.assertEqual(len(data), 8)
+        self.assertEqual({row['projects_count'] for row in data}, {3})
+        self.assertEqual({row['active_projects_count'] for row in data}, {1})
+        self.assertEqual({row['spent'] for row in data}, {3000.0})
+
+
+class TrustIndicatorListTests(TestCase):
+    """Indicators sort and filter on the stored overall score"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='auditor', password='x', role='auditor'))
+        self.scores = {}
+        for i, score in enumerate([40, 90, 65, 10]):
+            department = Department.objects.create(name=f'Department {i}', budget=Decimal('500000.00'))
+            indicator = TrustIndicator.objects.create(
+                department=department, transparency_score=score, community_oversight_score=score,
+                response_time_score=score, document_completeness_score=score,
+            )
+            self.scores[indicator.pk] = score
+    
+    def get(self, **params):
+        response = self.client.get(reverse('trust-indicator-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+    
+    def test_overall_score_is_the_integer_mean_and_follows_updates(self):
+        indicator = TrustIndicator.objects.create(
+            department=Department.objects.first(), transparency_score=10, community_oversight_score=20,
+            response_time_score=30, document_completeness_score=41,
+        )
+        self.assertEqual(indicator.overall_score, 25)
+        
+        indicator.document_completeness_score = 100
+        indicator.save()
+        self.assertEqual(indicator.overall_score, 40)
+        self.assertEqual(TrustIndicator.objects.get(pk=indicator.pk).overall_score, 40)
+    
+    def test_ordering_by_overall_score(self):
+        with self.assertNumQueries(2):
+            rows = self.get(ordering='-overall_score')
+        self.assertEqual([row['overall_score'] for row in rows], [90, 65, 40, 10])
+        self.assertEqual(rows[0]['department_name'], 'Department 1')
+        
+        rows = self.get(ordering='overall_score')
+        self.assertEqual([row['overall_score'] for row in rows], [10, 40, 65, 90])
+    
+    def test_filtering_by_overall_score(self):
+        rows = self.get(overall_score__gte=40, overall_score__lte=65, ordering='overall_score')
+        self.assertEqual([row['overall_score'] for row in rows], [40, 65])
+        self.assertEqual([row['overall_score'] for row in self.get(overall_score=90)], [90])
+    
+    def test_query_count_does_not_grow_with_rows(self):
+        for i in range(10):
+            department = Department.objects.create(name=f'Extra {i}', budget=Decimal('500000.00'))
+            TrustIndicator.objects.create(
+                department=department, transparency_score=50, community_oversight_score=50,
+                response_time_score=50, document_completeness_score=50,
+            )
+        with self.assertNumQueries(2):
+            rows = self.get(ordering='-overall_score')
+        self.assertEqual(len(rows), 14)
+
+
+class LatestTrustIndicatorTests(TestCase):
+    """Summaries read only the newest indicator of each department in one query"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='auditor', password='x', role='auditor'))
+        self.departments = [
+            Department.objects.create(name=name, budget=Decimal('500000.00'))
+            for name in ['Water', 'Health', 'Roads']
+        ]
+        now = timezone.now()
+        self.latest = {}
+        for department, scores in zip(self.departments, [[20, 70], [90, 50], [10, 70]]):
+            for days_ago, score in zip([10, 1], scores):
+                indicator = self.add_indicator(department, score)
+                TrustIndicator.objects.filter(pk=indicator.pk).update(calculated_at=now - timedelta(days=days_ago))
+                self.latest[department.pk] = indicator.pk
+    
+    def add_indicator(self, department, score):
+        return TrustIndicator.objects.create(
+            department=department, transparency_score=score, community_oversight_score=score,
+            response_time_score=score, document_completeness_score=score,
+        )
+    
+    def summary(self):
+        response = self.client.get(reverse('trust-indicators-summary'))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def test_latest_per_department(self):
+        latest = TrustIndicator.objects.latest_per_department()
+        self.assertEqual(sorted(latest.values_list('pk', flat=True)), sorted(self.latest.values()))
+    
+    def test_ties_on_calculated_at_go_to_the_newest_row(self):
+        department = self.departments[0]
+        stamp = TrustIndicator.objects.get(pk=self.latest[department.pk]).calculated_at
+        newer = self.add_indicator(department, 30)
+        TrustIndicator.objects.filter(pk=newer.pk).update(calculated_at=stamp)
+        
+        latest = TrustIndicator.objects.latest_per_department().get(department=department)
+        self.assertEqual(latest.pk, newer.pk)
+    
+    def test_summary_is_one_query_and_ordered_by_score(self):
+        with self.assertNumQueries(1):
+            rows = self.summary()
+        self.assertEqual(
+            [(row['department_name'], row['overall_score']) for row in rows],
+            [('Roads', 70), ('Water', 70), ('Health', 50)],
+        )
+        
+        self.departments.extend(
+            Department.objects.create(name=f'Extra {i}', budget=Decimal('500000.00')) for i in range(5)
+        )
+        for department in self.departments[3:]:
+            self.add_indicator(department, 60)
+        with self.assertNumQueries(1):
+            rows = self.summary()
+        self.assertEqual(len(rows), 8)
+    
+    def test_summary_is_cached_until_an_indicator_is_written(self):
+        self.summary()
+        with self.assertNumQueries(0):
+            self.summary()
+        
+        self.add_indicator(self.departments[1], 95)
+        with self.assertNumQueries(1):
+            rows = self.summary()
+        self.assertEqual((rows[0]['department_name'], rows[0]['overall_score']), ('Health', 95))
+
+
+class DashboardSnapshotTests(TestCase):
+    """Dashboards read the newest snapshot, capturing one once it is too old; writes never touch them"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='admin', password='x', role='admin'))
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        make_project(self.department, status='active', spent=Decimal('1000.00'))
+    
+    def metrics(self, **params):
+        response = self.client.get(reverse('dashboard-metrics'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def age(self, snapshot, **delta):
+        DashboardMetrics.objects.filter(pk=snapshot.pk).update(calculated_at=timezone.now() - timedelta(**delta))
+    
+    def test_reads_without_a_snapshot_capture_one(self):
+        data = self.metrics()
+        self.assertEqual(data['activeProjects'], 1)
+        self.assertEqual(data['totalBudget'], 500000.0)
+        self.assertEqual(DashboardMetrics.objects.count(), 1)
+    
+    def test_reads_serve_the_latest_snapshot_within_max_age(self):
+        DashboardSnapshotService.capture()
+        make_project(self.department, name='Second', status='active')
+        
+        with self.assertNumQueries(1):
+            data = self.metrics()
+        self.assertEqual(data['activeProjects'], 1)
+        self.assertEqual(DashboardMetrics.objects.count(), 1)
+    
+    def test_reads_past_max_age_capture_a_fresh_snapshot(self):
+        snapshot = DashboardSnapshotService.capture()
+        self.age(snapshot, hours=2)
+        make_project(self.department, name='Second', status='active')
+        
+        self.assertEqual(self.metrics()['activeProjects'], 2)
+        self.assertEqual(DashboardMetrics.objects.count(), 2)
+        response = self.client.get(reverse('analytics-dashboard'))
+        self.assertEqual(response.data['active_projects'], 2)
+        self.assertEqual(DashboardMetrics.objects.count(), 2)
+        self.assertFalse(DashboardMetrics.objects.order_by('-calculated_at').first().is_stale)
+    
+    def test_explicit_max_age_computes_live_without_storing(self):
+        self.age(DashboardSnapshotService.capture(), minutes=10)
+        make_project(self.department, name='Second', status='active')
+        
+        self.assertEqual(self.metrics(max_age=3600)['activeProjects'], 1)
+        self.assertEqual(self.metrics(max_age=60)['activeProjects'], 2)
+        self.assertEqual(DashboardMetrics.objects.count(), 1)
+        self.assertEqual(self.client.get(reverse('dashboard-metrics'), {'max_age': 'soon'}).status_code, 400)
+    
+    def test_writes_do_not_touch_snapshots(self):
+        DashboardSnapshotService.capture()
+        with CaptureQueriesContext(connection) as queries:
+            make_project(self.department, name='Second')
+            Department.objects.create(name='Health', budget=Decimal('1000.00'))
+            User.objects.create_user(username='citizen', password='x', role='citizen')
+        self.assertFalse([q['sql'] for q in queries if 'analytics_dashboardmetrics' in q['sql']])
+    
+    def test_capture_command_prunes_old_snapshots(self):
+        old = [DashboardSnapshotService.capture() for _ in range(3)]
+        for snapshot in old[:2]:
+            self.age(snapshot, days=40)
+        self.age(old[2], days=5)
+        
+        out = StringIO()
+        call_command('capture_dashboard_metrics', stdout=out)
+        self.assertIn('pruned 2 old snapshot(s)', out.getvalue())
+        self.assertEqual(DashboardMetrics.objects.count(), 2)
+        
+        call_command('capture_dashboard_metrics', '--keep-days', '1', stdout=StringIO())
+        self.assertEqual(DashboardMetrics.objects.count(), 2)
+    
+    def test_prune_keeps_the_newest_snapshot(self):
+        self.age(DashboardSnapshotService.capture(), days=400)
+        self.assertEqual(DashboardSnapshotService.prune(keep_days=30), 0)
+        self.assertEqual(DashboardMetrics.objects.count(), 1)
+
+
+class SpendingFactCubeTests(TestCase):
+    """The spending fact cube tracks writes incrementally and matches a rebuild"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.other_department = Department.objects.create(name='Health', budget=Decimal('500000.00'))
+        self.project = make_project(self.department)
+        self.source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000000.00'))
+    
+    def facts(self):
+        return sorted(
+            SpendingFact.objects.values_list(
+                'source_type', 'department_id', 'project_id', 'category', 'month', 'status',
+                'total_amount', 'transaction_count',
+            ),
+            key=repr,
+        )
+    
+    def assertMatchesRebuild(self):
+        incremental = self.facts()
+        SpendingCubeService.rebuild()
+        self.assertEqual(incremental, self.facts())
+    
+    def test_writes_move_facts_between_cells(self):
+        spending = make_spending(self.project, self.user, '250.00')
+        fact = SpendingFact.objects.get()
+        self.assertEqual((fact.month, fact.status, fact.total_amount), (date(2025, 2, 1), 'pending', Decimal('250.00')))
+        
+        spending.status = 'approved'
+        spending.transaction_date = date(2025, 3, 15)
+        spending.save()
+        flow = FundFlow.objects.create(source=self.source, target_department=self.department,
+                                       amount=Decimal('900.00'), transaction_date=date(2025, 3, 2))
+        FundFlow.objects.create(source=self.source, target_project=self.project,
+                                amount=Decimal('400.00'), transaction_date=date(2025, 3, 9))
+        self.assertMatchesRebuild()
+        
+        flow.delete()
+        SpendingReviewService.review(ProjectSpending.objects.all(), 'rejected', self.user)
+        self.project.department = self.other_department
+        self.project.save()
+        self.assertMatchesRebuild()
+        self.assertFalse(SpendingFact.objects.filter(department=self.department).exists())
+    
+    def test_stale_instances_move_facts_from_the_stored_cell(self):
+        spending = make_spending(self.project, self.user, '250.00')
+        flow = FundFlow.objects.create(source=self.source, target_department=self.department,
+                                       amount=Decimal('900.00'), transaction_date=date(2025, 3, 2))
+        for model, pk in [(ProjectSpending, spending.pk), (FundFlow, flow.pk)]:
+            first = model.objects.get(pk=pk)
+            second = model.objects.get(pk=pk)
+            first.transaction_date = date(2025, 5, 1)
+            first.save()
+            second.transaction_date = date(2025, 6, 1)
+            second.save()
+            second.delete()
+        self.assertEqual(self.facts(), [])
+        self.assertMatchesRebuild()
+    
+    def test_update_fields_leave_unwritten_facts_alone(self):
+        spending = make_spending(self.project, self.user, '250.00')
+        spending.status = 'approved'
+        spending.description = 'Gravel'
+        spending.save(update_fields=['description'])
+        self.assertEqual(SpendingFact.objects.get().status, 'pending')
+        self.assertMatchesRebuild()
+    
+    def test_bulk_import_updates_facts(self):
+        rows = [
+            (number, {'project': self.project.pk, 'amount': '10.00', 'description': 'Bolts',
+                      'category': 'materials', 'transaction_date': f'2025-0{month}-05'})
+            for number, month in enumerate([1, 1, 2], start=1)
+        ]
+        BulkImportService('project_spending', self.user).run(rows)
+        self.assertEqual(
+            list(SpendingFact.objects.values_list('month', 'total_amount', 'transaction_count')),
+            [(date(2025, 1, 1), Decimal('20.00'), 2), (date(2025, 2, 1), Decimal('10.00'), 1)],
+        )
+        self.assertMatchesRebuild()
+    
+    def test_cube_endpoint_groups_by_quarter(self):
+        for month in [1, 2, 4]:
+            spending = make_spending(self.project, self.user, '100.00')
+            spending.transaction_date = date(2025, month, 10)
+            spending.save()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        
+        with self.assertNumQueries(1):
+            response = client.get(reverse('spending-cube'), {'group_by': 'department,month', 'granularity': 'quarter'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['department_name'], row['period'], row['total_amount'], row['transaction_count'])
+             for row in response.data['results']],
+            [('Public Works', date(2025, 1, 1), 200.0, 2), ('Public Works', date(2025, 4, 1), 100.0, 1)],
+        )
+        
+        response = client.get(reverse('spending-cube'), {'group_by': 'amount'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_cube_endpoint_validates_source_type(self):
+        make_spending(self.project, self.user, '100.00')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        
+        response = client.get(reverse('spending-cube'), {'source_type': 'grants'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('source_type', response.data['error'])
+        for source_type, expected in [('spending', 1), ('fund_flow', 0), ('all', 1)]:
+            response = client.get(reverse('spending-cube'), {'source_type': source_type})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), expected)
+
+
+class FundFlowDiagramTests(TestCase):
+    """The flow diagram is one link per (source, target) and is rebuilt after writes"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='auditor', password='x', role='auditor'))
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000000.00'))
+    
+    def add_flow(self, amount, status_name, transaction_date=date(2025, 3, 1)):
+        return FundFlow.objects.create(source=self.source, target_department=self.department, amount=Decimal(amount),
+                                       status=status_name, transaction_date=transaction_date)
+    
+    def test_links_are_summed_and_cached_until_a_write(self):
+        self.add_flow('100.00', 'verified')
+        self.add_flow('50.00', 'anomaly')
+        
+        response = self.client.get(reverse('fund-flow-diagram'))
+        self.assertEqual(len(response.data['nodes']), 2)
+        [link] = response.data['links']
+        self.assertEqual((link['amount'], link['count'], link['status']), ('150.00', 2, 'anomaly'))
+        self.assertEqual(link['status_breakdown'], {'anomaly': 50.0, 'verified': 100.0})
+        
+        with self.assertNumQueries(0):
+            self.client.get(reverse('fund-flow-diagram'))
+        
+        self.add_flow('25.00', 'verified', transaction_date=date(2024, 12, 1))
+        [link] = self.client.get(reverse('fund-flow-diagram')).data['links']
+        self.assertEqual(link['count'], 3)
+        [link] = self.client.get(reverse('fund-flow-diagram'), {'start_date': '2025-01-01'}).data['links']
+        self.assertEqual(link['count'], 2)
+    
+    def test_layout_seed_expires_from_its_first_full_pass(self):
+        # Drop seeds left by earlier diagram tests
+        cache.clear()
+        self.add_flow('100.00', 'verified')
+        with mock.patch('fund_flows.views.sankey_layout', wraps=sankey_layout) as layout, \
+                mock.patch('fund_flows.views.cache.set', wraps=cache.set) as cache_set:
+            self.client.get(reverse('fund-flow-diagram'))
+            self.add_flow('50.00', 'verified')
+            self.client.get(reverse('fund-flow-diagram'))
+            seeds = [args[1] for args, _ in cache_set.call_args_list if args[0].startswith('fund_flow_layout:')]
+            self.assertIsNone(layout.call_args_list[0].kwargs['seed'])
+            self.assertEqual(layout.call_args_list[1].kwargs['seed'], seeds[0]['columns'])
+            self.assertEqual(seeds[1]['created_at'], seeds[0]['created_at'])
+            
+            with mock.patch('fund_flows.views.LAYOUT_SEED_TIMEOUT', 0):
+                self.add_flow('25.00', 'verified')
+                self.client.get(reverse('fund-flow-diagram'))
+            self.assertIsNone(layout.call_args_list[2].kwargs['seed'])
+
+
+class SankeyLayoutTests(SimpleTestCase):
+    """The layered layout removes avoidable crossings and keeps seeded orderings"""
+    
+    def graph(self):
+        nodes = [{'id': f'source_{i}', 'type': 'source'} for i in range(4)]
+        nodes += [{'id': f'dept_{i}', 'type': 'department'} for i in range(3)]
+        # Ordered by volume alone, the small source_1 -> dept_1 link crosses two others
+        links = [
+            {'source': 'source_0', 'target': 'dept_0', 'amount': 40},
+            {'source': 'source_1', 'target': 'dept_1', 'amount': 15},
+            {'source': 'source_2', 'target': 'dept_2', 'amount': 20},
+            {'source': 'source_3', 'target': 'dept_1', 'amount': 100},
+        ]
+        return nodes, links
+    
+    def ordering(self, columns, links):
+        ranks = {node_id: (column, rank) for column, ids in enumerate(columns) for rank, node_id in enumerate(ids)}
+        return count_crossings(ranks, [(link['source'], link['target']) for link in links])
+    
+    def test_layout_untangles_and_sizes_by_volume(self):
+        nodes, links = self.graph()
+        by_volume = [['source_3', 'source_0', 'source_2', 'source_1'], ['dept_1', 'dept_0', 'dept_2']]
+        self.assertEqual(self.ordering(by_volume, links), 2)
+        
+        columns = sankey_layout(nodes, links)
+        self.assertEqual(self.ordering(columns, links), 0)
+        
+        by_id = {node['id']: node for node in nodes}
+        self.assertGreater(by_id['dept_1']['height'], by_id['dept_0']['height'])
+        ys = [by_id[node_id]['position']['y'] for node_id in columns[0]]
+        self.assertEqual(ys, sorted(set(ys)))
+    
+    def test_seeded_layout_keeps_known_nodes_in_order(self):
+        nodes, links = self.graph()
+        columns = sankey_layout(nodes, links)
+        
+        nodes.append({'id': 'project_9', 'type': 'project'})
+        links.append({'source': columns[0][-1], 'target': 'project_9', 'amount': 1})
+        seeded = sankey_layout(nodes, links, seed=columns)
+        self.assertEqual(seeded[:2], columns[:2])
+        self.assertEqual(seeded[2], ['project_9'])
+
+
+class FundTraceTests(TestCase):
+    """Tracing follows money from a source to spending records from the in-memory index"""
+    
+    def setUp(self):
+        # The index lives in the process; start each test from the test database
+        tracing.mark_stale()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.client.force_authenticate(self.user)
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.roads = make_project(self.department, budget=Decimal('300.00'))
+        self.parks = make_project(self.department, name='Parks', budget=Decimal('100.00'))
+        self.source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000.00'))
+        FundFlow.objects.create(source=self.source, target_department=self.department, amount=Decimal('800.00'),
+                                transaction_date=date(2025, 1, 1))
+        self.spending = make_spending(self.roads, self.user, '150.00', status='approved')
+    
+    def trace(self, **params):
+        response = self.client.get(reverse('fund-trace', args=['source', self.source.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def test_paths_carry_proportional_amounts(self):
+        data = self.trace()
+        paths = {tuple(path['nodes']): path['amount'] for path in data['paths']}
+        source, dept = f'source_{self.source.pk}', f'dept_{self.department.pk}'
+        # 800 reaches the department, which funds its projects' budgets (300 and 100);
+        # roads spent 150 of its 300
+        self.assertEqual(paths, {
+            (source, dept, f'project_{self.roads.pk}', f'spending_{self.spending.pk}'): 150.0,
+            (source, dept, f'project_{self.parks.pk}'): 100.0,
+        })
+        nodes = {node['id']: node for node in data['nodes']}
+        self.assertEqual(nodes[source]['retained'], 200.0)
+        self.assertEqual(nodes[dept]['retained'], 400.0)
+        self.assertEqual(nodes[f'project_{self.roads.pk}']['retained'], 150.0)
+        self.assertEqual(nodes[f'spending_{self.spending.pk}']['name'], 'Asphalt')
+        
+        self.assertEqual(len(self.trace(max_depth=1)['paths']), 1)
+    
+    def test_new_flows_and_approvals_patch_the_live_index(self):
+        self.trace()
+        index = tracing.get_index()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            FundFlow.objects.create(source=self.source, target_project=self.parks, amount=Decimal('100.00'),
+                                    transaction_date=date(2025, 2, 1))
+            extra = make_spending(self.parks, self.user, '50.00')
+            extra.status = 'approved'
+            extra.save()
+        
+        with self.assertNumQueries(4):
+            data = self.trace()
+        self.assertIs(tracing.get_index(), index)
+        paths = {tuple(path['nodes']): path['amount'] for path in data['paths']}
+        self.assertEqual(paths[(f'source_{self.source.pk}', f'project_{self.parks.pk}', f'spending_{extra.pk}')], 50.0)
+    
+    def test_patches_do_not_force_other_processes_to_rebuild(self):
+        self.trace()
+        version = tracing.data_version(tracing.CACHE_NAMESPACE)
+        live = tracing.get_index()
+        # An index loaded by another process before the write
+        other = tracing.FundTraceIndex.build(live.version, live.sequence)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            flow = FundFlow.objects.create(source=self.source, target_project=self.parks, amount=Decimal('100.00'),
+                                           transaction_date=date(2025, 2, 1))
+            self.parks.status = 'completed'
+            self.parks.save()
+        self.assertEqual(tracing.data_version(tracing.CACHE_NAMESPACE), version)
+        
+        tracing._index = other
+        self.assertIs(tracing.get_index(), other)
+        self.assertEqual(other.sequence, live.sequence)
+        source, parks = other.lookup[tracing.SOURCE, self.source.pk], other.lookup[tracing.PROJECT, self.parks.pk]
+        self.assertEqual(dict(other.edges(source))[parks], 100.0)
+        
+        # A batch that expired from the log can't be replayed, so the index is rebuilt
+        stale = tracing.FundTraceIndex.build(live.version, live.sequence)
+        with self.captureOnCommitCallbacks(execute=True):
+            flow.pk = None
+            flow.save()
+        cache.delete(change_key(tracing.CACHE_NAMESPACE, live.version, live.sequence + 1))
+        tracing._index = stale
+        rebuilt = tracing.get_index()
+        self.assertIsNot(rebuilt, stale)
+        self.assertEqual(dict(rebuilt.edges(source))[parks], 200.0)
+    
+    def test_batches_logged_during_a_build_are_not_counted_twice(self):
+        build = tracing.FundTraceIndex.build
+        
+        def build_during_a_write(version, sequence):
+            if build_mock.call_count == 1:
+                # A committed flow whose batch is logged while the tables are read
+                FundFlow.objects.create(source=self.source, target_project=self.parks, amount=Decimal('100.00'),
+                                        transaction_date=date(2025, 2, 1))
+                tracing.apply_edge_deltas([
+                    ((tracing.SOURCE, self.source.pk), (tracing.PROJECT, self.parks.pk), 100.0),
+                ])
+            return build(version, sequence)
+        
+        with mock.patch.object(tracing.FundTraceIndex, 'build', side_effect=build_during_a_write) as build_mock:
+            tracing.get_index()
+            index = tracing.get_index()
+        self.assertEqual(build_mock.call_count, 2)
+        source, parks = index.lookup[tracing.SOURCE, self.source.pk], index.lookup[tracing.PROJECT, self.parks.pk]
+        self.assertEqual(dict(index.edges(source))[parks], 100.0)
+    
+    def test_budget_changes_and_moves_patch_the_live_index(self):
+        health = Department.objects.create(name='Health', budget=Decimal('500000.00'))
+        # Creating the department is structural; start from the rebuilt index
+        tracing.mark_stale()
+        self.trace()
+        index = tracing.get_index()
+        version = tracing.data_version(tracing.CACHE_NAMESPACE)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parks.budget = Decimal('200.00')
+            self.parks.save()
+        paths = {tuple(path['nodes']): path['amount'] for path in self.trace()['paths']}
+        self.assertEqual(paths[(f'source_{self.source.pk}', f'dept_{self.department.pk}', f'project_{self.parks.pk}')],
+                         200.0)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parks.department = health
+            self.parks.save()
+        self.assertIs(tracing.get_index(), index)
+        self.assertEqual(tracing.data_version(tracing.CACHE_NAMESPACE), version)
+        parks = index.lookup[tracing.PROJECT, self.parks.pk]
+        self.assertEqual(dict(index.edges(index.lookup[tracing.DEPARTMENT, health.pk])), {parks: 200.0})
+        self.assertNotIn(parks, dict(index.edges(index.lookup[tracing.DEPARTMENT, self.department.pk])))
+        self.assertEqual(index.capacity[parks], 200.0)
+    
+    def test_traces_are_scoped_to_the_user(self):
+        health = Department.objects.create(name='Health', budget=Decimal('500000.00'))
+        clinic = make_project(health, name='Clinic', budget=Decimal('200.00'))
+        FundFlow.objects.create(source=self.source, target_department=health, amount=Decimal('100.00'),
+                                transaction_date=date(2025, 1, 1))
+        head = User.objects.create_user(username='head', password='x', role='department_head',
+                                        department=self.department)
+        manager = User.objects.create_user(username='manager', password='x', role='citizen')
+        Project.objects.filter(pk=self.parks.pk).update(manager=manager)
+        source, dept = f'source_{self.source.pk}', f'dept_{self.department.pk}'
+        
+        self.client.force_authenticate(head)
+        data = self.trace()
+        node_ids = {node['id'] for node in data['nodes']}
+        self.assertIn(f'spending_{self.spending.pk}', node_ids)
+        self.assertFalse(node_ids & {f'dept_{health.pk}', f'project_{clinic.pk}'})
+        self.assertEqual({path['nodes'][1] for path in data['paths']}, {dept})
+        response = self.client.get(reverse('fund-trace', args=['department', health.pk]))
+        self.assertEqual(response.status_code, 404)
+        
+        self.client.force_authenticate(manager)
+        data = self.trace()
+        self.assertEqual({node['id'] for node in data['nodes']}, {source, dept, f'project_{self.parks.pk}'})
+        self.assertEqual([path['nodes'] for path in data['paths']], [[source, dept, f'project_{self.parks.pk}']])
+        response = self.client.get(reverse('fund-trace', args=['project', self.roads.pk]))
+        self.assertEqual(response.status_code, 404)
+        
+        self.client.force_authenticate(self.user)
+        node_ids = {node['id'] for node in self.trace()['nodes']}
+        self.assertTrue({f'dept_{health.pk}', f'project_{clinic.pk}'} <= node_ids)
+
+
+class SearchIndexTests(TestCase):
+    """The full-text index follows writes and returns ranked, visibility-scoped hits"""
+    
+    def setUp(self):
+        # Term statistics are cached per process; start from the test database
+        bump_data_version(SEARCH_CACHE_NAMESPACE)
+        self.client = APIClient()
+        self.manager = User.objects.create_user(username='manager', password='x', role='citizen')
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.roads = make_project(self.department, manager=self.manager)
+        self.bridges = make_project(self.department, name='Bridge Survey', description='Inspect the ring road bridges')
+        self.source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000.00'))
+        self.flow = FundFlow.objects.create(source=self.source, target_project=self.roads, amount=Decimal('800.00'),
+                                            description='Bitumen delivery for resurfacing',
+                                            transaction_date=date(2025, 1, 1))
+    
+    def search(self, user, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse('search-full-text'), params)
+        self.assertEqual(response.status_code, 200)
+        return [(hit['kind'], hit['id']) for hit in response.data['results']]
+    
+    def test_ranked_hits_with_snippets(self):
+        hits = SearchIndex.search('bitum')
+        self.assertEqual([(hit['kind'], hit['id']) for hit in hits], [('fund_flow', self.flow.pk)])
+        self.assertEqual(hits[0]['snippet'], '<mark>Bitumen</mark> delivery for resurfacing')
+        
+        # A title match outranks a body match
+        hits = SearchIndex.search('bridge', kinds=['project'])
+        self.assertEqual([hit['id'] for hit in hits], [self.bridges.pk])
+        hits = SearchIndex.search('ring road', kinds=['project'])
+        self.assertEqual([hit['id'] for hit in hits], [self.roads.pk, self.bridges.pk])
+    
+    def test_pages_past_the_candidates_neither_repeat_nor_skip(self):
+        author = User.objects.create_user(username='citizen', password='x', role='citizen')
+        feedback = [
+            CommunityFeedback.objects.create(user=author, feedback_type='concern', title=f'Streetlight out {i}',
+                                             description=' '.join(['streetlight'] * (i % 4 + 1)))
+            for i in range(12)
+        ]
+        
+        def ids(**page):
+            return [hit['id'] for hit in SearchIndex.search('streetlight', kinds=['feedback'], **page)]
+        
+        with mock.patch.object(SQLiteSearchBackend, 'CANDIDATES', 5):
+            everything = ids(limit=100)
+            paged = [pk for offset in range(0, 12, 3) for pk in ids(limit=3, offset=offset)]
+        self.assertEqual(paged, everything)
+        self.assertEqual(sorted(everything), sorted(item.pk for item in feedback))
+        # The newest candidates are ranked; older matches follow newest first
+        self.assertEqual(set(everything[:5]), {item.pk for item in feedback[-5:]})
+        self.assertEqual(everything[5:], [item.pk for item in reversed(feedback[:-5])])
+    
+    def test_scoped_searches_rank_visible_hits_in_one_query(self):
+        author = User.objects.create_user(username='citizen', password='x', role='citizen')
+        visible = [
+            CommunityFeedback.objects.create(user=author, feedback_type='concern', title=f'Streetlight out {i}',
+                                             description=' '.join(['streetlight'] * (i + 1)))
+            for i in range(3)
+        ]
+        # Newer hidden matches fill every candidate slot
+        for i in range(12):
+            CommunityFeedback.objects.create(user=author, feedback_type='concern', title=f'Streetlight {i}',
+                                             description='streetlight', is_public=False)
+        
+        with mock.patch.object(SQLiteSearchBackend, 'CANDIDATES', 5):
+            ranked = [hit['id'] for hit in SearchIndex.search_for(author, 'streetlight', kinds=['feedback'])]
+            with self.assertNumQueries(1):
+                hits = SearchIndex.search_for(author, 'streetlight', kinds=['feedback'], limit=2, offset=1)
+        self.assertEqual(sorted(ranked), [item.pk for item in visible])
+        self.assertEqual([hit['id'] for hit in hits], ranked[1:])
+    
+    def test_writes_keep_the_index_in_sync(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.department.name = 'Highways Agency'
+            self.department.save()
+        self.assertEqual([hit['id'] for hit in SearchIndex.search('highways')], [self.roads.pk, self.bridges.pk])
+        
+        self.flow.delete()
+        self.assertEqual(SearchIndex.search('bitumen'), [])
+        
+        report = BulkImportService('fund_flows', self.manager).run([(1, {
+            'source': self.source.pk, 'target_project': self.roads.pk, 'amount': '10.00',
+            'transaction_date': '2025-03-01', 'description': 'Gravel top-up',
+        })])
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([hit['kind'] for hit in SearchIndex.search('gravel')], ['fund_flow'])
+        
+        queryset = SearchService.search_projects('surv')
+        self.assertEqual(list(queryset), [self.bridges])
+    
+    def test_renames_reindex_dependents_after_commit_in_one_batch(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.department.name = 'Highways Agency'
+            self.department.save()
+            self.source.name = 'Federal Grant'
+            self.source.save()
+            self.roads.name = 'Ring Road Resurfacing'
+            self.roads.save()
+        # Only the saved project's own row is current before the commit
+        self.assertEqual([hit['id'] for hit in SearchIndex.search('highways')], [self.roads.pk])
+        self.assertEqual(SearchIndex.search('federal'), [])
+        
+        rename_callbacks = [callback for callback in callbacks if callback is reindex_renamed_dependents]
+        self.assertEqual(len(rename_callbacks), 3)
+        with CaptureQueriesContext(connection) as queries:
+            rename_callbacks[0]()
+        rename_callbacks[1]()
+        self.assertEqual(
+            sorted((hit['kind'], hit['id']) for hit in SearchIndex.search('highways')),
+            [('project', self.roads.pk), ('project', self.bridges.pk)],
+        )
+        self.assertEqual([hit['id'] for hit in SearchIndex.search('federal')], [self.flow.pk])
+        self.assertEqual([hit['id'] for hit in SearchIndex.search('resurfacing', kinds=['fund_flow'])], [self.flow.pk])
+        # One read per dependent index kind (project, fund flow, document), not per rename
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('SELECT')]), 3)
+    
+    def test_endpoint_scopes_hits_to_the_user(self):
+        auditor = User.objects.create_user(username='auditor', password='x', role='auditor')
+        CommunityFeedback.objects.create(user=auditor, feedback_type='concern', title='Road potholes',
+                                         description='Potholes again', is_public=False)
+        
+        self.assertEqual(
+            {kind for kind, _ in self.search(auditor, q='road')}, {'project', 'fund_flow', 'feedback'}
+        )
+        self.assertEqual(sorted(self.search(self.manager, q='road')), [
+            ('fund_flow', self.flow.pk), ('project', self.roads.pk),
+        ])
+        self.assertEqual(self.search(self.manager, q='road', kind='project'), [('project', self.roads.pk)])
+        
+        self.client.force_authenticate(self.manager)
+        self.assertEqual(self.client.get(reverse('search-full-text'), {'q': 'road', 'kind': 'spending'}).status_code, 400)
+        response = self.client.get(reverse('project-list'), {'search': 'resurf'})
+        self.assertEqual([project['id'] for project in response.data['results']], [self.roads.pk])
+
+
+class TransactionSearchPaginationTests(TestCase):
+    """search_transactions_view pages with keyset cursors and streams NDJSON exports"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='auditor', password='x', role='auditor'))
+        department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        project = make_project(department)
+        source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000.00'))
+        self.flows = [
+            FundFlow.objects.create(source=source, target_department=department if i % 2 else None,
+                                    target_project=None if i % 2 else project, amount=Decimal('10.00'),
+                                    transaction_date=date(2025, 1, 1 + i // 2))
+            for i in range(5)
+        ]
+        # Newest first, ties on the same day broken by id
+        self.expected = [flow.pk for flow in sorted(self.flows, key=lambda flow: (flow.transaction_date, flow.pk),
+                                                     reverse=True)]
+    
+    def test_cursor_walks_every_row_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('search-transactions'), params)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+        self.assertNotIn('count', response.data)
+        
+        response = self.client.get(reverse('search-transactions'), {'include_count': 'true'})
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(self.client.get(reverse('search-transactions'), {'cursor': 'bogus'}).status_code, 400)
+    
+    def test_tampered_cursors_are_rejected(self):
+        for values in [['abc', 'x'], ['2025-01-03', 'x'], [None, 1], [{'day': 3}, 1], ['2025-01-03', 10 ** 30],
+                       ['2025-01-03']]:
+            response = self.client.get(reverse('search-transactions'), {'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 400, values)
+            self.assertEqual(response.data, {'error': 'Invalid cursor'})
+        
+        # A hand-built cursor with well-typed values still works
+        response = self.client.get(reverse('search-transactions'), {'cursor': encode_cursor(['2025-01-02', 10 ** 6])})
+        self.assertEqual([row['id'] for row in response.data['results']], self.expected[1:])
+    
+    def test_ndjson_export_streams_every_row(self):
+        response = self.client.get(reverse('search-transactions'), {'export': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], self.expected)
+        self.assertEqual(rows[-1]['target_name'], 'Road Repair (Public Works)')
+
+
+class GlobalSearchTests(TestCase):
+    """/api/search/ merges ranked hits across kinds and counts facets over every match"""
+    
+    def setUp(self):
+        bump_data_version(SEARCH_CACHE_NAMESPACE)
+        self.client = APIClient()
+        self.auditor = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.client.force_authenticate(self.auditor)
+        self.works = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.health = Department.objects.create(name='Health', budget=Decimal('500000.00'))
+        self.roads = make_project(self.works)
+        source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000.00'))
+        self.flow = FundFlow.objects.create(source=source, target_project=self.roads, amount=Decimal('10.00'),
+                                            description='Road resurfacing', transaction_date=date(2024, 5, 1),
+                                            verified_by=self.auditor)
+        FundFlow.objects.create(source=source, target_department=self.health, amount=Decimal('10.00'),
+                                description='Clinic road access', transaction_date=date(2025, 5, 1))
+        CommunityFeedback.objects.create(user=self.auditor, feedback_type='concern', title='Potholes on the road',
+                                         description='Still there', department=self.works)
+    
+    def test_results_and_facets_in_one_response(self):
+        self.client.get(reverse('global-search'), {'q': 'road'})
+        # Warm: one GROUP BY per kind, department names and one ranked index query
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('global-search'), {'q': 'road'})
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(sorted(hit['kind'] for hit in data['results']), ['feedback', 'fund_flow', 'fund_flow', 'project'])
+        
+        facets = {name: {entry['value']: entry['count'] for entry in entries} for name, entries in data['facets'].items()}
+        self.assertEqual(facets['kind'], {'fund_flow': 2, 'project': 1, 'feedback': 1})
+        self.assertEqual(facets['department'], {self.works.pk: 3, self.health.pk: 1})
+        # The feedback falls in the year it was created
+        self.assertEqual(facets['year'], Counter([2024, 2025, 2025, timezone.now().year]))
+        self.assertEqual(facets['verification'], {'verified': 1, 'unverified': 1})
+        self.assertEqual(data['facets']['department'][0]['name'], 'Public Works')
+    
+    def test_filters_narrow_hits_and_drop_kinds_without_the_facet(self):
+        response = self.client.get(reverse('global-search'), {'q': 'road', 'verification': 'verified'})
+        self.assertEqual([(hit['kind'], hit['id']) for hit in response.data['results']], [('fund_flow', self.flow.pk)])
+        self.assertEqual(response.data['total'], 1)
+        
+        response = self.client.get(reverse('global-search'), {'q': 'road', 'department': self.health.pk})
+        self.assertEqual([hit['kind'] for hit in response.data['results']], ['fund_flow'])
+        self.assertEqual(self.client.get(reverse('global-search'), {'q': 'road', 'year': 'x'}).status_code, 400)
+
+
+class SavedSearchExecutionTests(TestCase):
+    """Saved search filters run against fund flows from cached, incrementally refreshed ID sets"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.auditor = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.client.force_authenticate(self.auditor)
+        self.department = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.source = FundSource.objects.create(name='State Grant', total_amount=Decimal('1000.00'))
+        self.flows = [self.make_flow(amount, day) for amount, day in [(500, 1), (50, 2), (700, 3), (900, 3)]]
+        self.search_filter = SearchFilter.objects.create(name='Large', min_amount=Decimal('100.00'), year='2025',
+                                                         created_by=self.auditor, is_public=True)
+    
+    def make_flow(self, amount, day):
+        return FundFlow.objects.create(source=self.source, target_department=self.department,
+                                       amount=Decimal(amount), transaction_date=date(2025, 1, day))
+    
+    def execute(self, **params):
+        response = self.client.get(reverse('search-filter-execute', args=[self.search_filter.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def test_pages_follow_search_order(self):
+        data = self.execute(page_size=2)
+        self.assertEqual(data['refreshed'], 'full')
+        self.assertEqual(data['count'], 3)
+        large = [self.flows[3].pk, self.flows[2].pk, self.flows[0].pk]
+        self.assertEqual([row['id'] for row in data['results']], large[:2])
+        
+        data = self.execute(page_size=2, cursor=data['next_cursor'])
+        self.assertEqual([row['id'] for row in data['results']], large[2:])
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(data['refreshed'], 'cached')
+    
+    def test_refreshes_from_changed_flows_only(self):
+        self.execute()
+        # The filter, the watermark check and the page
+        with self.assertNumQueries(3):
+            self.assertEqual(self.execute()['refreshed'], 'cached')
+        
+        small = self.flows[1]
+        small.amount = Decimal('5000.00')
+        small.save()
+        self.flows[0].amount = Decimal('10.00')
+        self.flows[0].save()
+        data = self.execute()
+        self.assertEqual(data['refreshed'], 'incremental')
+        self.assertEqual([row['id'] for row in data['results']], [self.flows[3].pk, self.flows[2].pk, small.pk])
+        
+        self.flows[3].delete()
+        data = self.execute()
+        self.assertEqual(data['refreshed'], 'full')
+        self.assertEqual(data['count'], 2)
+    
+    def test_scoped_users_page_visible_flows_in_one_query(self):
+        health = Department.objects.create(name='Health', budget=Decimal('500000.00'))
+        head = User.objects.create_user(username='head', password='x', role='department_head', department=health)
+        visible = [
+            FundFlow.objects.create(source=self.source, target_department=health, amount=Decimal('300.00'),
+                                    transaction_date=date(2025, 1, day))
+            for day in (1, 5, 9)
+        ]
+        # Newer matches the head may not see
+        for day in range(10, 30):
+            self.make_flow(200, day)
+        self.execute()
+        
+        self.client.force_authenticate(head)
+        # The filter, the watermark check and the page
+        with self.assertNumQueries(3):
+            data = self.execute(page_size=2)
+        self.assertEqual([row['id'] for row in data['results']], [visible[2].pk, visible[1].pk])
+        self.assertNotIn('count', data)
+        data = self.execute(page_size=2, cursor=data['next_cursor'])
+        self.assertEqual([row['id'] for row in data['results']], [visible[0].pk])
+        self.assertIsNone(data['next_cursor'])
+        
+        response = self.client.get(reverse('search-filter-execute', args=[self.search_filter.pk]),
+                                   {'cursor': encode_cursor([-1])})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_private_filters_are_hidden_from_other_users(self):
+        self.search_filter.is_public = False
+        self.search_filter.save()
+        self.client.force_authenticate(User.objects.create_user(username='citizen', password='x'))
+        response = self.client.get(reverse('search-filter-execute', args=[self.search_filter.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class AutocompleteTests(TestCase):
+    """Name suggestions come from the in-memory index, scoped to what the caller may see"""
+    
+    def setUp(self):
+        autocomplete.mark_stale()
+        self.client = APIClient()
+        self.works = Department.objects.create(name='Public Works', budget=Decimal('500000.00'))
+        self.health = Department.objects.create(name='Health', budget=Decimal('500000.00'))
+        self.roads = make_project(self.works, name='Ring Road Repair')
+        self.clinic = make_project(self.health, name='Rural Clinic', is_public=False)
+        FundSource.objects.create(name='Road Fund', total_amount=Decimal('1000.00'))
+        self.head = User.objects.create_user(username='rita', password='x', first_name='Rita', last_name='Moreno',
+                                             role='department_head', department=self.health)
+    
+    def suggest(self, user, q, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse('autocomplete'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(hit['kind'], hit['label']) for hit in response.data['results']]
+    
+    def test_prefix_matches_any_word_and_ranks_name_starts_first(self):
+        auditor = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.suggest(auditor, 'r')
+        with self.assertNumQueries(0):
+            hits = self.suggest(auditor, 'r')
+        self.assertEqual(hits, [('fund_source', 'Road Fund'), ('project', 'Rural Clinic'),
+                                ('project', 'Ring Road Repair'), ('user', 'Rita Moreno (rita)')])
+        self.assertEqual(self.suggest(auditor, 'road r'), [('project', 'Ring Road Repair')])
+        self.assertEqual(self.suggest(auditor, 'WORKS'), [('department', 'Public Works')])
+        self.assertEqual(self.suggest(auditor, 'r', kind='project', limit=1), [('project', 'Rural Clinic')])
+        self.assertEqual(self.client.get(reverse('autocomplete'), {'q': 'r', 'kind': 'budget'}).status_code, 400)
+    
+    def test_suggestions_respect_visibility(self):
+        citizen = User.objects.create_user(username='citizen', password='x')
+        self.assertEqual(self.suggest(citizen, 'r'), [('fund_source', 'Road Fund'), ('project', 'Ring Road Repair')])
+        self.assertEqual(self.suggest(self.head, 'r'), [('fund_source', 'Road Fund'), ('project', 'Rural Clinic'),
+                                                 ('user', 'Rita Moreno (rita)')])
+    
+    def test_writes_update_the_live_index(self):
+        auditor = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.suggest(auditor, 'r')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.roads.name = 'Bridge Repair'
+            self.roads.save()
+            self.clinic.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest(auditor, 'b'), [('project', 'Bridge Repair')])
+        self.assertNotIn(('project', 'Rural Clinic'), self.suggest(auditor, 'r'))
+    
+    def test_scan_limit_counts_only_visible_matches(self):
+        for i in range(5):
+            make_project(self.health, name=f'Radar {i}', is_public=False)
+        make_project(self.works, name='Rampart Study')
+        citizen = User.objects.create_user(username='citizen', password='x')
+        with mock.patch.object(autocomplete, 'SCAN_LIMIT', 2):
+            self.assertEqual(self.suggest(citizen, 'ra'), [('project', 'Rampart Study')])
+    
+    def test_name_starts_rank_first_beyond_the_word_scan(self):
+        auditor = User.objects.create_user(username='auditor', password='x', role='auditor')
+        for letter in 'ABC':
+            make_project(self.works, name=f'Main Park {letter}')
+        make_project(self.works, name='Parkway Plan')
+        with mock.patch.object(autocomplete, 'SCAN_LIMIT', 2):
+            hits = self.suggest(auditor, 'par', kind='project')
+        self.assertEqual(hits[0], ('project', 'Parkway Plan'))
+    
+    def test_writes_do_not_force_other_processes_to_rebuild(self):
+        auditor = User.objects.create_user(username='auditor', password='x', role='auditor')
+        self.suggest(auditor, 'r')
+        live = autocomplete.get_index()
+        version = autocomplete.data_version(autocomplete.CACHE_NAMESPACE)
+        # An index loaded by another process before the writes
+        other = autocomplete.AutocompleteIndex.build(live.version, live.sequence)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.roads.name = 'Bridge Repair'
+            self.roads.save()
+            FundSource.objects.create(name='Bridge Fund', total_amount=Decimal('10.00'))
+        self.assertEqual(autocomplete.data_version(autocomplete.CACHE_NAMESPACE), version)
+        
+        autocomplete._index = other
+        with self.assertNumQueries(0):
+            hits = self.suggest(auditor, 'bridge')
+        self.assertEqual(hits, [('fund_source', 'Bridge Fund'), ('project', 'Bridge Repair')])
+        self.assertIs(autocomplete.get_index(), other)
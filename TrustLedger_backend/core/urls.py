@@ -42,6 +42,10 @@ urlpatterns = [
     # Project Spending
     path('project-spending/', views.ProjectSpendingListView.as_view(), name='project-spending-list'),
     path('project-spending/<int:pk>/', views.ProjectSpendingDetailView.as_view(), name='project-spending-detail'),
+    path('project-spending/bulk-review/', views.bulk_review_project_spending_view, name='project-spending-bulk-review'),
+    
+    # Bulk Import
+    path('bulk-import/<str:kind>/', views.bulk_import_view, name='bulk-import'),
     
     # Anomaly Detection
     path('run-anomaly-detection/', views.run_anomaly_detection_view, name='run-anomaly-detection'),
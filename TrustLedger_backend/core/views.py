@@ -12,9 +12,13 @@ from .serializers import (
     ImpactMetricSerializer, CommunityFeedbackSerializer, CommunityFeedbackCreateSerializer,
     BudgetVersionSerializer, AuditLogSerializer, DashboardMetricsSerializer,
     FundAllocationSerializer, FundAllocationCreateSerializer,
-    ProjectSpendingSerializer, ProjectSpendingCreateSerializer
+    ProjectSpendingSerializer, ProjectSpendingCreateSerializer, ProjectSpendingBulkReviewSerializer
 )
-from .services import AnomalyDetectionService
+from . import autocomplete
+from .search_index import SEARCH_SOURCES
+from .services import AnomalyDetectionService, SearchService, SpendingReviewService
+from .ingest import BulkImportService, IMPORT_SPECS, FORMATS, detect_format, read_rows
+from analytics.services import DashboardSnapshotService
 
 User = get_user_model()
 
@@ -46,6 +50,7 @@ class ProjectListView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['department', 'status', 'manager']
     search_fields = ['name', 'description']
+    search_index_kind = 'project'
     ordering_fields = ['name', 'budget', 'start_date', 'created_at']
     ordering = ['-created_at']
     
@@ -102,27 +107,17 @@ class ImpactMetricDetailView(generics.RetrieveUpdateDestroyAPIView):
 @permission_classes([permissions.IsAuthenticated])
 def dashboard_metrics_view(request):
     """View for dashboard metrics"""
-    # Calculate total budget
-    total_budget = Department.objects.aggregate(
-        total=Sum('budget')
-    )['total'] or 0
-    
-    # Calculate utilized funds
-    utilized_funds = Project.objects.aggregate(
-        total=Sum('spent')
-    )['total'] or 0
-    
-    # Count active projects
-    active_projects = Project.objects.filter(status='active').count()
-    
-    # Count anomalies (this will be implemented in fund_flows app)
-    anomalies_count = 0  # Placeholder
+    try:
+        snapshot = DashboardSnapshotService.latest_for_request(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     metrics = {
-        'totalBudget': float(total_budget),
-        'utilizedFunds': float(utilized_funds),
-        'activeProjects': active_projects,
-        'anomaliesCount': anomalies_count,
+        'totalBudget': float(snapshot.total_budget),
+        'utilizedFunds': float(snapshot.utilized_funds),
+        'activeProjects': snapshot.active_projects,
+        'anomaliesCount': snapshot.anomalies_count,
+        'asOf': snapshot.calculated_at,
     }
     
     return Response(metrics, status=status.HTTP_200_OK)
@@ -181,22 +176,24 @@ def project_status_summary_view(request):
     # Get projects based on user role
     if user.is_admin or user.is_auditor:
         projects = Project.objects.all()
-    elif user.is_department_head and user.department:
-        projects = Project.objects.filter(department=user.department)
+    elif user.is_department_head and user.department_id:
+        projects = Project.objects.filter(department_id=user.department_id)
     else:
         projects = Project.objects.filter(manager=user)
     
-    # Calculate status counts
-    status_counts = {
-        'planning': projects.filter(status='planning').count(),
-        'active': projects.filter(status='active').count(),
-        'completed': projects.filter(status='completed').count(),
-        'cancelled': projects.filter(status='cancelled').count(),
-    }
+    # Status counts and budget totals in one filtered-aggregate query
+    statuses = ['planning', 'active', 'completed', 'cancelled']
+    totals = projects.aggregate(
+        total_budget=Sum('budget'),
+        total_spent=Sum('spent'),
+        total_projects=Count('id'),
+        **{status_name: Count('id', filter=Q(status=status_name)) for status_name in statuses}
+    )
+    status_counts = {status_name: totals[status_name] for status_name in statuses}
     
     # Calculate budget utilization
-    total_budget = projects.aggregate(total=Sum('budget'))['total'] or 0
-    total_spent = projects.aggregate(total=Sum('spent'))['total'] or 0
+    total_budget = totals['total_budget'] or 0
+    total_spent = totals['total_spent'] or 0
     utilization_percentage = (total_spent / total_budget * 100) if total_budget > 0 else 0
     
     summary = {
@@ -204,7 +201,7 @@ def project_status_summary_view(request):
         'total_budget': float(total_budget),
         'total_spent': float(total_spent),
         'utilization_percentage': round(utilization_percentage, 2),
-        'total_projects': projects.count(),
+        'total_projects': totals['total_projects'],
     }
     
     return Response(summary, status=status.HTTP_200_OK)
@@ -214,24 +211,33 @@ def project_status_summary_view(request):
 @permission_classes([permissions.IsAuthenticated])
 def department_performance_view(request):
     """View for department performance data"""
-    departments = Department.objects.all()
+    # One GROUP BY over departments joined to their projects
+    departments = Department.objects.annotate(
+        project_budget=Sum('projects__budget'),
+        project_spent=Sum('projects__spent'),
+        project_total=Count('projects'),
+        project_active=Count('projects', filter=Q(projects__status='active')),
+        project_completed=Count('projects', filter=Q(projects__status='completed')),
+    ).values(
+        'id', 'name', 'budget', 'project_budget', 'project_spent',
+        'project_total', 'project_active', 'project_completed'
+    )
     
     performance_data = []
     for dept in departments:
-        projects = dept.projects.all()
-        total_budget = projects.aggregate(total=Sum('budget'))['total'] or 0
-        total_spent = projects.aggregate(total=Sum('spent'))['total'] or 0
+        total_budget = dept['project_budget'] or 0
+        total_spent = dept['project_spent'] or 0
         utilization_percentage = (total_spent / total_budget * 100) if total_budget > 0 else 0
         
         performance_data.append({
-            'department_id': dept.id,
-            'department_name': dept.name,
-            'budget': float(dept.budget),
+            'department_id': dept['id'],
+            'department_name': dept['name'],
+            'budget': float(dept['budget']),
             'spent': float(total_spent),
             'utilization_percentage': round(utilization_percentage, 2),
-            'projects_count': projects.count(),
-            'active_projects_count': projects.filter(status='active').count(),
-            'completed_projects_count': projects.filter(status='completed').count(),
+            'projects_count': dept['project_total'],
+            'active_projects_count': dept['project_active'],
+            'completed_projects_count': dept['project_completed'],
         })
     
     return Response(performance_data, status=status.HTTP_200_OK)
@@ -243,6 +249,7 @@ class CommunityFeedbackListView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['feedback_type', 'priority', 'status', 'project', 'department']
     search_fields = ['title', 'description']
+    search_index_kind = 'feedback'
     ordering_fields = ['created_at', 'priority']
     ordering = ['-created_at']
     
@@ -405,50 +412,21 @@ class AuditLogListView(generics.ListAPIView):
 @permission_classes([permissions.IsAuthenticated])
 def enhanced_dashboard_metrics_view(request):
     """Enhanced view for dashboard metrics with all required data"""
-    # Calculate total budget
-    total_budget = Department.objects.aggregate(
-        total=Sum('budget')
-    )['total'] or 0
-    
-    # Calculate utilized funds
-    utilized_funds = Project.objects.aggregate(
-        total=Sum('spent')
-    )['total'] or 0
-    
-    # Count active projects
-    active_projects = Project.objects.filter(status='active').count()
-    
-    # Count anomalies (from fund_flows app)
-    from fund_flows.models import Anomaly
-    anomalies_count = Anomaly.objects.filter(resolved=False).count()
-    
-    # Count departments
-    departments_count = Department.objects.count()
-    
-    # Calculate average trust score
-    from fund_flows.models import TrustIndicator
-    trust_indicators = TrustIndicator.objects.all()
-    if trust_indicators.exists():
-        trust_scores = [indicator.overall_score for indicator in trust_indicators]
-        trust_score = int(sum(trust_scores) / len(trust_scores))
-    else:
-        trust_score = 0
-    
-    # Count community feedback
-    community_feedback_count = CommunityFeedback.objects.filter(status='pending').count()
-    
-    # Count pending verifications
-    pending_verifications = ImpactMetric.objects.filter(verified=False).count()
+    try:
+        snapshot = DashboardSnapshotService.latest_for_request(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     metrics = {
-        'totalBudget': float(total_budget),
-        'utilizedFunds': float(utilized_funds),
-        'activeProjects': active_projects,
-        'anomaliesCount': anomalies_count,
-        'departmentsCount': departments_count,
-        'trustScore': trust_score,
-        'communityFeedbackCount': community_feedback_count,
-        'pendingVerifications': pending_verifications,
+        'totalBudget': float(snapshot.total_budget),
+        'utilizedFunds': float(snapshot.utilized_funds),
+        'activeProjects': snapshot.active_projects,
+        'anomaliesCount': snapshot.anomalies_count,
+        'departmentsCount': snapshot.departments_count,
+        'trustScore': snapshot.trust_score,
+        'communityFeedbackCount': snapshot.community_feedback_count,
+        'pendingVerifications': snapshot.pending_verifications,
+        'asOf': snapshot.calculated_at,
     }
     
     return Response(metrics, status=status.HTTP_200_OK)
@@ -551,10 +529,14 @@ class ProjectSpendingDetailView(generics.RetrieveUpdateDestroyAPIView):
         # Only allow status updates for approvers
         if 'status' in serializer.validated_data:
             if self.request.user.is_admin or self.request.user.is_auditor or self.request.user.is_department_head:
-                if serializer.validated_data['status'] == 'approved':
+                # Stamp or clear the approver as SpendingReviewService.review() does
+                new_status = serializer.validated_data['status']
+                if new_status == serializer.instance.status:
+                    serializer.save()
+                elif new_status == 'approved':
                     serializer.save(approved_by=self.request.user, approved_at=timezone.now())
                 else:
-                    serializer.save()
+                    serializer.save(approved_by=None, approved_at=None)
             else:
                 # Regular users can only update their own records and only certain fields
                 if serializer.instance.created_by == self.request.user:
@@ -569,29 +551,160 @@ class ProjectSpendingDetailView(generics.RetrieveUpdateDestroyAPIView):
             serializer.save()
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def bulk_review_project_spending_view(request):
+    """Approve or reject a batch of spending records by IDs or by filter"""
+    user = request.user
+    if not (user.is_admin or user.is_auditor or user.is_department_head):
+        return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = ProjectSpendingBulkReviewSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+    
+    queryset = ProjectSpending.objects.all()
+    if not (user.is_admin or user.is_auditor):
+        if not user.department:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        queryset = queryset.filter(project__department=user.department)
+    if data.get('filter'):
+        queryset = queryset.filter(**data['filter'])
+    
+    summary = SpendingReviewService.review(
+        queryset,
+        data['status'],
+        user,
+        ids=data.get('ids'),
+        rejection_reason=data.get('rejection_reason', ''),
+    )
+    return Response(summary, status=status.HTTP_200_OK)
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def run_anomaly_detection_view(request):
     """Run anomaly detection on all fund flows and projects"""
     try:
         # Run all anomaly detection methods
-        results = {
-            'budget_overruns': AnomalyDetectionService.detect_budget_overruns(),
-            'unusual_transactions': AnomalyDetectionService.detect_unusual_transactions(),
-            'timeline_anomalies': AnomalyDetectionService.detect_timeline_anomalies(),
-            'pattern_anomalies': AnomalyDetectionService.detect_pattern_anomalies(),
-        }
-        
-        # Count total anomalies detected
-        total_anomalies = sum(len(anomalies) for anomalies in results.values())
+        results = AnomalyDetectionService.run_all_detections()
+        total_anomalies = results.pop('total_detected')
         
         return Response({
             'message': 'Anomaly detection completed successfully',
             'total_anomalies_detected': total_anomalies,
             'results': results
         }, status=status.HTTP_200_OK)
-        
+    
     except Exception as e:
         return Response({
             'error': f'Anomaly detection failed: {str(e)}'
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def bulk_import_view(request, kind):
+    """Stream a CSV or JSONL upload into fund flows, spending records or allocations"""
+    if not (request.user.is_admin or request.user.is_auditor):
+        return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+    
+    if kind not in IMPORT_SPECS:
+        return Response({'error': f'Unknown import kind. Use one of: {", ".join(IMPORT_SPECS)}'},
+                        status=status.HTTP_404_NOT_FOUND)
+    
+    upload = request.FILES.get('file')
+    if not upload:
+        return Response({'error': 'A file upload is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    file_format = request.data.get('file_format') or detect_format(upload.name)
+    if file_format not in FORMATS:
+        return Response({'error': f'Unsupported file format. Use one of: {", ".join(FORMATS)}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        chunk_size = min(max(int(request.data.get('chunk_size', 1000)), 1), 10000)
+    except (TypeError, ValueError):
+        return Response({'error': 'chunk_size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # read_rows decodes line by line so large uploads are never held in memory as text
+    report = BulkImportService(kind, request.user, chunk_size=chunk_size).run(read_rows(upload, file_format))
+    
+    return Response(report, status=status.HTTP_200_OK)
+
+
+MAX_GLOBAL_SEARCH_LIMIT = 100
+GLOBAL_SEARCH_FILTERS = {
+    'status': str,
+    'department': int,
+    'year': int,
+    'document_type': str,
+    'verification': str,
+}
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def global_search_view(request):
+    """Ranked hits across fund flows, projects, documents and feedback with facet counts"""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    kinds = request.GET.getlist('kind') or list(SEARCH_SOURCES)
+    unknown = [kind for kind in kinds if kind not in SEARCH_SOURCES]
+    if unknown:
+        return Response(
+            {'error': f'Unknown kind "{unknown[0]}". Use one of: {", ".join(SEARCH_SOURCES)}.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    filters = {}
+    for name, convert in GLOBAL_SEARCH_FILTERS.items():
+        value = request.GET.get(name)
+        if value:
+            try:
+                filters[name] = convert(value)
+            except ValueError:
+                return Response({'error': f'{name} must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    if filters.get('verification') not in (None, 'verified', 'unverified'):
+        return Response({'error': 'verification must be verified or unverified'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        limit = int(request.GET.get('limit', 20))
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        return Response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= limit <= MAX_GLOBAL_SEARCH_LIMIT or offset < 0:
+        return Response(
+            {'error': f'limit must be between 1 and {MAX_GLOBAL_SEARCH_LIMIT} and offset at least 0'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    data = SearchService.global_search(request.user, query, kinds, filters, limit=limit, offset=offset)
+    data.update({'query': query, 'filters': filters, 'limit': limit, 'offset': offset})
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def autocomplete_view(request):
+    """Name suggestions for the search box from the in-memory prefix index"""
+    kinds = request.GET.getlist('kind') or autocomplete.KINDS
+    unknown = [kind for kind in kinds if kind not in autocomplete.KINDS]
+    if unknown:
+        return Response(
+            {'error': f'Unknown kind "{unknown[0]}". Use one of: {", ".join(autocomplete.KINDS)}.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        limit = min(max(int(request.GET.get('limit', autocomplete.DEFAULT_LIMIT)), 1), 50)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    query = request.GET.get('q', '')
+    return Response({
+        'query': query,
+        'results': autocomplete.suggest(query, request.user, kinds, limit),
+    }, status=status.HTTP_200_OK)
@@ -6,6 +6,7 @@ from django.utils import timezone
 from django.http import FileResponse, Http404
 from django.conf import settings
 import os
+from core.search_index import SearchIndex
 from .models import Document, DocumentVerification, DocumentCategory, DocumentTemplate
 from .serializers import (
     DocumentSerializer, DocumentListSerializer, DocumentUploadSerializer,
@@ -20,6 +21,7 @@ class DocumentListView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['document_type', 'project', 'fund_flow', 'verified', 'uploaded_by']
     search_fields = ['name']
+    search_index_kind = 'document'
     ordering_fields = ['name', 'uploaded_at', 'size']
     ordering = ['-uploaded_at']
     
@@ -159,9 +161,6 @@ def document_search_view(request):
     # Build query
     query = Q()
     
-    if serializer.validated_data.get('name'):
-        query &= Q(name__icontains=serializer.validated_data['name'])
-    
     if serializer.validated_data.get('document_type'):
         query &= Q(document_type=serializer.validated_data['document_type'])
     
@@ -198,7 +197,10 @@ def document_search_view(request):
                 Q(fund_flow__target_project__manager=user)
             )
     
-    documents = Document.objects.filter(query).order_by('-uploaded_at')
+    documents = Document.objects.filter(query)
+    if serializer.validated_data.get('name'):
+        documents = SearchIndex.filter(documents, 'document', serializer.validated_data['name'])
+    documents = documents.order_by('-uploaded_at')
     serializer = DocumentListSerializer(documents, many=True)
     
     return Response(serializer.data, status=status.HTTP_200_OK)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import FundFlow, FundSource, Anomaly, TrustIndicator
+from .models import FundFlow, FundSource, Anomaly, ProjectFlowStatistics, TrustIndicator
 
 @admin.register(FundFlow)
 class FundFlowAdmin(admin.ModelAdmin):
@@ -18,11 +18,19 @@ class FundSourceAdmin(admin.ModelAdmin):
 
 @admin.register(Anomaly)
 class AnomalyAdmin(admin.ModelAdmin):
-    list_display = ['fund_flow', 'severity', 'resolved', 'detected_by', 'detected_at']
+    list_display = ['__str__', 'severity', 'resolved', 'detected_by', 'detected_at']
     list_filter = ['severity', 'resolved', 'detected_at']
-    search_fields = ['fund_flow__source__name', 'description']
+    search_fields = ['fund_flow__source__name', 'project__name', 'department__name', 'description', 'fingerprint']
     ordering = ['-detected_at']
-    raw_id_fields = ['fund_flow', 'detected_by', 'resolved_by']
+    raw_id_fields = ['fund_flow', 'project', 'department', 'spending_record', 'detected_by', 'resolved_by']
+    readonly_fields = ['fingerprint']
+
+@admin.register(ProjectFlowStatistics)
+class ProjectFlowStatisticsAdmin(admin.ModelAdmin):
+    list_display = ['project', 'stream', 'count', 'mean', 'updated_at']
+    list_filter = ['stream']
+    search_fields = ['project__name']
+    raw_id_fields = ['project']
 
 @admin.register(TrustIndicator)
 class TrustIndicatorAdmin(admin.ModelAdmin):
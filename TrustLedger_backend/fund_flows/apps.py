@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FundFlowsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fund_flows'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,18 @@
+import django_filters
+from django.db import models
+from .models import TrustIndicator
+
+
+class TrustIndicatorFilter(django_filters.FilterSet):
+    """Filters for trust indicators, including ranges on the stored overall score"""
+    
+    class Meta:
+        model = TrustIndicator
+        fields = {
+            'department': ['exact'],
+            'overall_score': ['exact', 'gte', 'lte'],
+        }
+        # django-filter has no default filter for generated columns
+        filter_overrides = {
+            models.GeneratedField: {'filter_class': django_filters.NumberFilter},
+        }
@@ -0,0 +1,181 @@
+"""
+Layered (Sankey) layout for the fund flow diagram.
+
+Nodes sit in one column per node type. Within a column they are ordered
+with the barycenter heuristic: each sweep places every node at the
+flow-weighted average position of its neighbours in the other columns,
+and the ordering with the fewest link crossings is kept. Node heights are
+proportional to the volume flowing through them.
+
+Passing the ordering of a previous layout as a seed keeps existing nodes
+in their order and only slots new nodes in at their barycenter, so a
+graph that gained a few flows is relaid out without any sweeps.
+"""
+from bisect import bisect_right, insort
+from collections import defaultdict
+
+COLUMNS = {'source': 0, 'department': 1, 'project': 2}
+COLUMN_X = [100, 400, 700]
+
+DEFAULT_HEIGHT = 600
+NODE_PADDING = 12
+MIN_NODE_HEIGHT = 2
+TOP = 20
+SWEEPS = 4
+
+
+def count_crossings(order, links):
+    """
+    Number of link pairs that cross between adjacent drawings of two columns.
+    
+    order maps node id to its rank within its column; links are
+    (source, target) pairs. Counted as inversions in O(E log E).
+    """
+    by_pair = defaultdict(list)
+    for source, target in links:
+        by_pair[order[source][0], order[target][0]].append((order[source][1], order[target][1]))
+    
+    crossings = 0
+    for edges in by_pair.values():
+        edges.sort()
+        seen = []
+        for _, lower in edges:
+            # Earlier edges whose lower end is strictly further down cross this one
+            crossings += len(seen) - bisect_right(seen, lower)
+            insort(seen, lower)
+    return crossings
+
+
+def _ranks(columns):
+    return {node_id: (column, rank) for column, ids in enumerate(columns) for rank, node_id in enumerate(ids)}
+
+
+def _barycenter_sweep(columns, neighbours, targets):
+    """Reorder the target columns by the weighted mean relative position of each node's neighbours"""
+    relative = {}
+    for ids in columns:
+        for rank, node_id in enumerate(ids):
+            relative[node_id] = (rank + 0.5) / len(ids)
+    
+    for column in targets:
+        ids = columns[column]
+        
+        def barycenter(node_id):
+            weighted = neighbours[node_id]
+            total = sum(weighted.values())
+            if not total:
+                return relative[node_id]
+            return sum(relative[other] * weight for other, weight in weighted.items()) / total
+        
+        columns[column] = sorted(ids, key=lambda node_id: (barycenter(node_id), relative[node_id]))
+        for rank, node_id in enumerate(columns[column]):
+            relative[node_id] = (rank + 0.5) / len(columns[column])
+
+
+def order_columns(nodes, links, seed=None):
+    """
+    Column orderings (lists of node ids) that keep link crossings low.
+    
+    Without a seed, columns start sorted by volume and are refined by
+    barycenter sweeps. With a seed (the orderings of an earlier layout),
+    known nodes keep their relative order and new ones are inserted at
+    their barycenter.
+    """
+    volume = _volumes(nodes, links)
+    neighbours = defaultdict(lambda: defaultdict(float))
+    for link in links:
+        amount = float(link['amount'])
+        neighbours[link['source']][link['target']] += amount
+        neighbours[link['target']][link['source']] += amount
+    
+    columns = [[] for _ in COLUMN_X]
+    for node in nodes:
+        columns[COLUMNS[node['type']]].append(node['id'])
+    
+    if seed:
+        return _extend_seed(columns, seed, neighbours, volume)
+    
+    for ids in columns:
+        ids.sort(key=lambda node_id: -volume[node_id])
+    pairs = [(link['source'], link['target']) for link in links]
+    
+    best = [list(ids) for ids in columns]
+    best_crossings = count_crossings(_ranks(best), pairs)
+    # Down sweeps order targets by their sources, up sweeps the reverse
+    for targets in [list(range(1, len(columns))), [0]] * SWEEPS:
+        if not best_crossings:
+            break
+        _barycenter_sweep(columns, neighbours, targets)
+        crossings = count_crossings(_ranks(columns), pairs)
+        if crossings < best_crossings:
+            best, best_crossings = [list(ids) for ids in columns], crossings
+    return best
+
+
+def _extend_seed(columns, seed, neighbours, volume):
+    """Keep seeded nodes in their previous order and insert new ones at their barycenter"""
+    known = {node_id: (column, rank) for column, ids in enumerate(seed) for rank, node_id in enumerate(ids)}
+    relative = {
+        node_id: (rank + 0.5) / len(seed[column]) for node_id, (column, rank) in known.items()
+    }
+    
+    for column, ids in enumerate(columns):
+        kept = sorted((node_id for node_id in ids if node_id in known), key=lambda node_id: known[node_id][1])
+        fresh = [node_id for node_id in ids if node_id not in known]
+        if not fresh:
+            columns[column] = kept
+            continue
+        
+        kept_positions = [relative[node_id] for node_id in kept]
+        placed = defaultdict(list)
+        for node_id in sorted(fresh, key=lambda node_id: -volume[node_id]):
+            weighted = {other: weight for other, weight in neighbours[node_id].items() if other in relative}
+            total = sum(weighted.values())
+            position = sum(relative[other] * weight for other, weight in weighted.items()) / total if total else 1
+            placed[bisect_right(kept_positions, position)].append(node_id)
+        
+        merged = []
+        for index in range(len(kept) + 1):
+            merged.extend(placed.get(index, []))
+            if index < len(kept):
+                merged.append(kept[index])
+        columns[column] = merged
+    return columns
+
+
+def sankey_layout(nodes, links, seed=None, height=DEFAULT_HEIGHT):
+    """
+    Set position {'x', 'y'}, height and value on every node in place.
+    
+    Returns the column orderings used, to be passed back as the seed of
+    the next layout of the same graph.
+    """
+    columns = order_columns(nodes, links, seed)
+    volume = _volumes(nodes, links)
+    by_id = {node['id']: node for node in nodes}
+    
+    busiest = max((sum(volume[node_id] for node_id in ids) for ids in columns if ids), default=0)
+    longest = max((len(ids) for ids in columns), default=0)
+    usable = max(height - NODE_PADDING * max(longest - 1, 0), longest * MIN_NODE_HEIGHT)
+    scale = usable / busiest if busiest else 0
+    
+    for column, ids in enumerate(columns):
+        y = TOP
+        for node_id in ids:
+            node = by_id[node_id]
+            node_height = max(volume[node_id] * scale, MIN_NODE_HEIGHT)
+            node['value'] = volume[node_id]
+            node['height'] = round(node_height, 2)
+            node['position'] = {'x': COLUMN_X[column], 'y': round(y, 2)}
+            y += node_height + NODE_PADDING
+    return columns
+
+
+def _volumes(nodes, links):
+    """Flow through each node: the larger of its inflow and outflow"""
+    inflow, outflow = defaultdict(float), defaultdict(float)
+    for link in links:
+        amount = float(link['amount'])
+        outflow[link['source']] += amount
+        inflow[link['target']] += amount
+    return {node['id']: max(inflow[node['id']], outflow[node['id']]) for node in nodes}
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """Fingerprint open anomalies raised by the detectors, keeping the oldest of any duplicates"""
+    Anomaly = apps.get_model('fund_flows', 'Anomaly')
+    rules = [
+        ('spending_spike', 'fund_flow', {'description__startswith': 'Unusual spending spike'}, 'fund_flow_id'),
+        ('budget_overrun', 'project', {'fund_flow__description__startswith': 'Budget overrun'}, 'fund_flow__target_project_id'),
+        ('project_delay', 'project', {'fund_flow__description__startswith': 'Project delay'}, 'fund_flow__target_project_id'),
+    ]
+    seen = set()
+    to_update = []
+    for detector, subject_type, lookup, subject_field in rules:
+        rows = (
+            Anomaly.objects.filter(resolved=False, fingerprint__isnull=True, **lookup)
+            .values_list('pk', subject_field)
+            .order_by('pk')
+        )
+        for pk, subject_id in rows:
+            if subject_id is None:
+                continue
+            fingerprint = f"{detector}:{subject_type}:{subject_id}"
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            to_update.append(Anomaly(pk=pk, fingerprint=fingerprint))
+    Anomaly.objects.bulk_update(to_update, ['fingerprint'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fund_flows', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anomaly',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=128, null=True),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='anomaly',
+            constraint=models.UniqueConstraint(condition=models.Q(('resolved', False)), fields=('fingerprint',), name='unique_open_anomaly_fingerprint'),
+        ),
+    ]
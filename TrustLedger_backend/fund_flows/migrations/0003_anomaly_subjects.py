@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+SYNTHETIC_FLOW_PREFIXES = ('Budget overrun detected', 'Project delay detected')
+
+
+def detach_synthetic_flows(apps, schema_editor):
+    """Point detector anomalies at their project and drop the placeholder flows created for them"""
+    FundFlow = apps.get_model('fund_flows', 'FundFlow')
+    Anomaly = apps.get_model('fund_flows', 'Anomaly')
+    
+    prefix_q = models.Q()
+    for prefix in SYNTHETIC_FLOW_PREFIXES:
+        prefix_q |= models.Q(description__startswith=prefix)
+    synthetic = FundFlow.objects.filter(
+        prefix_q, status='anomaly', target_project__isnull=False
+    )
+    
+    moved = [
+        Anomaly(pk=pk, project_id=project_id, fund_flow_id=None)
+        for pk, project_id in Anomaly.objects.filter(fund_flow__in=synthetic)
+        .values_list('pk', 'fund_flow__target_project_id')
+    ]
+    Anomaly.objects.bulk_update(moved, ['project', 'fund_flow'], batch_size=500)
+    synthetic.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_department_rollups'),
+        ('fund_flows', '0002_anomaly_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anomaly',
+            name='department',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='core.department'),
+        ),
+        migrations.AddField(
+            model_name='anomaly',
+            name='project',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='core.project'),
+        ),
+        migrations.AddField(
+            model_name='anomaly',
+            name='spending_record',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='core.projectspending'),
+        ),
+        migrations.AlterField(
+            model_name='anomaly',
+            name='fund_flow',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='fund_flows.fundflow'),
+        ),
+        migrations.RunPython(detach_synthetic_flows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='anomaly',
+            constraint=models.CheckConstraint(condition=models.Q(('fund_flow__isnull', False), ('project__isnull', False), ('department__isnull', False), ('spending_record__isnull', False), _connector='OR'), name='anomaly_has_subject'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_department_rollups'),
+        ('fund_flows', '0003_anomaly_subjects'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectFlowStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stream', models.CharField(choices=[('fund_flow', 'Incoming Fund Flows'), ('spending', 'Project Spending')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('mean', models.FloatField(default=0)),
+                ('m2', models.FloatField(default=0)),
+                ('recent', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flow_statistics', to='core.project')),
+            ],
+            options={
+                'verbose_name_plural': 'Project flow statistics',
+                'unique_together': {('project', 'stream')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_department_trust_score_dirty'),
+        ('fund_flows', '0004_project_flow_statistics'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trustindicator',
+            index=models.Index(fields=['department', '-calculated_at'], name='trust_department_history'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:07
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fund_flows', '0005_trust_indicator_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trustindicator',
+            name='overall_score',
+            field=models.GeneratedField(db_index=True, db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('transparency_score'), '+', models.F('community_oversight_score')), '+', models.F('response_time_score')), '+', models.F('document_completeness_score')), '/', models.Value(4)), output_field=models.IntegerField()),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_search_index'),
+        ('fund_flows', '0006_trust_indicator_overall_score'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fundflow',
+            index=models.Index(fields=['-transaction_date', '-id'], name='fund_flow_date_id'),
+        ),
+    ]
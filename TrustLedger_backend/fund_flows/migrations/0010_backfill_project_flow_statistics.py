@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def backfill_statistics(apps, schema_editor):
+    """Fold every stored transaction into the running statistics once, streaming rows per project"""
+    FundFlow = apps.get_model('fund_flows', 'FundFlow')
+    ProjectFlowStatistics = apps.get_model('fund_flows', 'ProjectFlowStatistics')
+    ProjectSpending = apps.get_model('core', 'ProjectSpending')
+    recent_size = getattr(settings, 'ANOMALY_DETECTION', {}).get('STREAM_RECENT_SIZE', 20)
+    
+    sources = {
+        'fund_flow': FundFlow.objects.filter(target_project__isnull=False)
+        .values_list('target_project_id', 'amount').order_by('target_project_id', 'transaction_date', 'pk'),
+        'spending': ProjectSpending.objects.values_list('project_id', 'amount')
+        .order_by('project_id', 'transaction_date', 'pk'),
+    }
+    ProjectFlowStatistics.objects.all().delete()
+    rebuilt = []
+    for stream, rows in sources.items():
+        current = None
+        for project_id, amount in rows.iterator(chunk_size=5000):
+            if current is None or current.project_id != project_id:
+                current = ProjectFlowStatistics(project_id=project_id, stream=stream, recent=[])
+                rebuilt.append(current)
+            # Welford's update, as ProjectFlowStatistics.observe()
+            amount = float(amount)
+            current.count += 1
+            delta = amount - current.mean
+            current.mean += delta / current.count
+            current.m2 += delta * (amount - current.mean)
+            current.recent = (current.recent + [amount])[-recent_size:]
+    ProjectFlowStatistics.objects.bulk_create(rebuilt, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_search_index'),
+        ('fund_flows', '0008_fund_flow_updated_at_index'),
+    ]
+    
+    # Run once here rather than on every deploy; `manage.py rebuild_flow_statistics` repairs drift
+    operations = [
+        migrations.RunPython(backfill_statistics, migrations.RunPython.noop),
+    ]
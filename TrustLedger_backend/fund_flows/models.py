@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth import get_user_model
+from django.db.models.functions import Cast, Concat
 
 User = get_user_model()
 
@@ -39,13 +40,39 @@ class FundFlow(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Fields that place a flow in the analytics spending facts
+    FACT_FIELDS = ('target_department_id', 'target_project_id', 'transaction_date', 'status', 'amount')
+    
+    # core.cache namespace for the aggregated flow diagram; bumped on every write
+    CACHE_NAMESPACE = 'fund_flows'
+    
     class Meta:
         ordering = ['-transaction_date']
+        indexes = [
+            # Keyset pagination of search results (see core.pagination)
+            models.Index(fields=['-transaction_date', '-id'], name='fund_flow_date_id'),
+            # Incremental refresh of saved search results (see analytics.services)
+            models.Index(fields=['updated_at'], name='fund_flow_updated_at'),
+        ]
     
     def __str__(self):
         target = self.target_project or self.target_department
         return f"{self.source.name} → {target} (₹{self.amount})"
     
+    def save(self, *args, **kwargs):
+        """Override save to snapshot the stored fact fields for the analytics spending facts"""
+        with transaction.atomic():
+            stored = None
+            if self.pk and not self._state.adding:
+                # Read under a row lock, so concurrent saves of one flow move
+                # its spending fact cell in turn (see analytics.signals)
+                stored = (
+                    FundFlow.objects.select_for_update()
+                    .filter(pk=self.pk).values(*self.FACT_FIELDS).first()
+                )
+            self._fact_snapshot = stored
+            super().save(*args, **kwargs)
+    
     def clean(self):
         """Ensure either target_department or target_project is set, but not both"""
         from django.core.exceptions import ValidationError
@@ -64,7 +91,11 @@ class Anomaly(models.Model):
         ('critical', 'Critical'),
     ]
     
-    fund_flow = models.ForeignKey(FundFlow, on_delete=models.CASCADE, related_name='anomalies')
+    # The subject the anomaly was raised against; at least one must be set
+    fund_flow = models.ForeignKey(FundFlow, on_delete=models.CASCADE, null=True, blank=True, related_name='anomalies')
+    project = models.ForeignKey('core.Project', on_delete=models.CASCADE, null=True, blank=True, related_name='anomalies')
+    department = models.ForeignKey('core.Department', on_delete=models.CASCADE, null=True, blank=True, related_name='anomalies')
+    spending_record = models.ForeignKey('core.ProjectSpending', on_delete=models.CASCADE, null=True, blank=True, related_name='anomalies')
     description = models.TextField()
     severity = models.CharField(max_length=20, choices=SEVERITY_CHOICES, default='medium')
     detected_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='detected_anomalies')
@@ -73,12 +104,120 @@ class Anomaly(models.Model):
     resolved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='resolved_anomalies')
     resolved_at = models.DateTimeField(null=True, blank=True)
     resolution_notes = models.TextField(blank=True)
+    # Deterministic "detector:subject_type:subject_id" key set by the
+    # automatic detectors; unique among unresolved anomalies.
+    fingerprint = models.CharField(max_length=128, null=True, blank=True, editable=False)
+    
+    SUBJECT_FIELDS = ['fund_flow', 'spending_record', 'project', 'department']
     
     class Meta:
         ordering = ['-detected_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['fingerprint'],
+                condition=models.Q(resolved=False),
+                name='unique_open_anomaly_fingerprint',
+            ),
+            models.CheckConstraint(
+                condition=(
+                    models.Q(fund_flow__isnull=False) | models.Q(project__isnull=False) |
+                    models.Q(department__isnull=False) | models.Q(spending_record__isnull=False)
+                ),
+                name='anomaly_has_subject',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Anomaly in {self.subject} - {self.get_severity_display()}"
+    
+    @property
+    def subject(self):
+        """The most specific object this anomaly was raised against"""
+        for field in self.SUBJECT_FIELDS:
+            if getattr(self, f'{field}_id') is not None:
+                return getattr(self, field)
+        return None
+    
+    @property
+    def subject_type(self):
+        """Name of the field holding the subject"""
+        for field in self.SUBJECT_FIELDS:
+            if getattr(self, f'{field}_id') is not None:
+                return field
+        return None
+    
+    @staticmethod
+    def visible_to(user):
+        """Q restricting anomalies to the subjects a non-staff user is responsible for"""
+        return (
+            models.Q(fund_flow__target_department__head=user) |
+            models.Q(fund_flow__target_project__manager=user) |
+            models.Q(project__manager=user) |
+            models.Q(department__head=user) |
+            models.Q(spending_record__project__manager=user)
+        )
+    
+    @staticmethod
+    def make_fingerprint(detector, subject_type, subject_id):
+        """Build the dedupe key for an automatically detected anomaly"""
+        return f"{detector}:{subject_type}:{subject_id}"
+    
+    @staticmethod
+    def fingerprint_expression(detector, subject_type, subject_id):
+        """SQL expression equal to make_fingerprint() for a column reference such as OuterRef('pk')"""
+        return Concat(
+            models.Value(f"{detector}:{subject_type}:"),
+            Cast(subject_id, output_field=models.CharField()),
+            output_field=models.CharField(),
+        )
+
+
+class ProjectFlowStatistics(models.Model):
+    """Running per-project transaction statistics used to score new writes as they arrive"""
+    STREAM_CHOICES = [
+        ('fund_flow', 'Incoming Fund Flows'),
+        ('spending', 'Project Spending'),
+    ]
+    
+    project = models.ForeignKey('core.Project', on_delete=models.CASCADE, related_name='flow_statistics')
+    stream = models.CharField(max_length=20, choices=STREAM_CHOICES)
+    # Welford accumulators: mean and sum of squared deviations from the mean
+    count = models.PositiveIntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0)
+    # The most recent amounts, oldest first, capped at ANOMALY_DETECTION['STREAM_RECENT_SIZE']
+    recent = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'Project flow statistics'
+        unique_together = ['project', 'stream']
     
     def __str__(self):
-        return f"Anomaly in {self.fund_flow} - {self.get_severity_display()}"
+        return f"{self.project} {self.get_stream_display()}: n={self.count}, mean={self.mean:.2f}"
+    
+    @property
+    def variance(self):
+        """Sample variance of the amounts seen so far"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+    
+    def observe(self, amount, recent_size):
+        """Fold one amount into the running statistics in constant time"""
+        amount = float(amount)
+        self.count += 1
+        delta = amount - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amount - self.mean)
+        self.recent = (self.recent + [amount])[-recent_size:]
+
+
+class TrustIndicatorQuerySet(models.QuerySet):
+    def latest_per_department(self):
+        """Only the most recent indicator of each department"""
+        newest = TrustIndicator.objects.filter(
+            department=models.OuterRef('department')
+        ).order_by('-calculated_at', '-pk').values('pk')[:1]
+        return self.filter(pk=models.Subquery(newest))
 
 
 class TrustIndicator(models.Model):
@@ -88,16 +227,37 @@ class TrustIndicator(models.Model):
     community_oversight_score = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(100)])
     response_time_score = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(100)])
     document_completeness_score = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(100)])
+    # Integer mean of the four sub-scores, computed and stored by the database
+    overall_score = models.GeneratedField(
+        expression=(
+            models.F('transparency_score') + models.F('community_oversight_score') +
+            models.F('response_time_score') + models.F('document_completeness_score')
+        ) / 4,
+        output_field=models.IntegerField(),
+        db_persist=True,
+        db_index=True,
+    )
     calculated_at = models.DateTimeField(auto_now_add=True)
     
+    # Rows are append-only: each recalculation adds a point to the department's history
+    objects = TrustIndicatorQuerySet.as_manager()
+    
+    # core.cache namespace for summaries built from indicators; bumped on every write
+    CACHE_NAMESPACE = 'trust_indicators'
+    
     class Meta:
         ordering = ['-calculated_at']
+        indexes = [
+            models.Index(fields=['department', '-calculated_at'], name='trust_department_history'),
+        ]
     
     def __str__(self):
         return f"{self.department.name} Trust Score: {self.overall_score}"
     
-    @property
-    def overall_score(self):
-        """Calculate overall trust score"""
-        return (self.transparency_score + self.community_oversight_score + 
-                self.response_time_score + self.document_completeness_score) // 4
\ No newline at end of file
+    def save(self, *args, **kwargs):
+        """Save, then reload overall_score, which the database recomputes on UPDATE"""
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        # INSERTs return generated columns; UPDATEs do not
+        if not adding:
+            self.refresh_from_db(fields=['overall_score'])
@@ -85,17 +85,22 @@ class FundFlowListSerializer(serializers.ModelSerializer):
 class AnomalySerializer(serializers.ModelSerializer):
     """Serializer for Anomaly model"""
     fund_flow_info = FundFlowListSerializer(source='fund_flow', read_only=True)
+    project_name = serializers.CharField(source='project.name', read_only=True)
+    department_name = serializers.CharField(source='department.name', read_only=True)
+    subject_type = serializers.ReadOnlyField()
     detected_by_name = serializers.CharField(source='detected_by.get_full_name', read_only=True)
     resolved_by_name = serializers.CharField(source='resolved_by.get_full_name', read_only=True)
     
     class Meta:
         model = Anomaly
         fields = [
-            'id', 'fund_flow', 'fund_flow_info', 'description', 'severity',
+            'id', 'subject_type', 'fund_flow', 'fund_flow_info', 'project', 'project_name',
+            'department', 'department_name', 'spending_record', 'description', 'severity',
             'detected_by', 'detected_by_name', 'detected_at', 'resolved',
-            'resolved_by', 'resolved_by_name', 'resolved_at', 'resolution_notes'
+            'resolved_by', 'resolved_by_name', 'resolved_at', 'resolution_notes',
+            'fingerprint'
         ]
-        read_only_fields = ['detected_at', 'resolved_at']
+        read_only_fields = ['detected_at', 'resolved_at', 'fingerprint']
 
 
 class AnomalyCreateSerializer(serializers.ModelSerializer):
@@ -103,7 +108,15 @@ class AnomalyCreateSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Anomaly
-        fields = ['fund_flow', 'description', 'severity']
+        fields = ['fund_flow', 'project', 'department', 'spending_record', 'description', 'severity']
+    
+    def validate(self, attrs):
+        """Require at least one subject for the anomaly"""
+        if not any(attrs.get(field) for field in Anomaly.SUBJECT_FIELDS):
+            raise serializers.ValidationError(
+                "One of fund_flow, project, department or spending_record must be specified."
+            )
+        return attrs
     
     def create(self, validated_data):
         """Create anomaly with current user as detector"""
@@ -132,7 +145,6 @@ class AnomalyResolveSerializer(serializers.ModelSerializer):
 class TrustIndicatorSerializer(serializers.ModelSerializer):
     """Serializer for TrustIndicator model"""
     department_name = serializers.CharField(source='department.name', read_only=True)
-    overall_score = serializers.ReadOnlyField()
     
     class Meta:
         model = TrustIndicator
@@ -141,7 +153,7 @@ class TrustIndicatorSerializer(serializers.ModelSerializer):
             'community_oversight_score', 'response_time_score',
             'document_completeness_score', 'overall_score', 'calculated_at'
         ]
-        read_only_fields = ['calculated_at']
+        read_only_fields = ['overall_score', 'calculated_at']
 
 
 class TrustIndicatorCreateSerializer(serializers.ModelSerializer):
@@ -178,14 +190,18 @@ class FundFlowNodeSerializer(serializers.Serializer):
     type = serializers.CharField()
     status = serializers.CharField()
     position = serializers.DictField()
+    value = serializers.FloatField(help_text="Flow volume through the node")
+    height = serializers.FloatField(help_text="Drawn height, proportional to value")
 
 
 class FundFlowLinkSerializer(serializers.Serializer):
     """Serializer for fund flow diagram links"""
     source = serializers.CharField()
     target = serializers.CharField()
-    amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+    amount = serializers.DecimalField(max_digits=17, decimal_places=2)
+    count = serializers.IntegerField()
     status = serializers.CharField()
+    status_breakdown = serializers.DictField(child=serializers.FloatField())
 
 
 class FundFlowDiagramSerializer(serializers.Serializer):
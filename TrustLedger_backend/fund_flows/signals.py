@@ -0,0 +1,153 @@
+"""
+Signal handlers that score new transactions for anomalies as they are written
+and keep cached trust summaries, flow diagrams and the trace index current
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.cache import bump_data_version
+from core.models import Department, Project, ProjectSpending
+from core.services import StreamingAnomalyDetector
+from core.signals import transactions_bulk_changed
+from . import tracing
+from .models import FundFlow, FundSource, TrustIndicator
+
+
+@receiver(post_save, sender=FundFlow)
+@receiver(post_save, sender=ProjectSpending)
+def score_new_transaction(sender, instance, created, raw=False, **kwargs):
+    """Score a new fund flow or spending record once its transaction commits"""
+    if not created or raw or not StreamingAnomalyDetector.enabled():
+        return
+    # robust: a scoring failure is logged and never undoes the write itself
+    transaction.on_commit(partial(StreamingAnomalyDetector.observe, instance), robust=True)
+
+
+@receiver(post_save, sender=TrustIndicator)
+@receiver(post_delete, sender=TrustIndicator)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def invalidate_trust_summaries(sender, **kwargs):
+    """New scores or renamed departments change the cached trust summaries"""
+    bump_data_version(TrustIndicator.CACHE_NAMESPACE)
+
+
+@receiver(post_save, sender=FundFlow)
+@receiver(post_delete, sender=FundFlow)
+@receiver(post_save, sender=FundSource)
+@receiver(post_delete, sender=FundSource)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_flow_diagrams(sender, **kwargs):
+    """Flows, and the names and amounts of their endpoints, shape the cached diagrams"""
+    bump_data_version(FundFlow.CACHE_NAMESPACE)
+
+
+@receiver(transactions_bulk_changed, sender=FundFlow)
+def invalidate_flow_diagrams_after_bulk_write(sender, **kwargs):
+    """Bulk imports skip post_save"""
+    bump_data_version(FundFlow.CACHE_NAMESPACE)
+
+
+def _flow_edge(values):
+    """Trace index edge delta for a new fund flow's FACT_FIELDS values, or None"""
+    if values['target_department_id']:
+        target = (tracing.DEPARTMENT, values['target_department_id'])
+    elif values['target_project_id']:
+        target = (tracing.PROJECT, values['target_project_id'])
+    else:
+        return None
+    amount = FundFlow._meta.get_field('amount').to_python(values['amount']) or 0
+    return (tracing.SOURCE, values['source_id']), target, float(amount)
+
+
+def _spending_edges(pk, old, new):
+    """Trace index edge deltas for a change in (project_id, approved amount)"""
+    deltas = []
+    if old and old[1]:
+        deltas.append(((tracing.PROJECT, old[0]), (tracing.SPENDING, pk), -float(old[1])))
+    if new and new[1]:
+        deltas.append(((tracing.PROJECT, new[0]), (tracing.SPENDING, pk), float(new[1])))
+    return deltas
+
+
+def _project_edges(pk, old, new):
+    """Trace index edge deltas for a change in a project's (department_id, budget)"""
+    budget_field = Project._meta.get_field('budget')
+    return [
+        ((tracing.DEPARTMENT, old[0]), (tracing.PROJECT, pk), -float(budget_field.to_python(old[1]) or 0)),
+        ((tracing.DEPARTMENT, new[0]), (tracing.PROJECT, pk), float(budget_field.to_python(new[1]) or 0)),
+    ]
+
+
+def _after_commit(func, *args):
+    # The index must not see rows that are later rolled back
+    transaction.on_commit(partial(func, *args), robust=True)
+
+
+@receiver(post_save, sender=FundFlow)
+def update_trace_index_for_flow(sender, instance, created, raw=False, **kwargs):
+    """New flows extend the live trace index; edits need a rebuild"""
+    values = {'source_id': instance.source_id, **{name: getattr(instance, name) for name in FundFlow.FACT_FIELDS}}
+    edge = _flow_edge(values) if created and not raw else None
+    if edge:
+        _after_commit(tracing.apply_edge_deltas, [edge])
+    else:
+        _after_commit(tracing.mark_stale)
+
+
+@receiver(post_save, sender=ProjectSpending)
+def update_trace_index_for_spending(sender, instance, created, raw=False, **kwargs):
+    """Move the record's approved amount in the live trace index"""
+    # ProjectSpending.save() snapshots the locked stored row before writing it
+    previous = getattr(instance, '_spent_snapshot', None)
+    if raw or (previous is None and not created):
+        _after_commit(tracing.mark_stale)
+        return
+    deltas = _spending_edges(instance.pk, previous, (instance.project_id, instance.spent_contribution()))
+    if deltas:
+        _after_commit(tracing.apply_edge_deltas, deltas)
+
+
+@receiver(post_delete, sender=ProjectSpending)
+def remove_spending_from_trace_index(sender, instance, **kwargs):
+    """Drop a deleted record's approved amount from the live trace index"""
+    deltas = _spending_edges(instance.pk, (instance.project_id, instance.spent_contribution()), None)
+    if deltas:
+        _after_commit(tracing.apply_edge_deltas, deltas)
+
+
+@receiver(post_save, sender=Project)
+def update_trace_index_for_project(sender, instance, created, raw=False, **kwargs):
+    """Move a project's budget edge when its budget or department changes; new projects need a rebuild"""
+    # Project.save() snapshots the locked stored row before writing it
+    previous = getattr(instance, '_rollup_snapshot', None)
+    if created or raw or previous is None:
+        _after_commit(tracing.mark_stale)
+        return
+    old = (previous[0], instance._budget_snapshot)
+    new = (instance.department_id, instance.budget)
+    if old != new:
+        _after_commit(tracing.apply_edge_deltas, _project_edges(instance.pk, old, new))
+
+
+@receiver(post_delete, sender=FundFlow)
+@receiver(post_save, sender=FundSource)
+@receiver(post_delete, sender=FundSource)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=Project)
+def mark_trace_index_stale(sender, **kwargs):
+    """Removed flows and nodes, new nodes and changed totals are rebuilt rather than patched"""
+    _after_commit(tracing.mark_stale)
+
+
+@receiver(transactions_bulk_changed)
+def mark_trace_index_stale_after_bulk_write(sender, **kwargs):
+    """Bulk imports and spending reviews are rebuilt rather than patched"""
+    _after_commit(tracing.mark_stale)
@@ -0,0 +1,323 @@
+"""
+Multi-hop tracing of money from fund sources down to spending records.
+
+The funding graph is held in memory as a compressed sparse row (CSR)
+adjacency index: node attributes and edges live in flat typed arrays, so
+even a large ledger takes a few bytes per edge and a trace is a walk over
+array slices with no queries.
+
+Edges and their weights:
+
+- source -> department and source -> project: the summed fund flows
+- department -> project: the project budget (a department's money is
+  split across its projects in proportion to their budgets), which is
+  also the project's capacity
+- project -> spending record: the approved amount
+
+Each node passes money on in proportion to its edge weights, relative to
+the larger of what it holds (source total, department inflow or budget,
+project budget) and what it passes on. Whatever is not passed on is
+reported as retained at that node.
+
+The index is built with one query per table. New fund flows, changes in
+approved spending and project budget or department moves are applied to
+the live index in place, through an overlay that is folded into the
+arrays once it grows. Each batch of edge deltas is also appended to the
+namespace's change log (see core.cache), and other processes replay the
+batches they have not applied before a trace.
+
+Only structural changes (nodes added or removed, source totals and
+department budgets) bump the core.cache data version, which makes every
+process rebuild on its next trace. A process that finds a gap in the log,
+because an entry expired or was evicted, rebuilds too.
+"""
+import threading
+from array import array
+from collections import defaultdict
+
+from django.db.models import Sum
+
+from core.cache import bump_data_version, change_sequence, changes_since, data_version, log_change
+from core.models import Department, Project, ProjectSpending
+from .models import FundFlow, FundSource
+
+CACHE_NAMESPACE = 'fund_trace'
+
+NODE_TYPES = ['source', 'department', 'project', 'spending']
+NODE_PREFIXES = {'source': 'source_', 'department': 'dept_', 'project': 'project_', 'spending': 'spending_'}
+SOURCE, DEPARTMENT, PROJECT, SPENDING = range(len(NODE_TYPES))
+
+# Overlay edges folded back into the CSR arrays once there are this many
+COMPACT_AFTER = 1024
+
+# How far behind the change log an index may fall before a rebuild is
+# cheaper than replaying it
+MAX_REPLAY = 1024
+
+# Builds retried while the change log keeps moving under them
+BUILD_ATTEMPTS = 3
+
+DEFAULT_MAX_DEPTH = 3
+DEFAULT_MAX_PATHS = 1000
+
+
+class FundTraceIndex:
+    """CSR adjacency index of the funding graph"""
+    
+    def __init__(self, version=None, sequence=0):
+        self.version = version
+        self.sequence = sequence         # last delta log batch applied
+        self.lookup = {}                 # (type, pk) -> node index
+        self.types = array('b')
+        self.pks = array('q')
+        self.capacity = array('d')       # source total or budget
+        self.received = {}               # department node -> summed fund flows in
+        self.offsets = array('q', [0])   # edges of node i are offsets[i]:offsets[i + 1]
+        self.targets = array('q')
+        self.weights = array('d')
+        self.overlay = defaultdict(lambda: defaultdict(float))
+        self.overlay_size = 0
+    
+    @classmethod
+    def build(cls, version=None, sequence=0):
+        """Load the whole funding graph with one query per table"""
+        index = cls(version, sequence)
+        edges = defaultdict(lambda: defaultdict(float))
+        
+        for pk, total in FundSource.objects.values_list('id', 'total_amount'):
+            index._add_node(SOURCE, pk, total)
+        for pk, budget in Department.objects.values_list('id', 'budget'):
+            index._add_node(DEPARTMENT, pk, budget)
+        for pk, department_id, budget in Project.objects.values_list('id', 'department_id', 'budget'):
+            node = index._add_node(PROJECT, pk, budget)
+            edges[index.lookup[DEPARTMENT, department_id]][node] += float(budget or 0)
+        
+        inflow = defaultdict(float)
+        flows = (
+            FundFlow.objects.order_by()
+            .values_list('source_id', 'target_department_id', 'target_project_id')
+            .annotate(total=Sum('amount'))
+        )
+        for source_id, department_id, project_id, total in flows:
+            target = (DEPARTMENT, department_id) if department_id else (PROJECT, project_id)
+            if target[1] is None:
+                continue
+            edges[index.lookup[SOURCE, source_id]][index.lookup[target]] += float(total)
+            if department_id:
+                inflow[department_id] += float(total)
+        index.received = {
+            index.lookup[DEPARTMENT, department_id]: received for department_id, received in inflow.items()
+        }
+        
+        spending = ProjectSpending.objects.filter(status='approved').values_list('id', 'project_id', 'amount')
+        for pk, project_id, amount in spending.iterator(chunk_size=5000):
+            node = index._add_node(SPENDING, pk, amount)
+            edges[index.lookup[PROJECT, project_id]][node] += float(amount)
+        
+        index._pack(edges)
+        return index
+    
+    def _add_node(self, node_type, pk, capacity):
+        node = len(self.types)
+        self.lookup[node_type, pk] = node
+        self.types.append(node_type)
+        self.pks.append(pk)
+        self.capacity.append(float(capacity or 0))
+        return node
+    
+    def _pack(self, edges):
+        """Lay edges out in CSR order"""
+        self.offsets = array('q', [0])
+        self.targets = array('q')
+        self.weights = array('d')
+        for node in range(len(self.types)):
+            for target, weight in edges.get(node, {}).items():
+                if weight > 0:
+                    self.targets.append(target)
+                    self.weights.append(weight)
+            self.offsets.append(len(self.targets))
+        self.overlay.clear()
+        self.overlay_size = 0
+    
+    def edges(self, node):
+        """(target, weight) pairs leaving node, overlay applied"""
+        if node + 1 < len(self.offsets):
+            start, end = self.offsets[node], self.offsets[node + 1]
+            merged = dict(zip(self.targets[start:end], self.weights[start:end]))
+        else:
+            merged = {}
+        for target, delta in self.overlay.get(node, {}).items():
+            merged[target] = merged.get(target, 0.0) + delta
+        return [(target, weight) for target, weight in merged.items() if weight > 0]
+    
+    def add_edge_weight(self, source_key, target_key, delta):
+        """
+        Add delta to one edge. Returns False if either end is not in the
+        index (the index must then be rebuilt).
+        """
+        if source_key not in self.lookup:
+            return False
+        if target_key not in self.lookup:
+            if target_key[0] != SPENDING:
+                return False
+            self._add_node(SPENDING, target_key[1], 0)
+        source, target = self.lookup[source_key], self.lookup[target_key]
+        self.overlay[source][target] += delta
+        self.overlay_size += 1
+        if target_key[0] == SPENDING or (source_key[0], target_key[0]) == (DEPARTMENT, PROJECT):
+            self.capacity[target] += delta
+        elif target_key[0] == DEPARTMENT:
+            self.received[target] = self.received.get(target, 0.0) + delta
+        if self.overlay_size >= COMPACT_AFTER:
+            self.compact()
+        return True
+    
+    def apply(self, deltas):
+        """add_edge_weight() for each (source_key, target_key, delta); False if any end is unknown"""
+        return all(self.add_edge_weight(source_key, target_key, delta) for source_key, target_key, delta in deltas)
+    
+    def holding(self, node):
+        """What a node holds before passing money on"""
+        # A funded department passes on what it received; an unfunded one its budget
+        if self.received.get(node, 0) > 0:
+            return self.received[node]
+        return self.capacity[node]
+    
+    def compact(self):
+        """Fold the overlay into the CSR arrays"""
+        self._pack({node: dict(self.edges(node)) for node in range(len(self.types))})
+    
+    def node_id(self, node):
+        return f'{NODE_PREFIXES[NODE_TYPES[self.types[node]]]}{self.pks[node]}'
+    
+    def trace(self, node_type, pk, max_depth=DEFAULT_MAX_DEPTH, max_paths=DEFAULT_MAX_PATHS):
+        """
+        Every downstream path from one node with the amount that reaches its end.
+        
+        Returns None for an unknown node. Paths end at nodes that pass
+        nothing on or at max_depth hops; reached and retained (not passed
+        on) amounts are totalled per node.
+        """
+        root = self.lookup.get((NODE_TYPES.index(node_type), pk))
+        if root is None:
+            return None
+        
+        root_amount = max(self.holding(root), sum(weight for _, weight in self.edges(root)))
+        paths = []
+        reached = defaultdict(float)
+        retained = defaultdict(float)
+        truncated = False
+        
+        stack = [([root], root_amount)]
+        while stack:
+            path, amount = stack.pop()
+            node = path[-1]
+            reached[node] += amount
+            out = self.edges(node) if len(path) <= max_depth else []
+            # Cycles cannot occur between node types, but guard against bad data
+            out = [(target, weight) for target, weight in out if target not in path]
+            if not out:
+                if len(path) <= max_depth:
+                    # The end of the line: everything that arrives stays here
+                    retained[node] += amount
+                if len(paths) >= max_paths:
+                    truncated = True
+                    continue
+                paths.append({'nodes': [self.node_id(step) for step in path], 'amount': round(amount, 2)})
+                continue
+            
+            held = max(self.holding(node), sum(weight for _, weight in out))
+            passed = 0.0
+            for target, weight in sorted(out, key=lambda edge: edge[1]):
+                share = amount * weight / held
+                passed += share
+                stack.append((path + [target], share))
+            retained[node] += amount - passed
+        
+        return {
+            'root': root,
+            'amount': round(root_amount, 2),
+            'paths': paths,
+            'reached': reached,
+            'retained': retained,
+            'truncated': truncated,
+        }
+
+
+_lock = threading.RLock()
+_index = None
+
+
+def _catch_up(index):
+    """Replay the logged batches the index has not applied; False if it must be rebuilt instead"""
+    pending = changes_since(CACHE_NAMESPACE, index.version, index.sequence, MAX_REPLAY)
+    if pending is None:
+        return False
+    batches, sequence = pending
+    if not all(index.apply(deltas) for deltas in batches):
+        return False
+    index.sequence = sequence
+    return True
+
+
+def _build(version):
+    """
+    Build the index at the change-log position its tables reflect.
+    
+    A batch logged while the tables are read may or may not be in them, so
+    the build is retried until the log holds still; failing that, the index
+    serves the current call and is rebuilt on the next.
+    """
+    for _ in range(BUILD_ATTEMPTS):
+        sequence = change_sequence(CACHE_NAMESPACE, version)
+        index = FundTraceIndex.build(version, sequence)
+        if change_sequence(CACHE_NAMESPACE, version) == sequence:
+            return index
+    index.version = None
+    return index
+
+
+def get_index():
+    """The process-wide index, caught up with the change log or rebuilt after a structural change"""
+    global _index
+    version = data_version(CACHE_NAMESPACE)
+    with _lock:
+        if _index is None or _index.version != version or not _catch_up(_index):
+            _index = _build(version)
+        return _index
+
+
+def trace(node_type, pk, **kwargs):
+    """FundTraceIndex.trace() on the current index, with the index that produced it"""
+    with _lock:
+        index = get_index()
+        return index, index.trace(node_type, pk, **kwargs)
+
+
+def mark_stale():
+    """Force a rebuild on the next trace, here and in other processes"""
+    bump_data_version(CACHE_NAMESPACE)
+
+
+def apply_edge_deltas(deltas):
+    """
+    Log [(source_key, target_key, delta), ...] for every process and apply it to the live index.
+    
+    Keys are (node type, pk). This process applies the batch at once if its
+    index is loaded and caught up; otherwise the next trace replays it.
+    Falls back to marking the index stale when the log cannot be appended
+    to or a node is unknown.
+    """
+    # Logged outside the lock, so a build in progress sees the log move
+    version = data_version(CACHE_NAMESPACE)
+    sequence = log_change(CACHE_NAMESPACE, version, deltas)
+    if sequence is None:
+        # Readers can no longer tell what they missed
+        mark_stale()
+        return
+    with _lock:
+        if _index is not None and _index.version == version and _index.sequence == sequence - 1:
+            if _index.apply(deltas):
+                _index.sequence = sequence
+            else:
+                mark_stale()
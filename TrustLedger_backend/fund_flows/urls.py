@@ -12,6 +12,7 @@ urlpatterns = [
     path('flows/<int:flow_id>/verify/', views.verify_fund_flow_view, name='verify-fund-flow'),
     path('flows/<int:flow_id>/flag-anomaly/', views.flag_anomaly_view, name='flag-anomaly'),
     path('diagram/', views.fund_flow_diagram_view, name='fund-flow-diagram'),
+    path('trace/<str:node_type>/<int:pk>/', views.fund_trace_view, name='fund-trace'),
     
     # Anomalies
     path('anomalies/', views.AnomalyListView.as_view(), name='anomaly-list'),
@@ -23,8 +24,10 @@ urlpatterns = [
     path('trust-indicators/', views.TrustIndicatorListView.as_view(), name='trust-indicator-list'),
     path('trust-indicators/<int:pk>/', views.TrustIndicatorDetailView.as_view(), name='trust-indicator-detail'),
     path('trust-indicators/summary/', views.trust_indicators_summary_view, name='trust-indicators-summary'),
+    path('trust-indicators/trend/', views.trust_indicators_trend_view, name='trust-indicators-trend'),
     
     # Search
     path('search/transactions/', views.search_transactions_view, name='search-transactions'),
     path('search/projects/', views.search_projects_view, name='search-projects'),
+    path('search/full-text/', views.full_text_search_view, name='search-full-text'),
 ]
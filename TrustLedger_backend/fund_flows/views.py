@@ -1,9 +1,26 @@
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from django.db.models import Q, Sum, Count
+import json
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, Sum, Count, Avg
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from core.cache import get_or_build
+from core.models import Department, Project, ProjectSpending
+from core.pagination import InvalidCursor, keyset_chunks, keyset_page
+from core.search_index import SEARCH_SOURCES, SearchIndex
 from core.services import SearchService
+from . import tracing
+from .filters import TrustIndicatorFilter
+from .layout import sankey_layout
 from .models import FundSource, FundFlow, Anomaly, TrustIndicator
 from .serializers import (
     FundSourceSerializer, FundFlowSerializer, FundFlowListSerializer,
@@ -36,6 +53,7 @@ class FundFlowListView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['source', 'target_department', 'target_project', 'status']
     search_fields = ['description']
+    search_index_kind = 'fund_flow'
     ordering_fields = ['amount', 'transaction_date', 'created_at']
     ordering = ['-transaction_date']
     
@@ -78,7 +96,7 @@ class FundFlowDetailView(generics.RetrieveUpdateDestroyAPIView):
 class AnomalyListView(generics.ListCreateAPIView):
     """View for listing and creating anomalies"""
     permission_classes = [permissions.IsAuthenticated]
-    filterset_fields = ['severity', 'resolved', 'detected_by']
+    filterset_fields = ['severity', 'resolved', 'detected_by', 'fund_flow', 'project', 'department', 'spending_record']
     search_fields = ['description', 'resolution_notes']
     ordering_fields = ['severity', 'detected_at', 'resolved_at']
     ordering = ['-detected_at']
@@ -88,10 +106,7 @@ class AnomalyListView(generics.ListCreateAPIView):
         if user.is_admin or user.is_auditor:
             return Anomaly.objects.all()
         else:
-            return Anomaly.objects.filter(
-                Q(fund_flow__target_department__head=user) |
-                Q(fund_flow__target_project__manager=user)
-            )
+            return Anomaly.objects.filter(Anomaly.visible_to(user))
     
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -120,9 +135,9 @@ class AnomalyResolveView(generics.UpdateAPIView):
 
 class TrustIndicatorListView(generics.ListCreateAPIView):
     """View for listing and creating trust indicators"""
-    queryset = TrustIndicator.objects.all()
+    queryset = TrustIndicator.objects.select_related('department')
     permission_classes = [permissions.IsAuthenticated]
-    filterset_fields = ['department']
+    filterset_class = TrustIndicatorFilter
     ordering_fields = ['overall_score', 'calculated_at']
     ordering = ['-calculated_at']
     
@@ -142,81 +157,234 @@ class TrustIndicatorDetailView(generics.RetrieveUpdateDestroyAPIView):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def fund_flow_diagram_view(request):
-    """View for fund flow diagram data"""
-    # Get all fund flows
-    fund_flows = FundFlow.objects.all()
-    
-    # Create nodes for sources
-    sources = FundSource.objects.all()
-    source_nodes = []
-    for source in sources:
-        source_nodes.append({
-            'id': f"source_{source.id}",
-            'name': source.name,
-            'amount': float(source.total_amount),
-            'type': 'source',
-            'status': 'verified',
-            'position': {'x': 100, 'y': 200}
-        })
-    
-    # Create nodes for departments
-    departments = []
-    for flow in fund_flows:
-        if flow.target_department and flow.target_department not in departments:
-            departments.append(flow.target_department)
-    
-    department_nodes = []
-    for i, dept in enumerate(departments):
-        department_nodes.append({
-            'id': f"dept_{dept.id}",
-            'name': dept.name,
-            'amount': float(dept.budget),
-            'type': 'department',
-            'status': 'verified',
-            'position': {'x': 400, 'y': 100 + (i * 150)}
-        })
-    
-    # Create nodes for projects
-    projects = []
-    for flow in fund_flows:
-        if flow.target_project and flow.target_project not in projects:
-            projects.append(flow.target_project)
-    
-    project_nodes = []
-    for i, project in enumerate(projects):
-        project_nodes.append({
-            'id': f"project_{project.id}",
-            'name': project.name,
-            'amount': float(project.budget),
-            'type': 'project',
-            'status': 'verified',
-            'position': {'x': 700, 'y': 100 + (i * 100)}
-        })
+    """
+    View for fund flow diagram data.
+    
+    One link per (source, target) pair with the summed amount, optionally
+    limited to ?start_date= / ?end_date= (YYYY-MM-DD) and to flows into a
+    ?department= or its projects.
+    """
+    filters = {}
+    for name in ('start_date', 'end_date'):
+        value = request.query_params.get(name)
+        if value:
+            try:
+                filters[name] = parse_date(value)
+            except ValueError:
+                filters[name] = None
+            if filters[name] is None:
+                return Response({'error': f'{name} must be a date (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+    department_id = request.query_params.get('department')
+    if department_id:
+        if not department_id.isdigit():
+            return Response({'error': 'department must be an integer id'}, status=status.HTTP_400_BAD_REQUEST)
+        filters['department'] = int(department_id)
+    
+    key = 'diagram:' + ':'.join(f'{name}={value}' for name, value in sorted(filters.items()))
+    diagram = get_or_build(
+        FundFlow.CACHE_NAMESPACE, key,
+        lambda: FundFlowDiagramSerializer(_build_laid_out_diagram(key, filters)).data
+    )
+    return Response(diagram, status=status.HTTP_200_OK)
+
+
+# Most severe first: a link or node takes the worst status among its flows
+DIAGRAM_STATUSES = ['anomaly', 'under_review', 'verified']
+
+# How long a layout's node ordering seeds the next layout of the same
+# filter set; after that the graph gets a full crossing-minimizing pass
+LAYOUT_SEED_TIMEOUT = 60 * 60
+
+
+def _build_laid_out_diagram(key, filters):
+    """The diagram for filters with a Sankey layout seeded by the previous one"""
+    diagram = _build_fund_flow_diagram(**filters)
+    seed_key = f'fund_flow_layout:{key}'
+    now = time.time()
+    seed = cache.get(seed_key)
+    # The seed keeps the time of its full pass, so rebuilds don't extend its life
+    if seed is None or now - seed['created_at'] >= LAYOUT_SEED_TIMEOUT:
+        seed = {'created_at': now, 'columns': None}
+    columns = sankey_layout(diagram['nodes'], diagram['links'], seed=seed['columns'])
+    cache.set(
+        seed_key, {'created_at': seed['created_at'], 'columns': columns},
+        LAYOUT_SEED_TIMEOUT - (now - seed['created_at'])
+    )
+    diagram['nodes'].sort(key=lambda node: (node['position']['x'], node['position']['y']))
+    return diagram
+
+
+def _build_fund_flow_diagram(start_date=None, end_date=None, department=None):
+    """Nodes and summed links for the matching flows in one GROUP BY plus one query per node type"""
+    flows = FundFlow.objects.all()
+    if start_date:
+        flows = flows.filter(transaction_date__gte=start_date)
+    if end_date:
+        flows = flows.filter(transaction_date__lte=end_date)
+    if department:
+        flows = flows.filter(Q(target_department_id=department) | Q(target_project__department_id=department))
+    
+    rows = (
+        flows.order_by()
+        .values('source_id', 'target_department_id', 'target_project_id')
+        .annotate(
+            total=Sum('amount'),
+            count=Count('id'),
+            **{f'{status_name}_total': Sum('amount', filter=Q(status=status_name)) for status_name in DIAGRAM_STATUSES}
+        )
+        .order_by('source_id', 'target_department_id', 'target_project_id')
+    )
     
-    # Create links
     links = []
-    for flow in fund_flows:
-        source_id = f"source_{flow.source.id}"
-        
-        if flow.target_department:
-            target_id = f"dept_{flow.target_department.id}"
+    node_statuses = {}
+    for row in rows:
+        if row['target_department_id']:
+            target_id = f"dept_{row['target_department_id']}"
+        elif row['target_project_id']:
+            target_id = f"project_{row['target_project_id']}"
         else:
-            target_id = f"project_{flow.target_project.id}"
-        
+            continue
+        source_id = f"source_{row['source_id']}"
+        breakdown = {
+            name: float(row[f'{name}_total']) for name in DIAGRAM_STATUSES if row[f'{name}_total'] is not None
+        }
+        link_status = next(name for name in DIAGRAM_STATUSES if name in breakdown)
         links.append({
             'source': source_id,
             'target': target_id,
-            'amount': float(flow.amount),
-            'status': flow.status
+            'amount': row['total'],
+            'count': row['count'],
+            'status': link_status,
+            'status_breakdown': breakdown,
         })
+        for node_id in (source_id, target_id):
+            current = node_statuses.get(node_id, DIAGRAM_STATUSES[-1])
+            node_statuses[node_id] = min(current, link_status, key=DIAGRAM_STATUSES.index)
+    
+    # (type, id prefix, queryset, amount field); positions come from fund_flows.layout
+    node_groups = [
+        ('source', 'source_', FundSource.objects, 'total_amount'),
+        ('department', 'dept_', Department.objects, 'budget'),
+        ('project', 'project_', Project.objects, 'budget'),
+    ]
+    nodes = []
+    for node_type, prefix, manager, amount_field in node_groups:
+        ids = [int(node_id[len(prefix):]) for node_id in node_statuses if node_id.startswith(prefix)]
+        for pk, name, amount in manager.filter(pk__in=ids).values_list('id', 'name', amount_field):
+            node_id = f'{prefix}{pk}'
+            nodes.append({
+                'id': node_id,
+                'name': name,
+                'amount': amount,
+                'type': node_type,
+                'status': node_statuses[node_id],
+            })
     
-    diagram_data = {
-        'nodes': source_nodes + department_nodes + project_nodes,
-        'links': links
+    return {'nodes': nodes, 'links': links}
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def fund_trace_view(request, node_type, pk):
+    """
+    Trace where a source's, department's or project's money ends up.
+    
+    Returns every downstream path (source -> department -> project ->
+    spending record) with the proportional amount reaching its end, and
+    per-node reached and retained totals. ?max_depth= (hops, default 3)
+    and ?max_paths= (default 1000) bound the walk. Nodes and paths outside
+    the user's scope are left out (see _visible_trace_nodes).
+    """
+    if node_type not in ('source', 'department', 'project'):
+        return Response({'error': 'node type must be source, department or project'}, status=status.HTTP_400_BAD_REQUEST)
+    limits = {}
+    for name, default, ceiling in [('max_depth', tracing.DEFAULT_MAX_DEPTH, 3),
+                                   ('max_paths', tracing.DEFAULT_MAX_PATHS, 10000)]:
+        value = request.query_params.get(name, str(default))
+        if not value.isdigit() or not 1 <= int(value) <= ceiling:
+            return Response({'error': f'{name} must be between 1 and {ceiling}'}, status=status.HTTP_400_BAD_REQUEST)
+        limits[name] = int(value)
+    
+    index, result = tracing.trace(node_type, pk, **limits)
+    visible = _visible_trace_nodes(request.user, index, result['reached']) if result else set()
+    if result is None or result['root'] not in visible:
+        return Response({'error': f'{node_type.capitalize()} not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    names = _trace_node_names(index, visible)
+    nodes = [
+        {
+            'id': index.node_id(node),
+            'type': tracing.NODE_TYPES[index.types[node]],
+            'name': names.get(index.node_id(node), ''),
+            'reached': round(amount, 2),
+            'retained': round(result['retained'].get(node, 0.0), 2),
+        }
+        for node, amount in result['reached'].items()
+        if node in visible
+    ]
+    visible_ids = {index.node_id(node) for node in visible}
+    return Response({
+        'root': index.node_id(result['root']),
+        'amount': result['amount'],
+        'nodes': nodes,
+        'paths': [path for path in result['paths'] if visible_ids.issuperset(path['nodes'])],
+        'truncated': result['truncated'],
+    }, status=status.HTTP_200_OK)
+
+
+def _visible_trace_nodes(user, index, nodes):
+    """
+    The traced nodes a user may see, with the scoping of the spending list.
+    
+    Admins and auditors see everything. Others see fund sources, their own
+    department, projects in it or managed by them (and the departments
+    funding those), and those projects' spending records plus any they
+    created.
+    """
+    if user.is_admin or user.is_auditor:
+        return set(nodes)
+    pks = defaultdict(list)
+    for node in nodes:
+        pks[index.types[node]].append(index.pks[node])
+    
+    projects = Q(manager=user)
+    if user.department_id:
+        projects |= Q(department_id=user.department_id)
+    visible_projects = dict(
+        Project.objects.filter(projects, pk__in=pks[tracing.PROJECT]).values_list('id', 'department_id')
+    ) if pks[tracing.PROJECT] else {}
+    allowed = {
+        tracing.SOURCE: set(pks[tracing.SOURCE]),
+        tracing.DEPARTMENT: {user.department_id, *visible_projects.values()} & set(pks[tracing.DEPARTMENT]),
+        tracing.PROJECT: set(visible_projects),
+        tracing.SPENDING: set(
+            ProjectSpending.objects.filter(
+                Q(project__in=Project.objects.filter(projects)) | Q(created_by=user),
+                pk__in=pks[tracing.SPENDING],
+            ).values_list('id', flat=True)
+        ) if pks[tracing.SPENDING] else set(),
     }
+    return {node for node in nodes if index.pks[node] in allowed[index.types[node]]}
+
+
+def _trace_node_names(index, nodes):
+    """Display names for traced nodes, one query per node type"""
+    pks = defaultdict(list)
+    for node in nodes:
+        pks[index.types[node]].append(index.pks[node])
     
-    serializer = FundFlowDiagramSerializer(diagram_data)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    labelled = [
+        (tracing.SOURCE, FundSource.objects.values_list('id', 'name')),
+        (tracing.DEPARTMENT, Department.objects.values_list('id', 'name')),
+        (tracing.PROJECT, Project.objects.values_list('id', 'name')),
+        (tracing.SPENDING, ProjectSpending.objects.values_list('id', 'description')),
+    ]
+    names = {}
+    for node_type, queryset in labelled:
+        if pks[node_type]:
+            prefix = tracing.NODE_PREFIXES[tracing.NODE_TYPES[node_type]]
+            names.update((f'{prefix}{pk}', name) for pk, name in queryset.filter(pk__in=pks[node_type]))
+    return names
 
 
 @api_view(['GET'])
@@ -229,13 +397,9 @@ def anomalies_count_view(request):
         total_anomalies = Anomaly.objects.count()
         unresolved_anomalies = Anomaly.objects.filter(resolved=False).count()
     else:
-        total_anomalies = Anomaly.objects.filter(
-            Q(fund_flow__target_department__head=user) |
-            Q(fund_flow__target_project__manager=user)
-        ).count()
+        total_anomalies = Anomaly.objects.filter(Anomaly.visible_to(user)).count()
         unresolved_anomalies = Anomaly.objects.filter(
-            Q(fund_flow__target_department__head=user) |
-            Q(fund_flow__target_project__manager=user),
+            Anomaly.visible_to(user),
             resolved=False
         ).count()
     
@@ -249,29 +413,99 @@ def anomalies_count_view(request):
 @permission_classes([permissions.IsAuthenticated])
 def trust_indicators_summary_view(request):
     """View for trust indicators summary"""
-    # Get latest trust indicators for each department
-    departments = []
-    for dept in Department.objects.all():
-        latest_indicator = TrustIndicator.objects.filter(
-            department=dept
-        ).order_by('-calculated_at').first()
-        
-        if latest_indicator:
-            departments.append({
-                'department_id': dept.id,
-                'department_name': dept.name,
-                'transparency_score': latest_indicator.transparency_score,
-                'community_oversight_score': latest_indicator.community_oversight_score,
-                'response_time_score': latest_indicator.response_time_score,
-                'document_completeness_score': latest_indicator.document_completeness_score,
-                'overall_score': latest_indicator.overall_score,
-                'calculated_at': latest_indicator.calculated_at
-            })
-    
-    # Sort by overall score
-    departments.sort(key=lambda x: x['overall_score'], reverse=True)
-    
-    return Response(departments, status=status.HTTP_200_OK)
+    return Response(
+        get_or_build(TrustIndicator.CACHE_NAMESPACE, 'summary', _build_trust_summary),
+        status=status.HTTP_200_OK
+    )
+
+
+def _build_trust_summary():
+    """Latest indicator of each department, best score first, in one query"""
+    rows = (
+        TrustIndicator.objects.latest_per_department()
+        .order_by('-overall_score', 'department__name')
+        .values(
+            'department_id', 'department__name', 'transparency_score',
+            'community_oversight_score', 'response_time_score',
+            'document_completeness_score', 'overall_score', 'calculated_at'
+        )
+    )
+    return [
+        {
+            'department_id': row['department_id'],
+            'department_name': row['department__name'],
+            'transparency_score': row['transparency_score'],
+            'community_oversight_score': row['community_oversight_score'],
+            'response_time_score': row['response_time_score'],
+            'document_completeness_score': row['document_completeness_score'],
+            'overall_score': row['overall_score'],
+            'calculated_at': row['calculated_at']
+        }
+        for row in rows
+    ]
+
+
+TREND_INTERVALS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def trust_indicators_trend_view(request):
+    """View for trust score history averaged into day, week or month buckets"""
+    interval = request.query_params.get('interval', 'week')
+    if interval not in TREND_INTERVALS:
+        return Response({
+            'error': f'interval must be one of: {", ".join(TREND_INTERVALS)}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    indicators = TrustIndicator.objects.all()
+    department_id = request.query_params.get('department')
+    if department_id:
+        if not department_id.isdigit():
+            return Response({'error': 'department must be an integer id'}, status=status.HTTP_400_BAD_REQUEST)
+        indicators = indicators.filter(department_id=department_id)
+    since = request.query_params.get('since')
+    if since:
+        try:
+            indicators = indicators.filter(calculated_at__date__gte=since)
+        except ValidationError:
+            return Response({'error': 'since must be a date (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    buckets = (
+        indicators.order_by()
+        .annotate(period=TREND_INTERVALS[interval]('calculated_at'))
+        .values('department_id', 'department__name', 'period')
+        .annotate(
+            transparency_score=Avg('transparency_score'),
+            community_oversight_score=Avg('community_oversight_score'),
+            response_time_score=Avg('response_time_score'),
+            document_completeness_score=Avg('document_completeness_score'),
+            overall_score=Avg('overall_score'),
+            samples=Count('id'),
+        )
+        .order_by('department__name', 'period')
+    )
+    
+    score_fields = [
+        'transparency_score', 'community_oversight_score', 'response_time_score',
+        'document_completeness_score', 'overall_score',
+    ]
+    results = []
+    for bucket in buckets:
+        entry = {
+            'department_id': bucket['department_id'],
+            'department_name': bucket['department__name'],
+            'period': bucket['period'],
+            'samples': bucket['samples'],
+        }
+        entry.update({field: round(bucket[field], 1) for field in score_fields})
+        results.append(entry)
+    
+    return Response({'interval': interval, 'results': results}, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
@@ -321,10 +555,14 @@ def flag_anomaly_view(request, flow_id):
         return Response({'error': 'Fund flow not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+MAX_SEARCH_PAGE_SIZE = 200
+EXPORT_CHUNK_SIZE = 1000
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def search_transactions_view(request):
-    """View for searching transactions with advanced filters"""
+    """View for searching transactions with advanced filters, a page at a time or streamed as NDJSON"""
     query = request.GET.get('q', '')
     filters = {
         'department_id': request.GET.get('department_id'),
@@ -377,15 +615,52 @@ def search_transactions_view(request):
                 Q(target_department__head=user)
             )
     
+    if request.GET.get('export') == 'ndjson':
+        return _stream_transactions(transactions)
+    
+    try:
+        page_size = int(request.GET.get('page_size', settings.REST_FRAMEWORK['PAGE_SIZE']))
+    except ValueError:
+        page_size = 0
+    if not 1 <= page_size <= MAX_SEARCH_PAGE_SIZE:
+        return Response(
+            {'error': f'page_size must be between 1 and {MAX_SEARCH_PAGE_SIZE}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        page, next_cursor = keyset_page(
+            transactions, SearchService.TRANSACTION_ORDERING, request.GET.get('cursor'), page_size
+        )
+    except InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+    
     # Serialize results
-    serializer = FundFlowListSerializer(transactions, many=True)
+    serializer = FundFlowListSerializer(page, many=True)
     
-    return Response({
+    data = {
         'results': serializer.data,
-        'count': transactions.count(),
+        'next_cursor': next_cursor,
+        'page_size': page_size,
         'query': query,
         'filters': filters
-    }, status=status.HTTP_200_OK)
+    }
+    # Counting every match costs as much as reading them all, so it is opt-in
+    if request.GET.get('include_count') == 'true':
+        data['count'] = transactions.count()
+    return Response(data, status=status.HTTP_200_OK)
+
+
+def _stream_transactions(transactions):
+    """Every matching transaction as newline-delimited JSON, read in keyset chunks"""
+    def lines():
+        for chunk in keyset_chunks(transactions, SearchService.TRANSACTION_ORDERING, EXPORT_CHUNK_SIZE):
+            for row in FundFlowListSerializer(chunk, many=True).data:
+                yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+    
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="transactions.ndjson"'
+    return response
 
 
 @api_view(['GET'])
@@ -439,4 +714,44 @@ def search_projects_view(request):
         'count': projects.count(),
         'query': query,
         'filters': filters
-    }, status=status.HTTP_200_OK)
\ No newline at end of file
+    }, status=status.HTTP_200_OK)
+
+
+MAX_SEARCH_LIMIT = 100
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def full_text_search_view(request):
+    """Ranked full-text hits with highlighted snippets across fund flows, projects, documents and feedback"""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    kinds = request.GET.getlist('kind') or list(SEARCH_SOURCES)
+    unknown = [kind for kind in kinds if kind not in SEARCH_SOURCES]
+    if unknown:
+        return Response(
+            {'error': f'Unknown kind "{unknown[0]}". Use one of: {", ".join(SEARCH_SOURCES)}.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        limit = int(request.GET.get('limit', 20))
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        return Response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= limit <= MAX_SEARCH_LIMIT or offset < 0:
+        return Response(
+            {'error': f'limit must be between 1 and {MAX_SEARCH_LIMIT} and offset at least 0'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    results = SearchIndex.search_for(request.user, query, kinds, limit=limit, offset=offset)
+    return Response({
+        'query': query,
+        'kinds': kinds,
+        'results': results,
+        'limit': limit,
+        'offset': offset,
+    }, status=status.HTTP_200_OK)
@@ -160,7 +160,6 @@ def create_sample_data():
             'community_oversight_score': 78,
             'response_time_score': 90,
             'document_completeness_score': 82,
-            'overall_score': 84
         }
     )
     
@@ -171,7 +170,6 @@ def create_sample_data():
             'community_oversight_score': 85,
             'response_time_score': 87,
             'document_completeness_score': 90,
-            'overall_score': 88
         }
     )
     